@@ -2,13 +2,14 @@
 认证依赖项
 """
 from typing import Optional, List
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 
 from ..models import AdminUser, AdminRole
 from .utils import get_user_from_token, check_user_permissions, check_account_lockout
 from ...database import get_db
+from ...core.rate_limit import RateLimitPolicy, rate_limiter
 
 # HTTP Bearer认证
 security = HTTPBearer()
@@ -183,58 +184,28 @@ def check_api_access(
     )
 
 
-class RateLimiter:
-    """简单的速率限制器"""
-    def __init__(self, max_requests: int = 100, window_seconds: int = 3600):
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.requests = {}
-    
-    def is_allowed(self, identifier: str) -> bool:
-        """检查是否允许请求"""
-        import time
-        
-        now = time.time()
-        window_start = now - self.window_seconds
-        
-        # 清理过期记录
-        if identifier in self.requests:
-            self.requests[identifier] = [
-                req_time for req_time in self.requests[identifier]
-                if req_time > window_start
-            ]
-        else:
-            self.requests[identifier] = []
-        
-        # 检查请求数量
-        if len(self.requests[identifier]) >= self.max_requests:
-            return False
-        
-        # 记录当前请求
-        self.requests[identifier].append(now)
-        return True
-
-
-# 全局速率限制器实例
-rate_limiter = RateLimiter()
+# 管理接口频率限制：每个用户或客户端每小时最多100次
+ADMIN_RATE_LIMIT_POLICY = RateLimitPolicy(name="admin", limit=100, window=3600)
 
 
 def check_rate_limit(identifier: str = None):
     """速率限制检查"""
-    def rate_limit_checker(
-        request,
+    async def rate_limit_checker(
+        request: Request,
         current_user: Optional[AdminUser] = Depends(get_optional_user)
     ):
         # 使用用户ID或IP地址作为标识符
         if current_user:
             limit_id = f"user_{current_user.id}"
         else:
-            limit_id = identifier or request.client.host
+            limit_id = identifier or (request.client.host if request.client else "unknown")
         
-        if not rate_limiter.is_allowed(limit_id):
+        result = await rate_limiter.check(ADMIN_RATE_LIMIT_POLICY, limit_id)
+        if not result.allowed:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded"
+                detail="Rate limit exceeded",
+                headers={"Retry-After": result.retry_after_header}
             )
         
         return True
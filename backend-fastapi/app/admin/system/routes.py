@@ -2,7 +2,7 @@
 系统管理API路由
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 
@@ -21,6 +21,7 @@ class DatabaseFileSwitchRequest(BaseModel):
     city_db_key: str = None     # 城市数据库文件key
     asn_db_key: str = None      # ASN数据库文件key
     country_db_key: str = None  # 国家数据库文件key
+    snapshot_db_key: str = None # 合并快照文件key
 
 
 class DatabaseFileSwitchResponse(BaseModel):
@@ -36,12 +37,14 @@ class DatabaseInfoResponse(BaseModel):
     current_databases: Dict[str, str]
     available_databases: Dict[str, Any]
     database_status: Dict[str, bool]
+    reader_set: Optional[Dict[str, Any]] = None
     database_files: Dict[str, list]
 
 
 class SystemStatsResponse(BaseModel):
     """系统统计响应"""
     geoip_stats: Dict[str, Any]
+    stage_timings: Optional[Dict[str, Any]] = None
     database_info: Dict[str, Any]
     concurrent_limit: int
 
@@ -88,7 +91,8 @@ async def switch_database_files(
         result = await geoip_service.switch_database_file(
             city_db_key=request.city_db_key,
             asn_db_key=request.asn_db_key,
-            country_db_key=request.country_db_key
+            country_db_key=request.country_db_key,
+            snapshot_db_key=request.snapshot_db_key
         )
 
         if result["success"]:
@@ -99,6 +103,8 @@ async def switch_database_files(
                 changes_desc.append(f"ASN数据库: {request.asn_db_key}")
             if request.country_db_key:
                 changes_desc.append(f"国家数据库: {request.country_db_key}")
+            if request.snapshot_db_key:
+                changes_desc.append(f"合并快照: {request.snapshot_db_key}")
 
             logger.info(f"管理员 {current_user.username} 切换数据库文件: {', '.join(changes_desc)}")
             return DatabaseFileSwitchResponse(**result)
@@ -15,6 +15,10 @@ from app.models.schemas import (
 )
 from app.services.geoip_service import geoip_service
 from app.services.cache_service import cache_service
+from app.services.cache_warmup import cache_warmer
+from app.services.stream_lookup import (
+    STREAM_MEDIA_TYPES, DuplexStreamingResponse, iter_request_ips, stream_lookup
+)
 from app.config import settings
 
 logger = get_logger(__name__)
@@ -54,6 +58,23 @@ async def health_check():
     )
 
 
+@api_router.get("/ready", response_model=Dict[str, Any], tags=["系统"])
+async def readiness_check():
+    """就绪检查接口
+
+    数据库读取器已加载且启动时的缓存预热已结束时返回200，否则返回503。
+    """
+    checks = {
+        "geoip": geoip_service.readers.has_readers,
+        "cache_warmup": cache_warmer.ready
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "checks": checks, "timestamp": time.time()}
+    )
+
+
 @api_router.get("/query", response_model=IPQueryResponse, tags=["查询"])
 async def query_single_ip(
     ip: str = Query(..., description="要查询的IP地址", example="8.8.8.8"),
@@ -75,31 +96,13 @@ async def query_single_ip(
         ip_request = IPQueryRequest(ip=ip)
         clean_ip = ip_request.ip
         
-        # 尝试从缓存获取结果
-        cached_result = await cache_service.get_cached_result(clean_ip)
-        if cached_result:
-            logger.info(f"返回缓存结果: {clean_ip}")
-            
-            # 记录响应
-            response_time = time.time() - start_time
-            request_logger.log_response(
-                method=request.method,
-                path=request.url.path,
-                status_code=200,
-                response_time=response_time
-            )
-            performance_monitor.record_request(response_time, True)
-            
-            return IPQueryResponse(success=True, data=cached_result)
-        
-        # 查询IP信息
-        result = await geoip_service.query_ip(clean_ip)
+        # 优先返回缓存结果，未命中时查询并写入缓存（并发的相同查询只执行一次）
+        result = await cache_service.get_or_load(clean_ip, geoip_service.query_ip)
         
-        # 缓存结果
-        if not result.error:
-            await cache_service.cache_result(result)
-        
-        logger.info(f"查询完成: {clean_ip}")
+        if result.cached:
+            logger.info(f"返回缓存结果: {clean_ip}")
+        else:
+            logger.info(f"查询完成: {clean_ip}")
         
         # 记录响应
         response_time = time.time() - start_time
@@ -148,20 +151,9 @@ async def query_batch_ips(
         
         logger.info(f"验证通过，共{len(valid_ips)}个有效IP，开始批量查询")
         
-        # 先尝试从缓存获取结果（优化：并发检查缓存）
-        import asyncio
-        cache_tasks = [cache_service.get_cached_result(ip) for ip in valid_ips]
-        cache_results = await asyncio.gather(*cache_tasks, return_exceptions=True)
-
-        cached_results = []
-        uncached_ips = []
-
-        for ip, cached_result in zip(valid_ips, cache_results):
-            if cached_result and not isinstance(cached_result, Exception):
-                cached_results.append(cached_result)
-            else:
-                uncached_ips.append(ip)
-        
+        # 先从缓存批量获取结果（一次Redis往返）
+        cached_results, uncached_ips = await cache_service.get_cached_results(valid_ips)
+
         # 查询未缓存的IP
         uncached_results = []
         if uncached_ips:
@@ -173,8 +165,9 @@ async def query_batch_ips(
             # 缓存新查询的结果
             await cache_service.cache_batch_results(uncached_results)
         
-        # 合并结果
-        all_results = cached_results + uncached_results
+        # 按请求顺序合并结果
+        results_by_ip = {**cached_results, **{result.ip: result for result in uncached_results}}
+        all_results = [results_by_ip[ip] for ip in valid_ips]
         success_count = len([r for r in all_results if not r.error])
         
         logger.info(f"批量查询完成，成功{success_count}个，缓存命中{len(cached_results)}个")
@@ -208,6 +201,59 @@ async def query_batch_ips(
         raise GeoIPException("批量查询服务暂时不可用")
 
 
+@api_router.post("/batch-query/stream", tags=["查询"])
+async def stream_batch_ips(
+    request: Request,
+    format: str = Query("ndjson", description="输出格式: ndjson 或 csv"),
+    window_size: int = Query(None, ge=1, le=100000, description="每个查询窗口的IP数量"),
+    progress: bool = Query(True, description="是否附带进度和汇总记录"),
+    start_time: float = Depends(log_request_middleware)
+):
+    """流式批量IP查询接口
+
+    请求体为每行一个IP的纯文本或CSV（首行含ip列名时取该列，否则取第一列），支持分块上传。
+    服务端按窗口读取、查询并立即写回结果，不受批量查询100个IP的限制。
+
+    - **format**: ndjson时每行一个查询结果；csv时输出平铺列
+    - **window_size**: 每个窗口的IP数量（默认取配置）
+    - **progress**: 每个窗口后附带进度记录，结束时附带汇总记录
+      （NDJSON中为progress/summary对象行，CSV中为#开头的注释行）
+
+    响应开始后出错时以error记录结束输出。
+    """
+    if format not in STREAM_MEDIA_TYPES:
+        raise ValidationException(f"不支持的输出格式: {format}，可选值: {', '.join(STREAM_MEDIA_TYPES)}")
+
+    window = window_size or settings.stream_window_size
+    logger.info(f"收到流式批量查询请求，格式{format}，窗口{window}")
+
+    ips = iter_request_ips(
+        request.stream(),
+        max_line_length=settings.stream_max_line_length,
+        max_ips=settings.stream_max_ips
+    )
+
+    async def body():
+        try:
+            async for data in stream_lookup(ips, output_format=format, window_size=window, progress=progress):
+                yield data
+        finally:
+            response_time = time.time() - start_time
+            request_logger.log_response(
+                method=request.method,
+                path=request.url.path,
+                status_code=200,
+                response_time=response_time
+            )
+            performance_monitor.record_request(response_time, True)
+
+    return DuplexStreamingResponse(
+        body(),
+        media_type=STREAM_MEDIA_TYPES[format],
+        headers={"X-Stream-Window-Size": str(window)}
+    )
+
+
 # 向后兼容的重定向端点
 @api_router.get("/query-ip", response_model=IPQueryResponse, tags=["查询"], deprecated=True)
 async def query_single_ip_legacy(
@@ -293,7 +339,7 @@ async def get_cache_stats():
 async def clear_cache():
     """清空缓存
 
-    清空Redis缓存中的所有数据，用于缓存重置或故障排除。
+    清空Redis中的所有查询结果缓存（ip_query:*），用于缓存重置或故障排除；同库的频率限制状态不受影响。
     """
     try:
         success = await cache_service.clear_cache()
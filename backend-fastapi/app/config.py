@@ -3,7 +3,7 @@
 使用Pydantic Settings进行配置管理
 """
 import secrets
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -20,6 +20,14 @@ class Settings(BaseSettings):
     # 日志配置
     log_level: str = Field(default="INFO", description="日志级别")
     log_format: str = Field(default="json", description="日志格式")
+    log_queue_enabled: bool = Field(default=True, description="日志经有界队列交给后台线程渲染和批量写入，调用方只需入队")
+    log_queue_size: int = Field(default=10000, description="日志队列容量（队列已满时丢弃新日志并计数）")
+    log_batch_size: int = Field(default=256, description="后台线程每次合并写入的最大日志条数")
+    log_flush_interval: float = Field(default=0.1, description="后台线程检查日志队列的间隔(秒)")
+    log_sample_rates: Dict[str, float] = Field(
+        default={},
+        description="INFO及以下日志的抽样比例，按事件名或日志记录器名配置，如 {\"performance\": 0.1}"
+    )
     
     # Redis配置
     redis_host: str = Field(default="localhost", description="Redis主机")
@@ -27,10 +35,47 @@ class Settings(BaseSettings):
     redis_db: int = Field(default=0, description="Redis数据库")
     redis_password: Optional[str] = Field(default=None, description="Redis密码")
     redis_enabled: bool = Field(default=True, description="启用Redis缓存")
+    redis_max_connections: int = Field(default=50, description="共享Redis连接池的最大连接数")
+    redis_socket_timeout: float = Field(default=5.0, description="Redis命令超时时间(秒)")
+    redis_socket_connect_timeout: float = Field(default=5.0, description="Redis连接超时时间(秒)")
+    redis_health_check_interval: int = Field(default=30, description="连接空闲超过该时间(秒)后使用前先PING检查，0为关闭")
     
     # 缓存配置
     cache_ttl: int = Field(default=3600, description="缓存过期时间(秒)")
     cache_max_size: int = Field(default=10000, description="缓存最大条目数")
+    cache_mget_chunk_size: int = Field(default=500, description="批量读取缓存时每条MGET命令的最大键数")
+    cache_serializer: str = Field(default="tuple", description="缓存值序列化方式: tuple(定长字段元组) 或 json(旧格式)")
+    cache_compression: str = Field(default="zlib", description="tuple序列化的压缩方式: zlib(预置字典) 或 none")
+    cache_key_mode: str = Field(default="ip", description="Redis缓存键粒度: ip(按IP) 或 prefix(按GeoIP数据库返回的网段)")
+    cache_ipv6_max_prefix: int = Field(default=64, description="网段键模式下IPv6按网段缓存的最长前缀，更长的前缀按单个IP缓存")
+    cache_key_index_enabled: bool = Field(default=False, description="写入缓存时登记键索引（管理端统计和按模式失效无需遍历键空间，Redis占用约增加一倍）")
+    cache_warmup_on_startup: bool = Field(default=False, description="启动时从查询记录预热Redis缓存")
+    cache_warmup_limit: int = Field(default=10000, description="启动预热选取的IP数量")
+    cache_warmup_days: int = Field(default=7, description="启动预热统计最近多少天的查询记录")
+    cache_warmup_batch_size: int = Field(default=1000, description="预热时每批查询并写入的IP数量")
+    cache_warmup_rate: int = Field(default=5000, description="预热写入速率上限(IP/秒，0为不限制)")
+    cache_warmup_ready_timeout: int = Field(default=300, description="启动预热未完成时就绪检查最长等待时间(秒)")
+    cache_l1_max_size: int = Field(default=10000, description="进程内L1缓存最大条目数(0为禁用)")
+    cache_l1_ttl: int = Field(default=60, description="L1缓存过期时间(秒)")
+    cache_l1_ttl_jitter: float = Field(default=0.1, description="L1过期时间随机抖动比例")
+    cache_stale_ttl: int = Field(default=60, description="缓存过期后仍可返回旧值并后台刷新的宽限期(秒，0为禁用)")
+    cache_single_flight_enabled: bool = Field(default=True, description="合并同一IP的并发未命中查询")
+    cache_lock_enabled: bool = Field(default=False, description="使用Redis锁在多个worker间合并同一IP的查询")
+    cache_lock_timeout: float = Field(default=5.0, description="查询锁过期时间及最长等待时间(秒)")
+    cache_lock_poll_interval: float = Field(default=0.05, description="等待其他worker查询结果的轮询间隔(秒)")
+    cache_negative_ttl: int = Field(default=300, description="不在任何数据库中的地址的缓存时间(秒，0为与普通结果相同)")
+    cache_bogon_enabled: bool = Field(default=True, description="私有、回环等保留地址直接由区间表应答")
+    cache_policy_enabled: bool = Field(default=True, description="按IP访问频率决定是否写入Redis及TTL（关闭时全部写入并使用cache_ttl）")
+    cache_admission_min_frequency: int = Field(default=2, description="写入Redis所需的最低近期访问次数(1-15)")
+    cache_admission_sketch_width: int = Field(default=65536, description="访问频率估计（count-min sketch）每行的计数器数")
+    cache_ttl_min: int = Field(default=300, description="刚达到准入阈值的IP的缓存时间(秒)")
+    cache_ttl_max: int = Field(default=86400, description="访问频率最高的IP的缓存时间(秒)")
+    cache_database_update_interval: int = Field(default=604800, description="GeoIP数据库的更新周期(秒)，缓存TTL不超过构建时间加该周期，0为不限制")
+
+    # GeoIP进程内前缀缓存配置
+    geoip_cache_enabled: bool = Field(default=True, description="启用GeoIP进程内前缀缓存")
+    geoip_cache_max_size: int = Field(default=50000, description="GeoIP前缀缓存最大条目数")
+    geoip_cache_ttl: int = Field(default=3600, description="GeoIP前缀缓存过期时间(秒)")
     
     # GeoIP配置
     geoip_db_path: str = Field(
@@ -41,10 +86,34 @@ class Settings(BaseSettings):
         default="../GeoLite2-ASN.mmdb",
         description="GeoIP ASN数据库路径"
     )
+    geoip_isp_ranges_file: str = Field(
+        default="./data/isp_ranges.json",
+        description="ISP推断区间覆盖文件路径(JSON数组，元素包含network/isp/organization)"
+    )
     geoip_update_interval: int = Field(
         default=86400,
         description="GeoIP数据库更新间隔(秒)"
     )
+    geoip_snapshot_path: str = Field(
+        default="API/GeoLite2-Merged.snapshot",
+        description="合并列式快照文件路径(由scripts/build_geoip_snapshot.py生成)"
+    )
+    geoip_prefer_snapshot: bool = Field(default=False, description="存在合并快照时默认使用快照")
+    geoip_reader_mode: str = Field(
+        default="auto",
+        description="GeoIP读取器模式: auto/mmap_ext/mmap/file/memory，mmap类模式在worker进程间共享页缓存"
+    )
+    geoip_require_shared_pages: bool = Field(
+        default=False,
+        description="要求数据库以共享内存映射模式加载，否则拒绝启动"
+    )
+    geoip_auto_reload: bool = Field(default=True, description="数据库文件变化时自动热加载")
+    geoip_reload_check_interval: int = Field(default=60, description="数据库文件变化检查间隔(秒)")
+    geoip_executor_mode: str = Field(
+        default="thread",
+        description="查询执行方式: thread(线程池), process(进程池，批量查询绕开GIL), inline(事件循环内直接执行)"
+    )
+    geoip_process_workers: int = Field(default=0, description="进程池worker数量（0为CPU核数）")
 
     # 数据库切换配置
     current_geoip_source: str = Field(
@@ -82,9 +151,36 @@ class Settings(BaseSettings):
     
     # 性能配置
     max_batch_size: int = Field(default=100, description="最大批量查询数量")
+    stream_window_size: int = Field(default=1000, description="流式批量查询每个窗口的IP数量")
+    stream_max_ips: int = Field(default=10000000, description="单次流式批量查询的最大IP数量（0为不限制）")
+    stream_max_line_length: int = Field(default=1024, description="流式批量查询上传内容的最大行长度(字节)")
+
+    # 批量查询任务配置
+    jobs_enabled: bool = Field(default=True, description="启用批量查询任务")
+    jobs_dir: str = Field(default="./data/jobs", description="批量查询任务输入和结果文件目录")
+    jobs_max_workers: int = Field(default=2, description="批量查询任务进程池大小")
+    jobs_max_concurrent: int = Field(default=1, description="每个服务进程同时执行的任务数")
+    jobs_shard_size: int = Field(default=100000, description="每个结果分片包含的IP数量")
+    jobs_batch_size: int = Field(default=1000, description="worker每次查询的IP数量")
+    jobs_max_ips: int = Field(default=50000000, description="单个任务的最大IP数量（0为不限制）")
+    jobs_poll_interval: int = Field(default=5, description="任务认领和心跳间隔(秒)")
+    jobs_stale_timeout: int = Field(default=60, description="心跳超时后运行中的任务可被其他进程接管(秒)")
+    jobs_max_per_user: int = Field(default=20, description="每个用户最多保留的任务数（0为不限制）")
+    jobs_max_disk_mb_per_user: int = Field(default=2048, description="每个用户任务输入和结果文件的磁盘配额(MB，0为不限制)")
     concurrent_limit: int = Field(default=50, description="并发限制")
     request_timeout: int = Field(default=30, description="请求超时时间(秒)")
     
+    # 频率限制配置
+    rate_limit_enabled: bool = Field(default=True, description="启用频率限制")
+    rate_limit_use_redis: bool = Field(default=True, description="在Redis中计数，所有worker共享限额（需启用Redis，不可用时退回进程内令牌桶）")
+    rate_limit_redis_timeout: float = Field(default=0.1, description="Redis频率限制检查的超时时间(秒)，超时后改用进程内令牌桶")
+    rate_limit_local_max_keys: int = Field(default=100000, description="进程内令牌桶最多保存的键数量（超出时淘汰最久未使用的键）")
+    rate_limit_sweep_interval: int = Field(default=60, description="进程内令牌桶清理已补满条目的间隔(秒)，0为不清理")
+    rate_limit_route_policies: Dict[str, str] = Field(
+        default={},
+        description="按路径前缀覆盖全局频率限制，值为“次数/秒数”或“次数/秒数/封禁秒数”"
+    )
+    
     # 监控配置
     enable_metrics: bool = Field(default=True, description="启用指标收集")
     metrics_path: str = Field(default="/metrics", description="指标路径")
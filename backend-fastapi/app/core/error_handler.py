@@ -7,8 +7,8 @@ import traceback
 from typing import Dict, Any, Optional
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from ..config import settings
 from .security_audit import log_security_event, SecurityEventType, SecurityLevel
@@ -18,11 +18,11 @@ from .security_audit import log_security_event, SecurityEventType, SecurityLevel
 logger = logging.getLogger(__name__)
 
 
-class SecurityErrorHandler(BaseHTTPMiddleware):
-    """安全错误处理中间件"""
+class SecurityErrorHandler:
+    """安全错误处理中间件（纯ASGI实现）"""
     
-    def __init__(self, app, debug: bool = False):
-        super().__init__(app)
+    def __init__(self, app: Optional[ASGIApp], debug: bool = False):
+        self.app = app
         self.debug = debug or settings.debug
         
         # 敏感信息模式
@@ -45,17 +45,35 @@ class SecurityErrorHandler(BaseHTTPMiddleware):
             r'stack.*trace'
         ]
     
-    async def dispatch(self, request: Request, call_next) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """处理请求和错误响应"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
         try:
-            response = await call_next(request)
-            return response
+            await self.app(scope, receive, send_wrapper)
             
         except HTTPException as exc:
-            return await self._handle_http_exception(request, exc)
+            # 响应头已发出时无法再返回错误响应
+            if response_started:
+                raise
+            response = await self._handle_http_exception(Request(scope), exc)
+            await response(scope, receive, send)
             
         except Exception as exc:
-            return await self._handle_general_exception(request, exc)
+            if response_started:
+                raise
+            response = await self._handle_general_exception(Request(scope), exc)
+            await response(scope, receive, send)
     
     async def _handle_http_exception(self, request: Request, exc: HTTPException) -> JSONResponse:
         """处理HTTP异常"""
@@ -0,0 +1,300 @@
+"""
+非阻塞日志管道
+structlog事件在调用线程中只经过级别过滤、抽样和几个添加字段的处理器，随后以
+(时间, 方法名, 事件字典) 放入有界队列，不创建LogRecord、不查找调用栈；JSON/控制台渲染和写入
+都在后台线程中进行，写入线程定期取出一批记录合并成一次写入。其他库通过标准库logging输出的日志
+同样入队。队列已满时丢弃新记录并计数，不阻塞事件循环。
+structlog事件不经过标准库logging，级别过滤按同名的标准库Logger判断，
+logging.disable()和按记录器设置的级别对两者同样生效。
+"""
+import copy
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Any, TextIO
+
+import structlog
+
+# 抽样只作用于这些级别，WARNING及以上的日志全部保留
+SAMPLED_METHODS = frozenset({"debug", "info"})
+
+# structlog方法名对应的标准库日志级别
+METHOD_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+    "exception": logging.ERROR,
+    "critical": logging.CRITICAL,
+    "fatal": logging.CRITICAL,
+}
+
+
+def filter_by_stdlib_level(logger: Any, method_name: str, event_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """structlog处理器：按同名标准库Logger的isEnabledFor过滤事件
+
+    与structlog.stdlib.filter_by_level不同，isEnabledFor同时考虑logging.disable()；
+    其结果由标准库按记录器缓存，判断开销很小。应放在处理器链的最前面。
+    """
+    stdlib_logger = getattr(logger, "stdlib_logger", None)
+    if stdlib_logger is None or stdlib_logger.isEnabledFor(METHOD_LEVELS.get(method_name, logging.INFO)):
+        return event_dict
+    raise structlog.DropEvent
+
+
+class EventSampler:
+    """structlog处理器：按抽样比例丢弃日志事件
+
+    比例先按事件名（如“请求完成”）查找，再按日志记录器名（如request、performance）查找，
+    未配置的事件全部保留。应放在处理器链的最前面，被丢弃的事件不再经过后续处理器。
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        self.rates = {key: min(1.0, max(0.0, float(rate))) for key, rate in (rates or {}).items()}
+        self.sampled_out: Dict[str, int] = {}
+
+    def __call__(self, logger: Any, method_name: str, event_dict: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.rates or method_name not in SAMPLED_METHODS:
+            return event_dict
+
+        key = event_dict.get("event")
+        rate = self.rates.get(key)
+        if rate is None:
+            key = getattr(logger, "name", None)
+            rate = self.rates.get(key)
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return event_dict
+
+        self.sampled_out[key] = self.sampled_out.get(key, 0) + 1
+        raise structlog.DropEvent
+
+
+class BoundedQueueHandler(logging.Handler):
+    """只负责入队的日志处理器（调用线程中只合并消息参数，格式化和写入在写入线程中进行）
+
+    队列为deque，append和popleft本身是线程安全的，入队不加锁也不唤醒写入线程，
+    写入线程按flush_interval轮询。
+    """
+
+    # 入队前展开异常信息使用的格式化器
+    exc_formatter = logging.Formatter()
+
+    def __init__(self, maxsize: int = 10000):
+        super().__init__()
+        self.maxsize = max(1, maxsize)
+        self.queue: Deque[Any] = deque()
+        self.enqueued = 0
+        self.dropped = 0
+
+    def put(self, item: Any) -> None:
+        """放入队列，队列已满时丢弃"""
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.append(item)
+        self.enqueued += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """入队前合并消息参数并展开异常（与QueueHandler.prepare相同）
+
+        参数可能是之后会被修改的可变对象，异常对象引用的调用帧也不应留到写入线程，
+        因此在调用线程中得到最终消息；复制记录，不影响其他处理器。
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """标准库日志记录合并参数后入队"""
+        try:
+            self.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class BatchLogWriter(threading.Thread):
+    """后台写入线程：成批取出记录，格式化后合并为一次写入"""
+
+    def __init__(
+        self,
+        handler: BoundedQueueHandler,
+        format_item: Callable[[Any], str],
+        stream: TextIO,
+        batch_size: int = 256,
+        flush_interval: float = 0.1
+    ):
+        super().__init__(name="log-writer", daemon=True)
+        self.handler = handler
+        self.format_item = format_item
+        self.stream = stream
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.001, flush_interval)
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self._reported_drops = 0
+        self._stopping = threading.Event()
+
+    def run(self) -> None:
+        """处理队列直到停止（停止前写完队列中剩余的记录）"""
+        log_queue = self.handler.queue
+        while True:
+            stopping = self._stopping.is_set()
+            while log_queue:
+                batch = []
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(log_queue.popleft())
+                except IndexError:
+                    pass
+                self._write(batch)
+
+            if stopping:
+                return
+            self._stopping.wait(self.flush_interval)
+
+    def _write(self, batch: list) -> None:
+        """格式化并写入一批记录（包括丢弃数量的提示）"""
+        lines = []
+        for item in batch:
+            try:
+                lines.append(self.format_item(item))
+            except Exception:
+                self.errors += 1
+
+        dropped = self.handler.dropped
+        if dropped > self._reported_drops:
+            lines.append(f"日志队列已满，已丢弃 {dropped - self._reported_drops} 条日志")
+            self._reported_drops = dropped
+
+        if not lines:
+            return
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            self.errors += 1
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """写完队列中剩余的记录后退出"""
+        self._stopping.set()
+        self.join(timeout)
+
+
+class QueueLogger:
+    """structlog使用的底层日志记录器：把处理后的事件交给日志管道"""
+
+    def __init__(self, name: Optional[str], pipeline: "LogPipeline"):
+        self.name = name
+        # 级别过滤使用的同名标准库记录器
+        self.stdlib_logger = logging.getLogger(name)
+        self._pipeline = pipeline
+
+    def _submit(self, method_name: str) -> Callable[[Dict[str, Any]], None]:
+        def submit(event_dict: Dict[str, Any]) -> None:
+            self._pipeline.submit(method_name, event_dict)
+        return submit
+
+    def __getattr__(self, method_name: str) -> Callable[[Dict[str, Any]], None]:
+        # debug/info/warning/error/critical/exception等方法（首次访问后缓存在实例上）
+        if method_name.startswith("_"):
+            raise AttributeError(method_name)
+        submit = self._submit(method_name)
+        setattr(self, method_name, submit)
+        return submit
+
+
+class LogPipeline:
+    """日志管道：structlog事件和标准库日志记录的入队、后台渲染与批量写入
+
+    queue_enabled为False时不启动后台线程，在调用线程中直接渲染并写入（与入队模式输出相同）。
+    """
+
+    def __init__(
+        self,
+        render: Callable[[float, str, Dict[str, Any]], str],
+        sampler: EventSampler,
+        queue_enabled: bool = True,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.1,
+        stream: Optional[TextIO] = None
+    ):
+        self.render = render
+        self.sampler = sampler
+        self.queue_enabled = queue_enabled
+        self.stream = stream or sys.stdout
+        self.foreign_formatter = logging.Formatter("%(message)s")
+        self.handler = BoundedQueueHandler(queue_size)
+        self.writer = BatchLogWriter(self.handler, self.format_item, self.stream, batch_size, flush_interval)
+        self.root_handler: Optional[logging.Handler] = None
+        self._write_lock = threading.Lock()
+
+    def logger_factory(self, *args: Any) -> QueueLogger:
+        """structlog的logger_factory"""
+        return QueueLogger(args[0] if args else None, self)
+
+    def submit(self, method_name: str, event_dict: Dict[str, Any]) -> None:
+        """提交一条structlog事件"""
+        if self.queue_enabled:
+            self.handler.put((time.time(), method_name, event_dict))
+        else:
+            self._write_now(self.render(time.time(), method_name, event_dict))
+
+    def format_item(self, item: Any) -> str:
+        """格式化队列中的一项（structlog事件或标准库日志记录）"""
+        if isinstance(item, tuple):
+            return self.render(*item)
+        return self.foreign_formatter.format(item)
+
+    def create_handler(self) -> logging.Handler:
+        """标准库logging使用的处理器"""
+        if self.queue_enabled:
+            self.root_handler = self.handler
+        else:
+            self.root_handler = logging.StreamHandler(self.stream)
+            self.root_handler.setFormatter(self.foreign_formatter)
+        return self.root_handler
+
+    def _write_now(self, line: str) -> None:
+        """同步写入一行"""
+        with self._write_lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def start(self) -> None:
+        """启动写入线程"""
+        if self.queue_enabled and not self.writer.is_alive():
+            self.writer.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止写入线程（写完已入队的记录）"""
+        if self.writer.is_alive():
+            self.writer.stop(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取日志管道统计"""
+        return {
+            "queue_enabled": self.queue_enabled,
+            "queue_size": len(self.handler.queue),
+            "queue_capacity": self.handler.maxsize,
+            "enqueued": self.handler.enqueued,
+            "dropped": self.handler.dropped,
+            "written": self.writer.written,
+            "batches": self.writer.batches,
+            "avg_batch_size": round(self.writer.written / self.writer.batches, 1) if self.writer.batches else 0.0,
+            "errors": self.writer.errors,
+            "sampled_out": dict(self.sampler.sampled_out),
+            "writer_running": self.writer.is_alive()
+        }
@@ -2,65 +2,116 @@
 日志配置模块
 使用structlog进行结构化日志记录
 """
+import atexit
 import logging
-import sys
-from typing import Any, Dict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import structlog
 from pythonjsonlogger import jsonlogger
 
 from app.config import settings
+from app.core.log_pipeline import EventSampler, LogPipeline, filter_by_stdlib_level
 
+# 当前的日志管道（setup_logging中创建）
+log_pipeline: Optional[LogPipeline] = None
 
-def setup_logging() -> None:
-    """设置日志配置"""
-    
-    # 配置标准库logging
-    logging.basicConfig(
-        format="%(message)s",
-        stream=sys.stdout,
-        level=getattr(logging, settings.log_level.upper())
-    )
-    
-    # 配置structlog
-    if settings.log_format.lower() == "json":
+
+def _build_renderer(log_format: str) -> Callable[[float, str, Dict[str, Any]], str]:
+    """创建在写入线程中运行的渲染函数（时间戳取日志产生的时间）"""
+    if log_format.lower() == "json":
         # JSON格式日志
-        structlog.configure(
-            processors=[
-                structlog.stdlib.filter_by_level,
-                structlog.stdlib.add_logger_name,
-                structlog.stdlib.add_log_level,
-                structlog.stdlib.PositionalArgumentsFormatter(),
-                structlog.processors.TimeStamper(fmt="iso"),
-                structlog.processors.StackInfoRenderer(),
-                structlog.processors.format_exc_info,
-                structlog.processors.UnicodeDecoder(),
-                structlog.processors.JSONRenderer()
-            ],
-            context_class=dict,
-            logger_factory=structlog.stdlib.LoggerFactory(),
-            wrapper_class=structlog.stdlib.BoundLogger,
-            cache_logger_on_first_use=True,
-        )
+        time_format = "iso"
+        processors = [
+            structlog.processors.UnicodeDecoder(),
+            structlog.processors.JSONRenderer()
+        ]
     else:
         # 控制台格式日志
-        structlog.configure(
-            processors=[
-                structlog.stdlib.filter_by_level,
-                structlog.stdlib.add_logger_name,
-                structlog.stdlib.add_log_level,
-                structlog.stdlib.PositionalArgumentsFormatter(),
-                structlog.processors.TimeStamper(fmt="%Y-%m-%d %H:%M:%S"),
-                structlog.dev.ConsoleRenderer()
-            ],
-            context_class=dict,
-            logger_factory=structlog.stdlib.LoggerFactory(),
-            wrapper_class=structlog.stdlib.BoundLogger,
-            cache_logger_on_first_use=True,
+        time_format = "%Y-%m-%d %H:%M:%S"
+        processors = [structlog.dev.ConsoleRenderer()]
+
+    def render(created: float, method_name: str, event_dict: Dict[str, Any]) -> str:
+        moment = datetime.fromtimestamp(created, tz=timezone.utc)
+        event_dict["timestamp"] = (
+            moment.replace(tzinfo=None).isoformat() + "Z" if time_format == "iso" else moment.strftime(time_format)
         )
+        for processor in processors:
+            event_dict = processor(None, method_name, event_dict)
+        return event_dict
+
+    return render
+
+
+def _to_pipeline(logger: Any, method_name: str, event_dict: Dict[str, Any]) -> Tuple[Tuple[Dict[str, Any]], Dict]:
+    """最后一个处理器：把事件字典原样交给日志管道"""
+    return (event_dict,), {}
+
+
+def setup_logging() -> None:
+    """设置日志配置
+
+    启用日志队列时，调用方只执行级别过滤、抽样、添加字段和入队，渲染和写入在后台线程中成批完成。
+    structlog日志同样遵循标准库的logging.disable()和各记录器的setLevel。
+    """
+    global log_pipeline
+
+    level = getattr(logging, settings.log_level.upper())
+
+    # 重复调用时先停止上一次的写入线程
+    root = logging.getLogger()
+    if log_pipeline is not None:
+        root.removeHandler(log_pipeline.root_handler)
+        log_pipeline.stop()
+
+    log_pipeline = LogPipeline(
+        _build_renderer(settings.log_format),
+        EventSampler(settings.log_sample_rates),
+        queue_enabled=settings.log_queue_enabled,
+        queue_size=settings.log_queue_size,
+        batch_size=settings.log_batch_size,
+        flush_interval=settings.log_flush_interval
+    )
+    log_pipeline.start()
+    atexit.register(log_pipeline.stop)
+
+    # 配置标准库logging（其他库的日志按原样输出）
+    logging.basicConfig(
+        handlers=[log_pipeline.create_handler()],
+        level=level
+    )
+
+    # 配置structlog（低于日志级别的调用直接返回，不经过处理器；
+    # 其余事件先按同名标准库记录器的设置过滤，再抽样）
+    structlog.configure(
+        processors=[
+            filter_by_stdlib_level,
+            log_pipeline.sampler,
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            _to_pipeline
+        ],
+        context_class=dict,
+        logger_factory=log_pipeline.logger_factory,
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        cache_logger_on_first_use=True,
+    )
+
+
+def stop_logging() -> None:
+    """停止写入线程并写完已入队的日志（用于退出前确保日志先于后续的输出写出）"""
+    if log_pipeline is not None:
+        log_pipeline.stop()
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """获取日志管道统计"""
+    return log_pipeline.get_stats() if log_pipeline is not None else {}
 
 
-def get_logger(name: str) -> structlog.stdlib.BoundLogger:
+def get_logger(name: str) -> structlog.typing.FilteringBoundLogger:
     """获取日志记录器"""
     return structlog.get_logger(name)
 
@@ -0,0 +1,357 @@
+"""
+频率限制
+各中间件和依赖项共用的限流子系统：以GCRA（通用信元速率算法）在Redis中原子地判断，
+每个限流键只保存一个“理论到达时间”，判断为O(1)，多个worker共享同一份计数。
+一个请求需要判断的多个策略（如全局策略和安全策略）由一次脚本调用完成。
+Redis不可用时退回到进程内令牌桶（每个worker单独计数），恢复后自动切回Redis。
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Any
+
+from app.config import settings
+from app.core.logging import get_logger
+from app.core.redis_client import get_redis
+
+logger = get_logger(__name__)
+
+# Redis失败后重新尝试的间隔(秒)
+RECONNECT_INTERVAL = 30
+
+# 进程内令牌桶每个条目的估计内存占用(字节)：键字符串、条目列表和有序字典节点
+LOCAL_ENTRY_BYTES = 320
+
+# 频率限制状态的键前缀（与缓存数据同库，清空缓存时只删除缓存命名空间，不影响这些键）
+RATE_LIMIT_KEY_PREFIX = "ratelimit"
+
+# GCRA判断（使用Redis服务器时间，多个worker的时钟差异不影响结果）
+# 一次调用按顺序判断多个策略，遇到第一个拒绝即停止（之后的策略不计入本次请求）
+# KEYS[2i-1]: 第i个策略的理论到达时间键  KEYS[2i]: 封禁键
+# ARGV[3i-2]: 发放间隔(毫秒)  ARGV[3i-1]: 突发容量(毫秒)  ARGV[3i]: 超限后的封禁时长(毫秒)
+# 返回每个已判断的策略的 {是否允许, 需等待的毫秒数, 剩余次数}，依次展开为一个列表
+GCRA_SCRIPT = """
+local now_parts = redis.call("time")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local results = {}
+
+for i = 1, #KEYS / 2 do
+    local tat_key = KEYS[2 * i - 1]
+    local block_key = KEYS[2 * i]
+    local interval = tonumber(ARGV[3 * i - 2])
+    local tolerance = tonumber(ARGV[3 * i - 1])
+    local block = tonumber(ARGV[3 * i])
+    local allowed, wait, remaining = 0, 0, 0
+
+    local blocked = redis.call("pttl", block_key)
+    if blocked > 0 then
+        wait = blocked
+    else
+        local tat = tonumber(redis.call("get", tat_key) or now)
+        if tat < now then
+            tat = now
+        end
+
+        if tat - now > tolerance then
+            if block > 0 then
+                redis.call("set", block_key, "1", "px", block)
+                wait = block
+            else
+                wait = tat - now - tolerance
+            end
+        else
+            local new_tat = tat + interval
+            redis.call("set", tat_key, new_tat, "px", new_tat - now)
+            allowed = 1
+            remaining = math.floor((tolerance - (new_tat - now)) / interval) + 1
+        end
+    end
+
+    results[#results + 1] = allowed
+    results[#results + 1] = wait
+    results[#results + 1] = remaining
+    if allowed == 0 then
+        break
+    end
+end
+
+return results
+"""
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """限流策略：window秒内最多limit次，超限后封禁block_seconds秒（0为不封禁）"""
+    name: str
+    limit: int
+    window: float
+    block_seconds: float = 0
+
+    @property
+    def interval(self) -> float:
+        """平均每次请求的发放间隔(秒)"""
+        return self.window / max(1, self.limit)
+
+    @classmethod
+    def parse(cls, name: str, spec: str) -> "RateLimitPolicy":
+        """解析“次数/秒数”或“次数/秒数/封禁秒数”格式的策略"""
+        parts = [part.strip() for part in spec.split("/")]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"无效的限流策略: {spec}")
+        return cls(
+            name=name,
+            limit=int(parts[0]),
+            window=float(parts[1]),
+            block_seconds=float(parts[2]) if len(parts) == 3 else 0
+        )
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    """限流判断结果"""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # 被拒绝时需等待的秒数
+    backend: str  # redis或local
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After响应头的值（整秒，至少1）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class LocalTokenBucket:
+    """进程内令牌桶（Redis不可用时的后备）
+
+    每个键保存[剩余令牌, 上次更新时间, 令牌补满的时间]，容量为limit，按limit/window的速率补充。
+    条目按最近使用顺序保存，总数不超过max_keys，超出时淘汰最久未使用的键（等同于令牌已补满）；
+    后台定期清除令牌已补满和封禁已到期的键，大量来源地址的扫描不会使内存无限增长。
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max(1, max_keys)
+        self.buckets: "OrderedDict[str, list]" = OrderedDict()
+        self.blocked_until: "OrderedDict[str, float]" = OrderedDict()
+        self.stats = {"evicted": 0, "swept": 0, "sweeps": 0}
+
+    def check(self, policy: RateLimitPolicy, key: str) -> RateLimitResult:
+        """消耗一个令牌，返回判断结果"""
+        now = time.monotonic()
+
+        until = self.blocked_until.get(key)
+        if until is not None:
+            if now < until:
+                return RateLimitResult(False, policy.limit, 0, until - now, "local")
+            del self.blocked_until[key]
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(policy.limit), now, now]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+                self.stats["evicted"] += 1
+        else:
+            bucket[0] = min(float(policy.limit), bucket[0] + (now - bucket[1]) / policy.interval)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+
+        if bucket[0] < 1:
+            if policy.block_seconds > 0:
+                self._block(key, now + policy.block_seconds)
+                return RateLimitResult(False, policy.limit, 0, policy.block_seconds, "local")
+            return RateLimitResult(False, policy.limit, 0, (1 - bucket[0]) * policy.interval, "local")
+
+        bucket[0] -= 1
+        bucket[2] = now + (policy.limit - bucket[0]) * policy.interval
+        return RateLimitResult(True, policy.limit, int(bucket[0]), 0.0, "local")
+
+    def _block(self, key: str, until: float) -> None:
+        """封禁键到指定时间（封禁表同样受max_keys限制）"""
+        self.blocked_until[key] = until
+        self.blocked_until.move_to_end(key)
+        if len(self.blocked_until) > self.max_keys:
+            self.blocked_until.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def sweep(self) -> int:
+        """清除令牌已补满和封禁已到期的键，返回清除的数量"""
+        now = time.monotonic()
+        full = [key for key, bucket in self.buckets.items() if bucket[2] <= now]
+        for key in full:
+            del self.buckets[key]
+        expired = [key for key, until in self.blocked_until.items() if until <= now]
+        for key in expired:
+            del self.blocked_until[key]
+
+        removed = len(full) + len(expired)
+        self.stats["swept"] += removed
+        self.stats["sweeps"] += 1
+        return removed
+
+    def clear(self) -> None:
+        """清空所有计数"""
+        self.buckets.clear()
+        self.blocked_until.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取内存占用统计（按每个条目LOCAL_ENTRY_BYTES字节估计）"""
+        keys = len(self.buckets) + len(self.blocked_until)
+        return {
+            "keys": len(self.buckets),
+            "blocked_keys": len(self.blocked_until),
+            "max_keys": self.max_keys,
+            "estimated_bytes": keys * LOCAL_ENTRY_BYTES,
+            "max_bytes": self.max_keys * 2 * LOCAL_ENTRY_BYTES,
+            **self.stats
+        }
+
+
+class RateLimiter:
+    """频率限制器（Redis GCRA + 本地令牌桶后备）"""
+
+    def __init__(self, key_prefix: str = RATE_LIMIT_KEY_PREFIX):
+        self.key_prefix = key_prefix
+        self.local = LocalTokenBucket(settings.rate_limit_local_max_keys)
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._script = None
+        self._retry_at = 0.0
+        self._route_policies: Optional[Tuple[Tuple[str, RateLimitPolicy], ...]] = None
+        self.stats = {
+            "checks": 0,
+            "rejected": 0,
+            "redis_checks": 0,
+            "local_checks": 0,
+            "redis_errors": 0
+        }
+
+    @property
+    def redis_active(self) -> bool:
+        """当前是否使用Redis判断"""
+        return (
+            settings.redis_enabled
+            and settings.rate_limit_use_redis
+            and time.monotonic() >= self._retry_at
+        )
+
+    def policy_for(self, path: str, default: RateLimitPolicy) -> RateLimitPolicy:
+        """按路径前缀选择策略（配置中最长匹配的前缀优先），未配置时使用default"""
+        if self._route_policies is None:
+            self._route_policies = tuple(sorted(
+                (
+                    (prefix, RateLimitPolicy.parse(f"route:{prefix}", spec))
+                    for prefix, spec in settings.rate_limit_route_policies.items()
+                ),
+                key=lambda item: len(item[0]),
+                reverse=True
+            ))
+
+        for prefix, policy in self._route_policies:
+            if path.startswith(prefix):
+                return policy
+        return default
+
+    async def check(self, policy: RateLimitPolicy, key: str) -> RateLimitResult:
+        """判断一次请求是否允许（记录本次请求）"""
+        return (await self.check_many([(policy, key)]))[0]
+
+    async def check_many(self, checks: Sequence[Tuple[RateLimitPolicy, str]]) -> List[RateLimitResult]:
+        """按顺序判断一次请求的多个(策略, 键)，使用Redis时只需一次往返
+
+        遇到第一个拒绝即停止，返回已判断的结果（最后一个为拒绝时请求应被拒绝），
+        被拒绝之后的策略不计入本次请求，与逐个调用check相同。
+        """
+        results = None
+        if self.redis_active:
+            results = await self._check_redis(checks)
+        if results is None:
+            results = []
+            for policy, key in checks:
+                result = self.local.check(policy, f"{policy.name}:{key}")
+                results.append(result)
+                if not result.allowed:
+                    break
+            self.stats["local_checks"] += len(results)
+        else:
+            self.stats["redis_checks"] += len(results)
+
+        self.stats["checks"] += len(results)
+        if not results[-1].allowed:
+            self.stats["rejected"] += 1
+        return results
+
+    async def _check_redis(self, checks: Sequence[Tuple[RateLimitPolicy, str]]) -> Optional[List[RateLimitResult]]:
+        """在Redis中执行GCRA判断，失败时返回None（本次及RECONNECT_INTERVAL秒内改用本地令牌桶）"""
+        keys: List[str] = []
+        args: List[int] = []
+        for policy, key in checks:
+            base_key = f"{self.key_prefix}:{policy.name}:{key}"
+            interval_ms = max(1, int(policy.interval * 1000))
+            keys += [base_key, f"{base_key}:blocked"]
+            args += [interval_ms, max(0, int(policy.window * 1000) - interval_ms), int(policy.block_seconds * 1000)]
+
+        try:
+            if self._script is None:
+                self._script = get_redis().register_script(GCRA_SCRIPT)
+            values = await asyncio.wait_for(
+                self._script(keys=keys, args=args),
+                timeout=settings.rate_limit_redis_timeout
+            )
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            self._retry_at = time.monotonic() + RECONNECT_INTERVAL
+            logger.warning(f"Redis频率限制不可用，{RECONNECT_INTERVAL}秒内使用本地令牌桶: {e}")
+            return None
+
+        return [
+            RateLimitResult(
+                allowed=bool(values[i]),
+                limit=policy.limit,
+                remaining=int(values[i + 2]),
+                retry_after=int(values[i + 1]) / 1000,
+                backend="redis"
+            )
+            for (policy, _), i in zip(checks, range(0, len(values), 3))
+        ]
+
+    async def start(self) -> None:
+        """启动本地令牌桶的后台清理"""
+        if self._sweep_task is None and settings.rate_limit_sweep_interval > 0:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        """停止后台清理"""
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+
+    async def _sweep_loop(self) -> None:
+        """定期清除已补满和封禁到期的本地令牌桶"""
+        while True:
+            await asyncio.sleep(settings.rate_limit_sweep_interval)
+            try:
+                removed = self.local.sweep()
+                if removed:
+                    logger.debug(f"清除本地频率限制条目: {removed}")
+            except Exception as e:
+                logger.error(f"清理本地频率限制条目失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计"""
+        return {
+            "enabled": settings.rate_limit_enabled,
+            "backend": "redis" if self.redis_active else "local",
+            **self.stats,
+            "local": self.local.get_stats(),
+            "sweeper_running": self._sweep_task is not None and not self._sweep_task.done()
+        }
+
+
+# 全局频率限制器
+rate_limiter = RateLimiter()
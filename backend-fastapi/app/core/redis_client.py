@@ -0,0 +1,57 @@
+"""
+共享的异步Redis连接池
+查询缓存服务和管理端缓存子系统使用同一个连接池。连接池在第一次使用时才创建，
+连接在执行第一条命令时才建立，导入模块不会打开任何连接。
+值以原始字节返回（decode_responses=False），需要字符串的调用方自行解码。
+"""
+from typing import Optional
+
+import redis.asyncio as redis
+from redis.asyncio import Redis, ConnectionPool
+
+from app.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+_pool: Optional[ConnectionPool] = None
+
+
+def get_redis_url() -> str:
+    """根据配置生成Redis连接地址"""
+    if settings.redis_password:
+        return f"redis://:{settings.redis_password}@{settings.redis_host}:{settings.redis_port}/{settings.redis_db}"
+    return f"redis://{settings.redis_host}:{settings.redis_port}/{settings.redis_db}"
+
+
+def get_connection_pool() -> ConnectionPool:
+    """获取共享连接池（首次调用时创建）"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool.from_url(
+            get_redis_url(),
+            decode_responses=False,
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+            health_check_interval=settings.redis_health_check_interval
+        )
+    return _pool
+
+
+def get_redis() -> Redis:
+    """获取使用共享连接池的客户端（客户端本身很轻量，可以随用随取）"""
+    return redis.Redis(connection_pool=get_connection_pool())
+
+
+async def close_redis_pool() -> None:
+    """断开共享连接池中的所有连接"""
+    global _pool
+    if _pool is not None:
+        try:
+            await _pool.disconnect()
+            logger.info("Redis连接池已关闭")
+        except Exception as e:
+            logger.error(f"关闭Redis连接池时出错: {e}")
+        finally:
+            _pool = None
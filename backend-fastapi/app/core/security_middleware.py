@@ -2,17 +2,18 @@
 安全中间件模块
 实施Web安全防护措施
 """
+import re
 import time
 import secrets
-from typing import Dict, Set, Optional
-from collections import defaultdict, deque
+from typing import Dict, Optional, Tuple, Iterable, Any
 from datetime import datetime, timedelta
 
 from fastapi import Request, Response, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from ..config import settings
+from .rate_limit import RateLimitPolicy, rate_limiter
 
 
 class SecurityHeaders:
@@ -65,56 +66,6 @@ class SecurityHeaders:
         }
 
 
-class RateLimiter:
-    """速率限制器"""
-    
-    def __init__(self):
-        self.requests: Dict[str, deque] = defaultdict(deque)
-        self.blocked_ips: Set[str] = set()
-        self.block_until: Dict[str, datetime] = {}
-    
-    def is_allowed(self, client_ip: str, max_requests: int = 100, window_seconds: int = 60) -> bool:
-        """
-        检查是否允许请求
-        
-        Args:
-            client_ip: 客户端IP
-            max_requests: 最大请求数
-            window_seconds: 时间窗口（秒）
-            
-        Returns:
-            bool: 是否允许请求
-        """
-        now = datetime.utcnow()
-        
-        # 检查是否在封禁期内
-        if client_ip in self.block_until:
-            if now < self.block_until[client_ip]:
-                return False
-            else:
-                # 解除封禁
-                self.blocked_ips.discard(client_ip)
-                del self.block_until[client_ip]
-        
-        # 清理过期请求记录
-        cutoff_time = now - timedelta(seconds=window_seconds)
-        request_times = self.requests[client_ip]
-        
-        while request_times and request_times[0] < cutoff_time:
-            request_times.popleft()
-        
-        # 检查请求频率
-        if len(request_times) >= max_requests:
-            # 触发速率限制，封禁IP
-            self.blocked_ips.add(client_ip)
-            self.block_until[client_ip] = now + timedelta(minutes=15)  # 封禁15分钟
-            return False
-        
-        # 记录当前请求
-        request_times.append(now)
-        return True
-
-
 class CSRFProtection:
     """CSRF防护"""
     
@@ -151,14 +102,196 @@ class CSRFProtection:
             del self.tokens[token]
 
 
-class SecurityMiddleware(BaseHTTPMiddleware):
-    """安全中间件"""
+# 恶意模式（按类别，全部为小写，匹配前文本统一转为小写）
+MALICIOUS_PATTERNS: Dict[str, Tuple[str, ...]] = {
+    # SQL注入模式
+    "sql_injection": (
+        "union select", "drop table", "delete from", "insert into",
+        "update set", "exec(", "execute(", "sp_", "xp_", "/*", "*/",
+        "--", ";--", "0x", "char(", "ascii(", "substring("
+    ),
+    # XSS模式
+    "xss": (
+        "<script", "</script>", "javascript:", "vbscript:", "onload=",
+        "onerror=", "onclick=", "onmouseover=", "onfocus=", "onblur=",
+        "eval(", "expression(", "url(javascript", "mocha:", "livescript:"
+    ),
+    # 路径遍历模式
+    "path_traversal": (
+        "../", "..\\", "..\\/", "..%2f", "..%5c", "%2e%2e%2f", "%2e%2e%5c"
+    ),
+    # 命令注入模式（移除常见的HTTP头字符）
+    "command_injection": (
+        "&&", "||", "$(", "${", "<%", "%>", "<?", "?>",
+        "`", ";--", "|cat", "|ls", "|dir", "&cat", "&ls", "&dir"
+    ),
+}
+
+# 只由这些字符组成的文本（IP地址、数字等常见查询值）不可能命中任何模式
+SAFE_TEXT_CHARS = "0123456789abcdefABCDEF.:"
+
+# 输入验证时跳过的常见浏览器请求头
+SAFE_HEADERS = frozenset({
+    "user-agent", "accept", "accept-language", "accept-encoding",
+    "connection", "host", "referer", "origin", "sec-fetch-site",
+    "sec-fetch-mode", "sec-fetch-dest", "cache-control", "pragma"
+})
+
+
+class MaliciousPatternScanner:
+    """预编译的恶意模式扫描器
+
+    所有模式在创建时按公共前缀合并为一个字典树形式的正则表达式，每个位置最多沿一条分支匹配，
+    每段文本只扫描一遍。
+    一个请求的多段文本先逐段跳过只由安全字符组成的值，其余以换行符连接后一次扫描：
+    模式都不含换行符，匹配不会跨越两段文本，结果与逐段检查相同。
+    统计中scanned和skipped按文本段计数，命中时按模式计数。
+    """
+
+    def __init__(self, patterns: Optional[Dict[str, Tuple[str, ...]]] = None):
+        patterns = MALICIOUS_PATTERNS if patterns is None else patterns
+
+        # 模式 -> 类别（重复出现的模式归入第一个类别）
+        self.categories: Dict[str, str] = {}
+        for category, items in patterns.items():
+            for pattern in items:
+                self.categories.setdefault(pattern.lower(), category)
+
+        self._regex = re.compile(self._build_trie_pattern(self.categories))
+
+        # 每个模式都含有安全字符以外的字符时，全部由安全字符组成的文本可以直接放行
+        safe_chars = set(SAFE_TEXT_CHARS.lower())
+        self._safe_text = (
+            re.compile(f"[{re.escape(SAFE_TEXT_CHARS)}]*")
+            if all(set(pattern) - safe_chars for pattern in self.categories) else None
+        )
+
+        self.hits: Dict[str, int] = {}
+        self.stats = {"scanned": 0, "skipped": 0, "matched": 0}
+
+    @staticmethod
+    def _build_trie_pattern(patterns: Iterable[str]) -> str:
+        """将模式合并为按公共前缀分支的正则表达式"""
+        trie: Dict[str, dict] = {}
+        for pattern in patterns:
+            node = trie
+            for char in pattern:
+                node = node.setdefault(char, {})
+            node[""] = {}  # 模式结束标记
+
+        def build(node: Dict[str, dict]) -> str:
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ""
+            if len(branches) == 1 and "" not in node:
+                return branches[0]
+            group = "(?:" + "|".join(branches) + ")"
+            # 当前位置已是某个模式的结尾时，后续分支可选
+            return group + "?" if "" in node else group
+
+        return build(trie)
+
+    def find(self, text: str) -> Optional[str]:
+        """返回文本命中的第一个模式，未命中返回None"""
+        return self.scan((text,))
+
+    def scan(self, texts: Iterable[str]) -> Optional[str]:
+        """一次扫描多段文本，返回命中的第一个模式
+
+        全部由安全字符组成的文本（IP地址、数字等查询值）逐段直接放行，其余文本连接后扫描一遍。
+        """
+        candidates = [text for text in texts if text]
+        self.stats["scanned"] += len(candidates)
+        if self._safe_text is not None:
+            fullmatch = self._safe_text.fullmatch
+            remaining = [text for text in candidates if not fullmatch(text)]
+            self.stats["skipped"] += len(candidates) - len(remaining)
+            candidates = remaining
+        if not candidates:
+            return None
+
+        match = self._regex.search("\n".join(candidates).lower())
+        if match is None:
+            return None
+
+        pattern = match.group(0)
+        self.stats["matched"] += 1
+        self.hits[pattern] = self.hits.get(pattern, 0) + 1
+        return pattern
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取扫描统计（按模式和类别的命中次数）"""
+        by_category: Dict[str, int] = {}
+        for pattern, count in self.hits.items():
+            category = self.categories.get(pattern, "unknown")
+            by_category[category] = by_category.get(category, 0) + count
+
+        return {
+            **self.stats,
+            "pattern_count": len(self.categories),
+            "hits_by_category": by_category,
+            "hits_by_pattern": dict(sorted(self.hits.items(), key=lambda item: item[1], reverse=True))
+        }
+
+    def reset_stats(self) -> None:
+        """清空统计"""
+        self.hits.clear()
+        for key in self.stats:
+            self.stats[key] = 0
+
+
+# 安全策略：每个客户端60秒内最多100次，超限后封禁15分钟
+SECURITY_RATE_LIMIT_POLICY = RateLimitPolicy(name="security", limit=100, window=60, block_seconds=900)
+
+# 不检查安全策略的路径
+SECURITY_RATE_LIMIT_EXEMPT_PATHS = frozenset({
+    "/api/health",
+    "/docs",
+    "/redoc",
+    "/openapi.json"
+})
+
+# 外层频率限制中间件与自身策略一并判断的安全策略结果，在scope["state"]中的键
+SECURITY_RATE_LIMIT_STATE = "security_rate_limit"
+
+
+def get_client_ip(request: Request) -> str:
+    """获取客户端真实IP"""
+    # 检查代理头
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if forwarded_for:
+        # 取第一个IP（原始客户端IP）
+        return forwarded_for.split(",")[0].strip()
+
+    real_ip = request.headers.get("X-Real-IP")
+    if real_ip:
+        return real_ip
+
+    # 检查Cloudflare头
+    cf_connecting_ip = request.headers.get("CF-Connecting-IP")
+    if cf_connecting_ip:
+        return cf_connecting_ip
+
+    return request.client.host if request.client else "unknown"
+
+
+def security_rate_limit_check(request: Request) -> Optional[Tuple[RateLimitPolicy, str]]:
+    """请求需要判断的安全策略(策略, 键)，免检路径返回None"""
+    if request.url.path in SECURITY_RATE_LIMIT_EXEMPT_PATHS:
+        return None
+    return SECURITY_RATE_LIMIT_POLICY, get_client_ip(request)
+
+
+class SecurityMiddleware:
+    """安全中间件（纯ASGI实现）"""
     
-    def __init__(self, app):
-        super().__init__(app)
-        self.rate_limiter = RateLimiter()
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.rate_limiter = rate_limiter
+        self.rate_limit_policy = SECURITY_RATE_LIMIT_POLICY
         self.csrf_protection = CSRFProtection()
         self.security_headers = SecurityHeaders()
+        self.pattern_scanner = malicious_pattern_scanner
         
         # 不需要CSRF保护的路径
         self.csrf_exempt_paths = {
@@ -168,156 +301,126 @@ class SecurityMiddleware(BaseHTTPMiddleware):
             "/api/admin/auth/register",  # 注册端点免于CSRF检查
             "/api/batch-query",  # 批量查询端点免于CSRF检查
             "/api/query-batch",  # 向后兼容的批量查询端点
+            "/api/batch-query/stream",  # 流式批量查询端点
             "/docs",
             "/redoc",
             "/openapi.json"
         }
+
+        # 不需要CSRF保护的路径前缀（供脚本调用的批量任务接口，以Bearer令牌认证，不依赖Cookie）
+        self.csrf_exempt_prefixes = (
+            "/api/jobs",
+        )
         
         # 不需要速率限制的路径
-        self.rate_limit_exempt_paths = {
-            "/api/health",
-            "/docs",
-            "/redoc",
-            "/openapi.json"
-        }
+        self.rate_limit_exempt_paths = SECURITY_RATE_LIMIT_EXEMPT_PATHS
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """处理请求"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
+        request = Request(scope)
+        path = scope["path"]
         
         # 获取客户端IP
         client_ip = self._get_client_ip(request)
         
-        # 速率限制检查
-        if request.url.path not in self.rate_limit_exempt_paths:
-            if not self.rate_limiter.is_allowed(client_ip):
-                return JSONResponse(
+        # 速率限制检查（安全限制不受RATE_LIMIT_ENABLED影响，关闭全局限制时仍然生效）
+        if path not in self.rate_limit_exempt_paths:
+            # 外层RateLimitMiddleware已在同一次Redis调用中判断过时直接使用其结果
+            result = scope.get("state", {}).pop(SECURITY_RATE_LIMIT_STATE, None)
+            if result is None:
+                result = await self.rate_limiter.check(self.rate_limit_policy, client_ip)
+            if not result.allowed:
+                response = JSONResponse(
                     status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    content={"detail": "请求过于频繁，请稍后再试"}
+                    content={"detail": "请求过于频繁，请稍后再试"},
+                    headers={"Retry-After": result.retry_after_header}
                 )
+                await response(scope, receive, send)
+                return
         
         # CSRF保护检查
-        if request.method in ["POST", "PUT", "DELETE", "PATCH"]:
-            if request.url.path not in self.csrf_exempt_paths:
+        if scope["method"] in ["POST", "PUT", "DELETE", "PATCH"]:
+            if (path not in self.csrf_exempt_paths
+                    and not path.startswith(self.csrf_exempt_prefixes)):
                 csrf_token = request.headers.get("X-CSRF-Token")
                 if not csrf_token or not self.csrf_protection.validate_token(csrf_token):
-                    return JSONResponse(
+                    response = JSONResponse(
                         status_code=status.HTTP_403_FORBIDDEN,
                         content={"detail": "CSRF令牌无效或缺失"}
                     )
+                    await response(scope, receive, send)
+                    return
         
         # 输入验证
         if not self._validate_request_input(request):
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"detail": "请求包含非法字符"}
             )
+            await response(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+
+                # 添加安全响应头
+                for header, value in self.security_headers.get_security_headers().items():
+                    headers[header] = value
+
+                # 添加处理时间头
+                process_time = time.time() - start_time
+                headers["X-Process-Time"] = str(process_time)
+            await send(message)
         
         # 处理请求
-        response = await call_next(request)
-        
-        # 添加安全响应头
-        for header, value in self.security_headers.get_security_headers().items():
-            response.headers[header] = value
-        
-        # 添加处理时间头
-        process_time = time.time() - start_time
-        response.headers["X-Process-Time"] = str(process_time)
+        await self.app(scope, receive, send_wrapper)
         
         # 定期清理过期令牌
         if time.time() % 3600 < 1:  # 每小时清理一次
             self.csrf_protection.cleanup_expired_tokens()
-        
-        return response
     
     def _get_client_ip(self, request: Request) -> str:
         """获取客户端真实IP"""
-        # 检查代理头
-        forwarded_for = request.headers.get("X-Forwarded-For")
-        if forwarded_for:
-            # 取第一个IP（原始客户端IP）
-            return forwarded_for.split(",")[0].strip()
-        
-        real_ip = request.headers.get("X-Real-IP")
-        if real_ip:
-            return real_ip
-        
-        # 检查Cloudflare头
-        cf_connecting_ip = request.headers.get("CF-Connecting-IP")
-        if cf_connecting_ip:
-            return cf_connecting_ip
-        
-        return request.client.host if request.client else "unknown"
+        return get_client_ip(request)
     
     def _validate_request_input(self, request: Request) -> bool:
-        """验证请求输入"""
-        # 检查URL路径
-        if self._contains_malicious_patterns(request.url.path):
-            return False
-        
-        # 检查查询参数
-        for key, value in request.query_params.items():
-            if self._contains_malicious_patterns(key) or self._contains_malicious_patterns(value):
-                return False
-        
-        # 检查请求头（跳过常见的浏览器头）
-        safe_headers = {
-            "user-agent", "accept", "accept-language", "accept-encoding",
-            "connection", "host", "referer", "origin", "sec-fetch-site",
-            "sec-fetch-mode", "sec-fetch-dest", "cache-control", "pragma"
-        }
-        for key, value in request.headers.items():
-            if key.lower() not in safe_headers:
-                if self._contains_malicious_patterns(value):
-                    return False
-        
-        return True
+        """验证请求输入
+
+        URL路径、查询参数（解析时已完成URL解码）和非常见请求头的值交给扫描器一次扫描，
+        IP地址等只由安全字符组成的值在连接前逐个跳过。
+        """
+        texts = [request.url.path]
+
+        # 查询参数
+        for key, value in request.query_params.multi_items():
+            texts.append(key)
+            texts.append(value)
+
+        # 请求头（跳过常见的浏览器头，只解码需要检查的值）
+        for key, value in request.headers.raw:
+            if key.decode("latin-1") not in SAFE_HEADERS:
+                texts.append(value.decode("latin-1"))
+
+        return self.pattern_scanner.scan(texts) is None
     
     def _contains_malicious_patterns(self, text: str) -> bool:
         """检查是否包含恶意模式"""
-        if not text:
-            return False
-        
-        text_lower = text.lower()
-        
-        # SQL注入模式
-        sql_patterns = [
-            "union select", "drop table", "delete from", "insert into",
-            "update set", "exec(", "execute(", "sp_", "xp_", "/*", "*/",
-            "--", ";--", "0x", "char(", "ascii(", "substring("
-        ]
-        
-        # XSS模式
-        xss_patterns = [
-            "<script", "</script>", "javascript:", "vbscript:", "onload=",
-            "onerror=", "onclick=", "onmouseover=", "onfocus=", "onblur=",
-            "eval(", "expression(", "url(javascript", "mocha:", "livescript:"
-        ]
-        
-        # 路径遍历模式
-        path_patterns = [
-            "../", "..\\", "..\\/", "..%2f", "..%5c", "%2e%2e%2f", "%2e%2e%5c"
-        ]
-        
-        # 命令注入模式（移除常见的HTTP头字符）
-        command_patterns = [
-            "&&", "||", "$(", "${", "<%", "%>", "<?", "?>",
-            "`", ";--", "|cat", "|ls", "|dir", "&cat", "&ls", "&dir"
-        ]
-        
-        all_patterns = sql_patterns + xss_patterns + path_patterns + command_patterns
-        
-        for pattern in all_patterns:
-            if pattern in text_lower:
-                return True
-        
-        return False
+        return self.pattern_scanner.find(text) is not None
     
     def get_csrf_token(self) -> str:
         """获取CSRF令牌"""
         return self.csrf_protection.generate_token()
 
 
+# 全局恶意模式扫描器（各中间件实例共享命中统计）
+malicious_pattern_scanner = MaliciousPatternScanner()
+
 # 全局安全中间件实例
 security_middleware = None
 
@@ -61,6 +61,7 @@ def create_tables():
     from .notifications.models import NotificationChannel, AlertRule, Alert, NotificationLog
     from .data_management.models import IPQueryRecord, QueryStatistic, DataCleanupRule, DataExportTask
     from .seo.models import SeoConfig
+    from .jobs.models import BulkLookupJob
     
     # 创建所有表
     Base.metadata.create_all(bind=engine)
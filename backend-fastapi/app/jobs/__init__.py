@@ -0,0 +1,3 @@
+"""
+批量查询任务模块
+"""
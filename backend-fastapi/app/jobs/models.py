@@ -0,0 +1,102 @@
+"""
+批量查询任务数据模型
+"""
+from datetime import datetime
+from typing import Optional, List
+from enum import Enum
+
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, JSON, Float
+from pydantic import BaseModel
+
+from ..database import Base
+
+
+class JobStatus(str, Enum):
+    """任务状态枚举"""
+    PENDING = "pending"
+    RUNNING = "running"
+    CANCELLED = "cancelled"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class BulkLookupJob(Base):
+    """批量查询任务表"""
+    __tablename__ = "bulk_lookup_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    owner_id = Column(Integer, index=True)  # 创建任务的管理员用户ID
+    output_format = Column(String(10), nullable=False, default="ndjson")  # ndjson, csv
+
+    # 输入与分片
+    input_path = Column(String(500))
+    output_dir = Column(String(500))
+    total_ips = Column(Integer, default=0)
+    shard_size = Column(Integer, default=0)
+    shard_offsets = Column(JSON)     # 每个分片在输入文件中的起始字节偏移
+    completed_shards = Column(JSON)  # 已完成的分片序号
+    disk_bytes = Column(BigInteger, default=0)  # 输入和已完成结果文件占用的字节数
+
+    # 任务状态
+    status = Column(String(20), default=JobStatus.PENDING.value, index=True)
+    progress = Column(Float, default=0.0)
+    processed_ips = Column(Integer, default=0)
+    failed_ips = Column(Integer, default=0)
+    error_message = Column(Text)
+
+    # 执行者与心跳，用于重启或多进程部署时接管中断的任务
+    worker_id = Column(String(100))
+    heartbeat_at = Column(DateTime)
+
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Pydantic模型
+
+class BulkLookupJobResponse(BaseModel):
+    """批量查询任务响应模型"""
+    id: int
+    name: str
+    owner_id: Optional[int]
+    output_format: str
+    status: str
+    progress: float
+    total_ips: int
+    processed_ips: int
+    failed_ips: int
+    shard_size: int
+    shard_count: int
+    completed_shards: List[int]
+    disk_bytes: int
+    error_message: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    completed_at: Optional[datetime]
+
+    @classmethod
+    def from_job(cls, job: BulkLookupJob) -> "BulkLookupJobResponse":
+        """由任务记录构建响应"""
+        return cls(
+            id=job.id,
+            name=job.name,
+            owner_id=job.owner_id,
+            output_format=job.output_format,
+            status=job.status,
+            progress=job.progress or 0.0,
+            total_ips=job.total_ips or 0,
+            processed_ips=job.processed_ips or 0,
+            failed_ips=job.failed_ips or 0,
+            shard_size=job.shard_size or 0,
+            shard_count=len(job.shard_offsets or []),
+            completed_shards=sorted(job.completed_shards or []),
+            disk_bytes=job.disk_bytes or 0,
+            error_message=job.error_message,
+            created_at=job.created_at,
+            started_at=job.started_at,
+            completed_at=job.completed_at
+        )
@@ -0,0 +1,146 @@
+"""
+批量查询任务路由
+所有接口都需要管理员令牌（Bearer），用户只能访问自己创建的任务
+"""
+from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+from .models import BulkLookupJobResponse
+from .service import bulk_job_manager
+from ..admin.auth.dependencies import get_current_active_user
+from ..admin.models import AdminUser, AdminRole
+from ..services.stream_lookup import STREAM_MEDIA_TYPES
+
+router = APIRouter(prefix="/api/jobs", tags=["批量任务"])
+
+# 读取上传文件的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _owner_scope(user: AdminUser) -> Optional[int]:
+    """任务查询的所属用户范围：超级管理员可管理所有任务，其他用户只能访问自己创建的任务"""
+    return None if user.role == AdminRole.SUPER_ADMIN.value else user.id
+
+
+def _job_not_found() -> HTTPException:
+    """任务不存在错误"""
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="任务不存在"
+    )
+
+
+@router.post("", response_model=BulkLookupJobResponse)
+async def create_job(
+    file: UploadFile = File(..., description="IP文件（每行一个IP，或含ip列的CSV）"),
+    name: Optional[str] = Query(None, max_length=100, description="任务名称"),
+    format: str = Query("ndjson", description="结果格式: ndjson 或 csv"),
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """创建批量查询任务
+
+    上传的文件保存后按分片在后台进程池中查询，结果分片写入磁盘。
+    通过任务详情查看进度，完成的分片可随时下载。每个用户的任务数量和磁盘占用受配额限制。
+    """
+    async def chunks():
+        while True:
+            data = await file.read(UPLOAD_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+    job = await bulk_job_manager.create_job(chunks(), name, format, current_user.id)
+    return BulkLookupJobResponse.from_job(job)
+
+
+@router.get("", response_model=List[BulkLookupJobResponse])
+async def list_jobs(
+    limit: int = Query(50, ge=1, le=500, description="返回数量"),
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取任务列表"""
+    jobs = await run_in_threadpool(bulk_job_manager.list_jobs, limit, _owner_scope(current_user))
+    return [BulkLookupJobResponse.from_job(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=BulkLookupJobResponse)
+async def get_job(
+    job_id: int,
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取任务详情和进度"""
+    job = await run_in_threadpool(bulk_job_manager.get_job, job_id, _owner_scope(current_user))
+    if not job:
+        raise _job_not_found()
+    return BulkLookupJobResponse.from_job(job)
+
+
+@router.post("/{job_id}/cancel", response_model=BulkLookupJobResponse)
+async def cancel_job(
+    job_id: int,
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """取消任务
+
+    执行中的分片完成后停止，已完成的分片会保留，可通过恢复接口继续。
+    """
+    job = await run_in_threadpool(bulk_job_manager.cancel_job, job_id, _owner_scope(current_user))
+    if not job:
+        raise _job_not_found()
+    return BulkLookupJobResponse.from_job(job)
+
+
+@router.post("/{job_id}/resume", response_model=BulkLookupJobResponse)
+async def resume_job(
+    job_id: int,
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """恢复已取消或失败的任务，跳过已完成的分片"""
+    job = await run_in_threadpool(bulk_job_manager.resume_job, job_id, _owner_scope(current_user))
+    if not job:
+        raise _job_not_found()
+    return BulkLookupJobResponse.from_job(job)
+
+
+@router.delete("/{job_id}", response_model=Dict[str, Any])
+async def delete_job(
+    job_id: int,
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """删除已结束的任务及其结果文件"""
+    if not await run_in_threadpool(bulk_job_manager.delete_job, job_id, _owner_scope(current_user)):
+        raise _job_not_found()
+    return {"success": True, "message": "任务已删除"}
+
+
+@router.get("/{job_id}/shards/{index}")
+async def download_shard(
+    job_id: int,
+    index: int,
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """下载已完成的结果分片"""
+    job = await run_in_threadpool(bulk_job_manager.get_job, job_id, _owner_scope(current_user))
+    if not job:
+        raise _job_not_found()
+
+    if index not in (job.completed_shards or []):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="分片不存在或尚未完成"
+        )
+
+    path = bulk_job_manager.get_shard_path(job.id, index, job.output_format)
+    if not await run_in_threadpool(path.exists):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="分片文件不存在"
+        )
+
+    return FileResponse(
+        path=str(path),
+        filename=path.name,
+        media_type=STREAM_MEDIA_TYPES[job.output_format]
+    )
@@ -0,0 +1,563 @@
+"""
+批量查询任务管理
+上传的IP文件整理为每行一个IP的输入文件并按固定数量切分为分片，分片交给本地进程池查询后写出结果文件。
+任务状态、已完成分片和心跳保存在数据库中，取消和进度在重启后保留；
+执行中断（重启、部署）的任务由任意进程重新认领，并跳过已完成的分片继续执行。
+每个任务属于创建它的用户，任务数量和文件占用的磁盘空间按用户限制。
+数据库和文件操作都在线程池中执行，不阻塞事件循环。
+"""
+import asyncio
+import multiprocessing
+import os
+import shutil
+import socket
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+from sqlalchemy import or_, and_, func
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.core.logging import get_logger
+from app.core.exceptions import ValidationException
+from app.database import SessionLocal
+from app.jobs import worker
+from app.jobs.models import BulkLookupJob, JobStatus
+from app.services import lookup_pool
+from app.services.geoip_service import geoip_service
+from app.services.stream_lookup import STREAM_MEDIA_TYPES, StreamInputError, iter_request_ips
+
+logger = get_logger(__name__)
+
+# 上传内容在内存中累积到该大小后再写入磁盘
+UPLOAD_FLUSH_SIZE = 1024 * 1024
+
+
+def _matches(column, value):
+    """构建可比较NULL的相等条件"""
+    return column.is_(None) if value is None else column == value
+
+
+class BulkJobManager:
+    """批量查询任务管理器"""
+
+    def __init__(self):
+        self.worker_id: str = ""
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self._executor_version: Optional[int] = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        """启动任务轮询，认领待执行和中断的任务"""
+        if not settings.jobs_enabled or self._poll_task is not None:
+            return
+
+        Path(settings.jobs_dir).mkdir(parents=True, exist_ok=True)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._poll_task = asyncio.create_task(self._poll_loop())
+        logger.info(f"批量查询任务管理器已启动: {self.worker_id}")
+
+    async def stop(self) -> None:
+        """停止任务执行，本进程持有的任务交还为待执行状态"""
+        if self._poll_task:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+
+        job_ids = list(self._tasks)
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+        if job_ids:
+            await run_in_threadpool(self._release_jobs, job_ids)
+
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+        logger.info("批量查询任务管理器已停止")
+
+    def _release_jobs(self, job_ids: List[int]) -> None:
+        """将本进程执行中的任务交还为待执行状态"""
+        db = SessionLocal()
+        try:
+            db.query(BulkLookupJob).filter(
+                BulkLookupJob.id.in_(job_ids),
+                BulkLookupJob.status == JobStatus.RUNNING.value,
+                BulkLookupJob.worker_id == self.worker_id
+            ).update({"status": JobStatus.PENDING.value, "worker_id": None}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """获取任务进程池，数据库切换后重建以加载新的读取器"""
+        version = geoip_service.readers.version
+        if self.executor is None or self._executor_version != version:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ProcessPoolExecutor(
+                max_workers=settings.jobs_max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=lookup_pool.init_worker,
+                initargs=(geoip_service.get_reader_config(),)
+            )
+            self._executor_version = version
+        return self.executor
+
+    async def _poll_loop(self) -> None:
+        """定期认领任务，新任务创建后立即唤醒"""
+        while True:
+            try:
+                capacity = settings.jobs_max_concurrent - len(self._tasks)
+                if capacity > 0:
+                    claimed = await run_in_threadpool(self._claim_jobs, set(self._tasks), capacity)
+                    for job_id in claimed:
+                        self._tasks[job_id] = asyncio.create_task(self._run_job(job_id))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.jobs_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"认领批量查询任务失败: {e}")
+                await asyncio.sleep(settings.jobs_poll_interval)
+
+    def _claim_jobs(self, running: set, capacity: int) -> List[int]:
+        """认领待执行的任务，以及心跳超时（执行者已退出）的运行中任务，返回认领到的任务ID"""
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.jobs_stale_timeout)
+        claimed_ids: List[int] = []
+        db = SessionLocal()
+        try:
+            candidates = db.query(BulkLookupJob).filter(
+                or_(
+                    BulkLookupJob.status == JobStatus.PENDING.value,
+                    and_(
+                        BulkLookupJob.status == JobStatus.RUNNING.value,
+                        or_(BulkLookupJob.heartbeat_at.is_(None), BulkLookupJob.heartbeat_at < stale_before)
+                    )
+                )
+            ).order_by(BulkLookupJob.created_at).limit(settings.jobs_max_concurrent).all()
+
+            for job in candidates:
+                if len(claimed_ids) >= capacity:
+                    break
+                if job.id in running:
+                    continue
+
+                # 条件更新保证同一任务只被一个进程认领
+                now = datetime.utcnow()
+                claimed = db.query(BulkLookupJob).filter(
+                    BulkLookupJob.id == job.id,
+                    BulkLookupJob.status == job.status,
+                    _matches(BulkLookupJob.worker_id, job.worker_id),
+                    _matches(BulkLookupJob.heartbeat_at, job.heartbeat_at)
+                ).update({
+                    "status": JobStatus.RUNNING.value,
+                    "worker_id": self.worker_id,
+                    "heartbeat_at": now,
+                    "started_at": job.started_at or now
+                }, synchronize_session=False)
+                db.commit()
+
+                if claimed == 1:
+                    if job.status == JobStatus.RUNNING.value:
+                        logger.info(f"接管中断的批量查询任务 {job.id}，原执行者: {job.worker_id}")
+                    claimed_ids.append(job.id)
+        finally:
+            db.close()
+        return claimed_ids
+
+    async def _run_job(self, job_id: int) -> None:
+        """执行任务并记录最终状态"""
+        try:
+            await self._process_job(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self.executor = None
+            logger.error(f"批量查询任务 {job_id} 执行失败: {e}")
+            await run_in_threadpool(self._finish_job, job_id, JobStatus.FAILED, str(e))
+        finally:
+            self._tasks.pop(job_id, None)
+            if self._wakeup:
+                self._wakeup.set()
+
+    async def _process_job(self, job_id: int) -> None:
+        """按分片提交到进程池，每完成一个分片记录一次进度"""
+        job = await run_in_threadpool(self._load_job, job_id)
+        if job is None:
+            return
+        offsets = list(job.shard_offsets or [])
+        completed = set(job.completed_shards or [])
+        input_path, output_format = job.input_path, job.output_format
+        total_ips, shard_size = job.total_ips, job.shard_size
+
+        pending = [index for index in range(len(offsets)) if index not in completed]
+        logger.info(f"开始执行批量查询任务 {job_id}，剩余分片 {len(pending)}/{len(offsets)}")
+
+        loop = asyncio.get_event_loop()
+        executor = self._get_executor()
+        in_flight: Dict[asyncio.Future, int] = {}
+        owned = True
+
+        try:
+            while pending or in_flight:
+                while owned and pending and len(in_flight) < settings.jobs_max_workers:
+                    index = pending.pop(0)
+                    count = min(shard_size, total_ips - index * shard_size)
+                    future = loop.run_in_executor(
+                        executor, worker.run_shard,
+                        input_path, offsets[index], count,
+                        str(self.get_shard_path(job_id, index, output_format)),
+                        output_format, settings.jobs_batch_size
+                    )
+                    in_flight[future] = index
+
+                done, _ = await asyncio.wait(
+                    in_flight, timeout=settings.jobs_poll_interval, return_when=asyncio.FIRST_COMPLETED
+                )
+                results = [(in_flight.pop(future), future.result()) for future in done]
+
+                # 记录进度并刷新心跳，任务被取消、被其他进程接管或超出磁盘配额时不再提交新分片
+                if not await run_in_threadpool(self._record_progress, job_id, results):
+                    owned = False
+                    pending.clear()
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+
+        if owned:
+            await run_in_threadpool(self._finish_job, job_id, JobStatus.COMPLETED)
+
+    def _record_progress(self, job_id: int, results: List[Tuple[int, Tuple[int, int]]]) -> bool:
+        """登记已完成的分片并刷新心跳，返回本进程是否仍是该任务的执行者"""
+        db = SessionLocal()
+        try:
+            job = db.query(BulkLookupJob).filter(BulkLookupJob.id == job_id).first()
+            if job is None:
+                return False
+
+            completed = set(job.completed_shards or [])
+            for index, (processed, failed) in results:
+                if index in completed:
+                    continue
+                completed.add(index)
+                job.processed_ips = (job.processed_ips or 0) + processed
+                job.failed_ips = (job.failed_ips or 0) + failed
+                shard_path = self.get_shard_path(job_id, index, job.output_format)
+                if shard_path.exists():
+                    job.disk_bytes = (job.disk_bytes or 0) + shard_path.stat().st_size
+
+            job.completed_shards = sorted(completed)
+            job.progress = round(job.processed_ips / job.total_ips, 4) if job.total_ips else 1.0
+
+            owned = job.status == JobStatus.RUNNING.value and job.worker_id == self.worker_id
+            if owned:
+                job.heartbeat_at = datetime.utcnow()
+                db.flush()
+                quota = settings.jobs_max_disk_mb_per_user * 1024 * 1024
+                if quota and job.owner_id is not None and self._owner_disk_usage(db, job.owner_id) > quota:
+                    # 结果文件超出所属用户的磁盘配额：停止执行，删除其他任务后可恢复
+                    job.status = JobStatus.FAILED.value
+                    job.error_message = f"任务文件超出磁盘配额 {settings.jobs_max_disk_mb_per_user}MB"
+                    job.completed_at = datetime.utcnow()
+                    job.worker_id = None
+                    owned = False
+                    logger.warning(f"批量查询任务 {job_id} 超出用户 {job.owner_id} 的磁盘配额，已停止")
+            db.commit()
+            return owned
+        finally:
+            db.close()
+
+    def _finish_job(self, job_id: int, status: JobStatus, error_message: Optional[str] = None) -> None:
+        """将本进程执行的任务标记为完成或失败"""
+        db = SessionLocal()
+        try:
+            db.query(BulkLookupJob).filter(
+                BulkLookupJob.id == job_id,
+                BulkLookupJob.status == JobStatus.RUNNING.value,
+                BulkLookupJob.worker_id == self.worker_id
+            ).update({
+                "status": status.value,
+                "error_message": error_message,
+                "completed_at": datetime.utcnow(),
+                "worker_id": None
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        logger.info(f"批量查询任务 {job_id} 结束: {status.value}")
+
+    async def create_job(
+        self,
+        chunks: AsyncIterator[bytes],
+        name: Optional[str],
+        output_format: str,
+        owner_id: int
+    ) -> BulkLookupJob:
+        """保存上传的IP文件并为owner_id用户创建任务（检查任务数量和磁盘配额）"""
+        if not settings.jobs_enabled:
+            raise ValidationException("批量查询任务未启用")
+        if output_format not in STREAM_MEDIA_TYPES:
+            raise ValidationException(f"不支持的输出格式: {output_format}，可选值: {', '.join(STREAM_MEDIA_TYPES)}")
+
+        max_bytes = await run_in_threadpool(self._check_quota, owner_id)
+
+        # 先写入临时目录，整理为每行一个IP并记录每个分片的起始偏移；文件读写和数据库操作在线程池中执行
+        upload_dir = Path(settings.jobs_dir) / f"upload-{uuid.uuid4().hex}"
+        await run_in_threadpool(upload_dir.mkdir, parents=True, exist_ok=True)
+        shard_size = settings.jobs_shard_size
+        offsets: List[int] = []
+        total = 0
+        position = 0
+        try:
+            f = await run_in_threadpool(open, upload_dir / "input.txt", "wb")
+            try:
+                buffer = bytearray()
+                ips = iter_request_ips(
+                    chunks,
+                    max_line_length=settings.stream_max_line_length,
+                    max_ips=settings.jobs_max_ips
+                )
+                async for ip in ips:
+                    if total % shard_size == 0:
+                        offsets.append(position)
+                    line = ip.encode("utf-8") + b"\n"
+                    buffer += line
+                    position += len(line)
+                    total += 1
+                    if max_bytes is not None and position > max_bytes:
+                        raise ValidationException(
+                            f"上传的文件超出剩余磁盘配额（每个用户 {settings.jobs_max_disk_mb_per_user}MB）"
+                        )
+                    if len(buffer) >= UPLOAD_FLUSH_SIZE:
+                        await run_in_threadpool(f.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await run_in_threadpool(f.write, bytes(buffer))
+            finally:
+                await run_in_threadpool(f.close)
+        except StreamInputError as e:
+            await run_in_threadpool(shutil.rmtree, upload_dir, True)
+            raise ValidationException(str(e))
+        except BaseException:
+            await run_in_threadpool(shutil.rmtree, upload_dir, True)
+            raise
+
+        if total == 0:
+            await run_in_threadpool(shutil.rmtree, upload_dir, True)
+            raise ValidationException("上传的文件中没有IP地址")
+
+        job = await run_in_threadpool(
+            self._insert_job, upload_dir, name, output_format, owner_id, total, shard_size, offsets, position
+        )
+
+        logger.info(f"用户 {owner_id} 创建批量查询任务 {job.id}: {total} 个IP，{len(offsets)} 个分片")
+        if self._wakeup:
+            self._wakeup.set()
+        return job
+
+    @staticmethod
+    def _owner_disk_usage(db, owner_id: int) -> int:
+        """用户所有任务文件占用的字节数"""
+        return db.query(func.coalesce(func.sum(BulkLookupJob.disk_bytes), 0)).filter(
+            BulkLookupJob.owner_id == owner_id
+        ).scalar()
+
+    def _check_quota(self, owner_id: int) -> Optional[int]:
+        """检查用户的任务数量和磁盘配额，返回本次上传最多可写入的字节数（None为不限制）"""
+        db = SessionLocal()
+        try:
+            if settings.jobs_max_per_user:
+                count = db.query(BulkLookupJob).filter(BulkLookupJob.owner_id == owner_id).count()
+                if count >= settings.jobs_max_per_user:
+                    raise ValidationException(
+                        f"每个用户最多保留 {settings.jobs_max_per_user} 个任务，请先删除已结束的任务"
+                    )
+
+            if not settings.jobs_max_disk_mb_per_user:
+                return None
+            remaining = settings.jobs_max_disk_mb_per_user * 1024 * 1024 - self._owner_disk_usage(db, owner_id)
+            if remaining <= 0:
+                raise ValidationException(
+                    f"任务文件已达到磁盘配额 {settings.jobs_max_disk_mb_per_user}MB，请先删除已结束的任务"
+                )
+            return remaining
+        finally:
+            db.close()
+
+    def _insert_job(
+        self,
+        upload_dir: Path,
+        name: Optional[str],
+        output_format: str,
+        owner_id: int,
+        total: int,
+        shard_size: int,
+        offsets: List[int],
+        input_bytes: int
+    ) -> BulkLookupJob:
+        """保存任务记录并将上传目录移动为任务目录"""
+        db = SessionLocal()
+        try:
+            job = BulkLookupJob(
+                name=name or f"bulk-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                owner_id=owner_id,
+                output_format=output_format,
+                total_ips=total,
+                shard_size=shard_size,
+                shard_offsets=offsets,
+                completed_shards=[],
+                disk_bytes=input_bytes,
+                status=JobStatus.PENDING.value
+            )
+            db.add(job)
+            db.flush()
+
+            job_dir = Path(settings.jobs_dir) / str(job.id)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            os.replace(upload_dir, job_dir)
+            job.input_path = str(job_dir / "input.txt")
+            job.output_dir = str(job_dir)
+            db.commit()
+            db.refresh(job)
+            return job
+        except Exception:
+            db.rollback()
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def get_shard_path(job_id: int, index: int, output_format: str) -> Path:
+        """分片结果文件路径"""
+        return Path(settings.jobs_dir) / str(job_id) / f"part-{index:05d}.{output_format}"
+
+    @staticmethod
+    def _scoped(query, owner_id: Optional[int]):
+        """限定为owner_id用户的任务（None为不限定，供超级管理员使用）"""
+        if owner_id is None:
+            return query
+        return query.filter(BulkLookupJob.owner_id == owner_id)
+
+    def _load_job(self, job_id: int) -> Optional[BulkLookupJob]:
+        """按ID读取任务（不限定所属用户，供任务执行使用）"""
+        db = SessionLocal()
+        try:
+            return db.query(BulkLookupJob).filter(BulkLookupJob.id == job_id).first()
+        finally:
+            db.close()
+
+    def get_job(self, job_id: int, owner_id: Optional[int] = None) -> Optional[BulkLookupJob]:
+        """获取任务（不属于owner_id用户的任务视为不存在）"""
+        db = SessionLocal()
+        try:
+            query = db.query(BulkLookupJob).filter(BulkLookupJob.id == job_id)
+            return self._scoped(query, owner_id).first()
+        finally:
+            db.close()
+
+    def list_jobs(self, limit: int = 50, owner_id: Optional[int] = None) -> List[BulkLookupJob]:
+        """按创建时间倒序列出任务"""
+        db = SessionLocal()
+        try:
+            query = self._scoped(db.query(BulkLookupJob), owner_id)
+            return query.order_by(BulkLookupJob.created_at.desc()).limit(limit).all()
+        finally:
+            db.close()
+
+    def _transition(
+        self,
+        job_id: int,
+        owner_id: Optional[int],
+        from_statuses: Tuple[JobStatus, ...],
+        values: Dict[str, Any]
+    ) -> Optional[BulkLookupJob]:
+        """在任务处于指定状态时更新状态，任务不存在或不属于owner_id用户时返回None"""
+        db = SessionLocal()
+        try:
+            job = self._scoped(db.query(BulkLookupJob).filter(BulkLookupJob.id == job_id), owner_id).first()
+            if job is None:
+                return None
+
+            updated = db.query(BulkLookupJob).filter(
+                BulkLookupJob.id == job_id,
+                BulkLookupJob.status.in_([status.value for status in from_statuses])
+            ).update(values, synchronize_session=False)
+            db.commit()
+            if updated != 1:
+                raise ValidationException(f"任务当前状态为 {job.status}，无法执行该操作")
+
+            db.refresh(job)
+            return job
+        finally:
+            db.close()
+
+    def cancel_job(self, job_id: int, owner_id: Optional[int] = None) -> Optional[BulkLookupJob]:
+        """取消任务，执行中的分片完成后停止（已完成的分片保留，可恢复）"""
+        return self._transition(
+            job_id,
+            owner_id,
+            (JobStatus.PENDING, JobStatus.RUNNING),
+            {"status": JobStatus.CANCELLED.value, "worker_id": None}
+        )
+
+    def resume_job(self, job_id: int, owner_id: Optional[int] = None) -> Optional[BulkLookupJob]:
+        """恢复已取消或失败的任务，从未完成的分片继续"""
+        job = self._transition(
+            job_id,
+            owner_id,
+            (JobStatus.CANCELLED, JobStatus.FAILED),
+            {"status": JobStatus.PENDING.value, "error_message": None, "completed_at": None, "worker_id": None}
+        )
+        if job is not None:
+            self._notify_from_thread()
+        return job
+
+    def _notify_from_thread(self) -> None:
+        """从线程池中唤醒轮询（asyncio.Event 非线程安全，需交回事件循环执行）"""
+        if self._wakeup and self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def delete_job(self, job_id: int, owner_id: Optional[int] = None) -> bool:
+        """删除未在执行中的任务及其文件"""
+        db = SessionLocal()
+        try:
+            job = self._scoped(db.query(BulkLookupJob).filter(BulkLookupJob.id == job_id), owner_id).first()
+            if job is None:
+                return False
+            if job.status in (JobStatus.PENDING.value, JobStatus.RUNNING.value):
+                raise ValidationException("任务尚未结束，请先取消")
+
+            output_dir = job.output_dir
+            db.delete(job)
+            db.commit()
+        finally:
+            db.close()
+
+        if output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        return True
+
+# 全局任务管理器实例
+bulk_job_manager = BulkJobManager()
@@ -0,0 +1,52 @@
+"""
+批量查询任务的进程池worker
+worker进程由lookup_pool.init_worker打开与主进程相同的数据库，逐段读取输入文件中的一个分片并写出结果文件
+"""
+import os
+from typing import Tuple
+
+from app.services.lookup_pool import get_worker_service
+from app.services.stream_lookup import format_ndjson, format_csv
+
+
+def run_shard(
+    input_path: str,
+    offset: int,
+    count: int,
+    output_path: str,
+    output_format: str,
+    batch_size: int
+) -> Tuple[int, int]:
+    """查询输入文件中从offset开始的count个IP，返回(处理数量, 失败数量)
+
+    结果先写入临时文件，完成后重命名为分片文件，中断时不会留下不完整的分片。
+    """
+    service = get_worker_service()
+    processed = 0
+    failed = 0
+    tmp_path = f"{output_path}.tmp"
+    with open(input_path, "rb") as source, open(tmp_path, "w", encoding="utf-8", newline="") as output:
+        source.seek(offset)
+        header = output_format == "csv"
+        while processed < count:
+            ips = []
+            for _ in range(min(batch_size, count - processed)):
+                line = source.readline()
+                if not line:
+                    break
+                ips.append(line.decode("utf-8").strip())
+            if not ips:
+                break
+
+            columns = service.query_batch_columns_sync(ips)
+            if output_format == "csv":
+                output.write(format_csv(columns, header=header))
+                header = False
+            else:
+                output.write(format_ndjson(columns))
+
+            processed += len(ips)
+            failed += sum(1 for error in columns["error"] if error)
+
+    os.replace(tmp_path, output_path)
+    return processed, failed
@@ -16,6 +16,9 @@ from app.core.exceptions import setup_exception_handlers
 from app.api.routes import api_router
 from app.services.geoip_service import geoip_service
 from app.services.cache_service import cache_service
+from app.core.redis_client import close_redis_pool
+from app.core.rate_limit import rate_limiter
+from app.services.cache_warmup import cache_warmer
 from app.middleware.performance import PerformanceMiddleware, RateLimitMiddleware
 from app.core.security_middleware import SecurityMiddleware
 from .core.error_handler import (
@@ -34,11 +37,20 @@ from app.data_management.routes import router as data_management_router
 from app.optimization.routes import router as optimization_router
 from app.analytics.routes import router as analytics_router
 from app.monitoring.routes import router as monitoring_router
+from app.jobs.routes import router as jobs_router
+from app.jobs.service import bulk_job_manager
 # 设置日志
 setup_logging()
 logger = get_logger(__name__)
 
 
+async def _on_database_reload() -> None:
+    """数据库切换后更新缓存服务记录的数据库构建时间，并删除旧数据库的查询结果（每个构建只由一个worker删除）"""
+    build_epoch = geoip_service.readers.build_epoch
+    cache_service.set_build_epoch(build_epoch)
+    await cache_service.purge_for_build(build_epoch)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
@@ -61,8 +73,23 @@ async def lifespan(app: FastAPI):
         # 初始化缓存服务
         if settings.redis_enabled:
             await cache_service.initialize()
+            # 缓存TTL按数据库的构建时间截断，数据库切换后删除旧结果
+            cache_service.set_build_epoch(geoip_service.readers.build_epoch)
+            geoip_service.add_reload_listener(_on_database_reload)
             logger.info("缓存服务初始化完成")
 
+            # 后台预热缓存，完成前就绪检查返回未就绪
+            if settings.cache_warmup_on_startup:
+                await cache_warmer.start_on_startup()
+
+        # 启动本地频率限制条目的后台清理
+        await rate_limiter.start()
+
+        # 启动批量查询任务管理器（认领中断的任务）
+        if settings.jobs_enabled:
+            await bulk_job_manager.start()
+            logger.info("批量查询任务管理器启动完成")
+
         logger.info("FastAPI应用启动完成")
         yield
         
@@ -72,10 +99,20 @@ async def lifespan(app: FastAPI):
     finally:
         # 关闭时清理
         logger.info("正在关闭FastAPI应用...")
-        
+
+        # 停止批量查询任务管理器
+        await bulk_job_manager.stop()
+
+        # 停止缓存预热
+        await cache_warmer.cancel()
+
+        # 停止频率限制条目清理
+        await rate_limiter.stop()
+
         # 关闭缓存服务
         if settings.redis_enabled:
             await cache_service.close()
+            await close_redis_pool()
             logger.info("缓存服务已关闭")
         
         # 关闭GeoIP服务
@@ -186,6 +223,7 @@ def create_app() -> FastAPI:
     app.include_router(optimization_router)
     app.include_router(analytics_router)
     app.include_router(monitoring_router)
+    app.include_router(jobs_router)
 
     # SEO配置路由
     from .seo.routes import router as seo_router
@@ -1,107 +1,126 @@
 """
 性能监控中间件
+纯ASGI实现，直接在scope和send上处理，不为每个请求额外创建任务或包装响应体
 """
 import time
-from typing import Callable
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.config import settings
 from app.core.logging import get_logger, request_logger, performance_monitor
+from app.core.rate_limit import RateLimitPolicy, rate_limiter
+from app.core.security_middleware import SECURITY_RATE_LIMIT_STATE, security_rate_limit_check
 
 logger = get_logger(__name__)
 
 
-class PerformanceMiddleware(BaseHTTPMiddleware):
+class PerformanceMiddleware:
     """性能监控中间件"""
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """处理请求并记录性能数据"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
-        
+        method = scope["method"]
+        path = scope["path"]
+        client = scope.get("client")
+
         # 记录请求信息
         request_logger.log_request(
-            method=request.method,
-            path=request.url.path,
-            ip=request.client.host if request.client else "unknown",
-            user_agent=request.headers.get("user-agent", "")
-        )
-        
-        # 处理请求
-        response = await call_next(request)
-        
-        # 计算响应时间
-        response_time = time.time() - start_time
-        
-        # 记录响应信息
-        request_logger.log_response(
-            method=request.method,
-            path=request.url.path,
-            status_code=response.status_code,
-            response_time=response_time
+            method=method,
+            path=path,
+            ip=client[0] if client else "unknown",
+            user_agent=Headers(scope=scope).get("user-agent", "")
         )
-        
-        # 记录性能数据
-        performance_monitor.record_request(
-            response_time=response_time,
-            success=response.status_code < 400
-        )
-        
-        # 添加响应头
-        response.headers["X-Response-Time"] = f"{response_time:.3f}s"
-        
-        return response
-
-
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """简单的频率限制中间件"""
-    
-    def __init__(self, app, calls_per_minute: int = 60):
-        super().__init__(app)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # 计算响应时间（响应头就绪时）
+                response_time = time.time() - start_time
+                status_code = message["status"]
+
+                # 记录响应信息
+                request_logger.log_response(
+                    method=method,
+                    path=path,
+                    status_code=status_code,
+                    response_time=response_time
+                )
+
+                # 记录性能数据
+                performance_monitor.record_request(
+                    response_time=response_time,
+                    success=status_code < 400
+                )
+
+                # 添加响应头
+                MutableHeaders(scope=message)["X-Response-Time"] = f"{response_time:.3f}s"
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class RateLimitMiddleware:
+    """频率限制中间件（按客户端地址计数，多个worker通过Redis共享限额）
+
+    内层SecurityMiddleware的安全策略在同一次Redis调用中一并判断，结果通过scope["state"]传递，
+    每个请求只需一次限流往返。
+    """
+
+    def __init__(self, app: ASGIApp, calls_per_minute: int = 60):
+        self.app = app
         self.calls_per_minute = calls_per_minute
-        self.requests = {}  # {ip: [timestamp, ...]}
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        self.policy = RateLimitPolicy(name="global", limit=calls_per_minute, window=60)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """频率限制检查"""
         # OPTIONS预检请求不进行频率限制
-        if request.method == "OPTIONS":
-            return await call_next(request)
-
-        client_ip = request.client.host if request.client else "unknown"
-        current_time = time.time()
-
-        # 清理过期记录
-        if client_ip in self.requests:
-            self.requests[client_ip] = [
-                timestamp for timestamp in self.requests[client_ip]
-                if current_time - timestamp < 60  # 保留最近1分钟的记录
-            ]
-        else:
-            self.requests[client_ip] = []
-
-        # 检查频率限制
-        if len(self.requests[client_ip]) >= self.calls_per_minute:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not settings.rate_limit_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+
+        # 检查频率限制（配置了路径策略的接口使用对应的限额），安全策略一并判断
+        checks = [(rate_limiter.policy_for(scope["path"], self.policy), client_ip)]
+        security_check = security_rate_limit_check(Request(scope))
+        if security_check is not None:
+            checks.append(security_check)
+        results = await rate_limiter.check_many(checks)
+        if len(results) > 1:
+            scope.setdefault("state", {})[SECURITY_RATE_LIMIT_STATE] = results[1]
+
+        result = results[0]
+        if not result.allowed:
             logger.warning(f"频率限制触发: {client_ip}")
 
             # 创建带CORS头的429响应
             response = Response(
                 content='{"error": {"code": "RATE_LIMIT_ERROR", "message": "请求过于频繁，请稍后再试"}}',
                 status_code=429,
-                media_type="application/json"
+                media_type="application/json",
+                headers={"Retry-After": result.retry_after_header}
             )
 
             # 添加CORS头
-            origin = request.headers.get("origin")
+            origin = Headers(scope=scope).get("origin")
             if origin:
                 response.headers["Access-Control-Allow-Origin"] = origin
                 response.headers["Access-Control-Allow-Credentials"] = "true"
                 response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
                 response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type, Accept, Origin, X-Requested-With"
 
-            return response
-
-        # 记录请求时间
-        self.requests[client_ip].append(current_time)
+            await response(scope, receive, send)
+            return
 
         # 处理请求
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
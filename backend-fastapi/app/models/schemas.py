@@ -3,7 +3,7 @@
 使用Pydantic进行数据验证和序列化
 """
 from typing import List, Optional, Dict, Any, Union
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, PrivateAttr, validator
 import ipaddress
 
 
@@ -72,6 +72,8 @@ class IPQueryResult(BaseModel):
     query_time: float = Field(..., description="查询耗时(秒)")
     cached: bool = Field(default=False, description="是否来自缓存")
     error: Optional[str] = Field(None, description="错误信息")
+    # 结果适用的网络前缀长度，供按网段缓存使用，不出现在响应中
+    _prefix_len: Optional[int] = PrivateAttr(default=None)
 
 
 class IPQueryResponse(BaseModel):
@@ -96,6 +98,28 @@ class CacheStats(BaseModel):
     miss_count: int = Field(..., description="未命中次数")
     hit_rate: float = Field(..., description="命中率")
     memory_usage: Optional[str] = Field(None, description="内存使用")
+    l1_enabled: bool = Field(False, description="进程内L1缓存是否启用")
+    l1_hit_count: int = Field(0, description="L1命中次数")
+    l2_hit_count: int = Field(0, description="Redis(L2)命中次数")
+    l1_hit_rate: float = Field(0.0, description="L1命中率（占全部缓存读取）")
+    l1_size: int = Field(0, description="L1当前条目数")
+    l1_max_size: int = Field(0, description="L1最大条目数")
+    l1_evictions: int = Field(0, description="L1容量淘汰次数")
+    coalesced_count: int = Field(0, description="合并到进行中查询的请求数")
+    lock_wait_count: int = Field(0, description="等待其他worker查询的次数")
+    lock_wait_hit_count: int = Field(0, description="等待后直接读到其他worker结果的次数")
+    stale_served_count: int = Field(0, description="宽限期内返回旧值的次数")
+    background_refresh_count: int = Field(0, description="后台刷新次数")
+    bogon_count: int = Field(0, description="由保留地址区间表直接应答的次数")
+    negative_hit_count: int = Field(0, description="负缓存命中次数（地址不在数据库中）")
+    negative_cached_count: int = Field(0, description="写入的负缓存条目数")
+    effective_hit_rate: float = Field(0.0, description="无需查询数据库的请求比例（含保留地址和合并的查询）")
+    policy_enabled: bool = Field(False, description="是否启用准入和自适应TTL策略")
+    admission_rate: float = Field(1.0, description="写入时通过准入判断的比例")
+    admission_rejected_count: int = Field(0, description="因访问频率过低未写入的次数")
+    avg_ttl: float = Field(0.0, description="写入的平均TTL(秒，不含宽限期)")
+    ttl_capped_count: int = Field(0, description="TTL被数据库预计更新时间截断的次数")
+    database_build_epoch: Optional[int] = Field(None, description="当前数据库的构建时间(Unix时间戳)")
 
 
 class ServiceStats(BaseModel):
@@ -15,6 +15,8 @@ from .service import MonitoringService, SystemMonitorService
 from ..admin.models import AdminUser
 from ..admin.auth.dependencies import get_current_active_user, require_super_admin
 from ..database import get_db
+from ..core.rate_limit import rate_limiter
+from ..core.logging import get_logging_stats
 
 router = APIRouter(prefix="/api/admin/monitoring", tags=["系统监控"])
 
@@ -47,6 +49,28 @@ async def get_system_health(
     return system_monitor.get_system_health()
 
 
+@router.get("/rate-limit")
+async def get_rate_limit_status(
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取频率限制状态（包括进程内限流条目的数量和内存上限）"""
+    return {
+        **rate_limiter.get_stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/logging")
+async def get_logging_status(
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取日志管道状态（队列长度、丢弃和抽样计数）"""
+    return {
+        **get_logging_stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
 @router.get("/services", response_model=List[ServiceStatus])
 async def get_service_status(
     current_user: AdminUser = Depends(get_current_active_user)
@@ -240,5 +264,6 @@ async def get_realtime_data(
         "timestamp": datetime.utcnow().isoformat(),
         "system_status": system_monitor.get_system_status(),
         "system_health": system_monitor.get_system_health(),
-        "service_status": system_monitor.get_service_status()
+        "service_status": system_monitor.get_service_status(),
+        "rate_limit": rate_limiter.get_stats()
     }
@@ -1,23 +1,45 @@
 """
 缓存优化系统
+使用与查询缓存服务共享的异步Redis连接池；导入模块时不建立连接，第一次访问Redis时才检查连接。
 """
 import json
 import hashlib
+import time
 from datetime import datetime, timedelta
-from typing import Any, Optional, Dict, List
+from typing import Any, Optional, Dict, List, AsyncIterator, Tuple
 from functools import wraps
-import redis
 from pydantic import BaseModel
+from redis.asyncio import Redis
 
-from ..database import SessionLocal
+from ..config import settings
+from ..core.rate_limit import RATE_LIMIT_KEY_PREFIX
+from ..core.redis_client import get_redis
+from ..models.schemas import IPQueryResult
+from ..services.cache_codec import CacheSerializer, get_serializer, decode_result
+
+# SCAN每次迭代建议返回的键数
+SCAN_COUNT = 1000
+# 批量UNLINK时每条命令的键数
+UNLINK_BATCH_SIZE = 500
+# 命名空间索引（有序集合，成员为缓存键，分数为过期时间戳）的键前缀
+INDEX_KEY_PREFIX = "cache_index:"
+# 未启用索引时统计TTL分布的采样键数
+STATS_SAMPLE_SIZE = 1000
+# Redis不可用时再次尝试连接的间隔(秒)
+RECONNECT_INTERVAL = 30
+# 缓存数据的命名空间（清空全部缓存时删除这些命名空间的键及其索引）
+CACHE_NAMESPACES = ("ip_query", "query_result", "stats", "func")
+# 按模式删除时跳过的键（与缓存同库的频率限制状态）
+PROTECTED_KEY_PREFIXES = (f"{RATE_LIMIT_KEY_PREFIX}:",)
+
+
+def _decode(value: Any) -> Any:
+    """将Redis返回的字节解码为字符串"""
+    return value.decode("utf-8") if isinstance(value, bytes) else value
 
 
 class CacheConfig(BaseModel):
-    """缓存配置模型"""
-    redis_host: str = "localhost"
-    redis_port: int = 6379
-    redis_db: int = 0
-    redis_password: Optional[str] = None
+    """缓存配置模型（连接参数见全局配置中的redis_*）"""
     default_ttl: int = 3600  # 默认过期时间(秒)
     max_memory: str = "100mb"
     eviction_policy: str = "allkeys-lru"
@@ -29,115 +51,291 @@ class CacheManager:
     def __init__(self, config: CacheConfig):
         self.config = config
         self.redis_available = False
+        self.redis_client: Optional[Redis] = None
+        self._configured = False
+        self._retry_at = 0.0
+
+    async def get_client(self) -> Optional[Redis]:
+        """获取Redis客户端
+
+        第一次调用时才PING检查连接并设置Redis配置；连接失败后RECONNECT_INTERVAL秒内直接返回None，
+        不会每个请求都等待连接超时。
+        """
+        if not settings.redis_enabled:
+            return None
+        if self.redis_available:
+            return self.redis_client
+        if time.monotonic() < self._retry_at:
+            return None
+
         try:
-            self.redis_client = redis.Redis(
-                host=config.redis_host,
-                port=config.redis_port,
-                db=config.redis_db,
-                password=config.redis_password,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
-            )
-            # 测试连接
-            self.redis_client.ping()
+            client = self.redis_client or get_redis()
+            await client.ping()
+            self.redis_client = client
             self.redis_available = True
-            self._setup_redis_config()
         except Exception as e:
+            self._retry_at = time.monotonic() + RECONNECT_INTERVAL
             print(f"Redis连接失败，缓存功能将被禁用: {e}")
-            self.redis_client = None
-    
-    def _setup_redis_config(self):
+            return None
+
+        if not self._configured:
+            self._configured = True
+            await self._setup_redis_config()
+        return self.redis_client
+
+    async def _setup_redis_config(self):
         """设置Redis配置"""
         try:
-            self.redis_client.config_set("maxmemory", self.config.max_memory)
-            self.redis_client.config_set("maxmemory-policy", self.config.eviction_policy)
+            await self.redis_client.config_set("maxmemory", self.config.max_memory)
+            await self.redis_client.config_set("maxmemory-policy", self.config.eviction_policy)
         except Exception as e:
             print(f"Redis配置设置失败: {e}")
     
-    def get(self, key: str) -> Optional[Any]:
+    async def get(self, key: str) -> Optional[Any]:
         """获取缓存"""
-        if not self.redis_available or not self.redis_client:
+        value = await self.get_raw(key)
+        if not value:
             return None
         try:
-            value = self.redis_client.get(key)
-            if value:
-                return json.loads(value)
+            return json.loads(value)
+        except Exception as e:
+            print(f"缓存获取失败: {e}")
             return None
+
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        """获取未解码的缓存值"""
+        client = await self.get_client()
+        if not client:
+            return None
+        try:
+            return await client.get(key)
         except Exception as e:
             print(f"缓存获取失败: {e}")
             return None
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
-        """设置缓存"""
-        if not self.redis_available or not self.redis_client:
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None, index: Optional[str] = None) -> bool:
+        """设置缓存（JSON编码，指定index时同时登记到该命名空间索引）"""
+        return await self.set_raw(key, json.dumps(value, default=str), ttl, index)
+
+    async def set_raw(
+        self,
+        key: str,
+        serialized_value: Any,
+        ttl: Optional[int] = None,
+        index: Optional[str] = None
+    ) -> bool:
+        """设置已编码的缓存值（指定index时同时登记到该命名空间索引）"""
+        client = await self.get_client()
+        if not client:
             return False
         try:
             ttl = ttl or self.config.default_ttl
-            serialized_value = json.dumps(value, default=str)
-            return self.redis_client.setex(key, ttl, serialized_value)
+            if index:
+                pipe = client.pipeline(transaction=False)
+                pipe.setex(key, ttl, serialized_value)
+                pipe.zadd(self.index_key(index), {key: time.time() + ttl})
+                return bool((await pipe.execute())[0])
+            return bool(await client.setex(key, ttl, serialized_value))
         except Exception as e:
             print(f"缓存设置失败: {e}")
             return False
     
-    def delete(self, key: str) -> bool:
+    async def delete(self, key: str) -> bool:
         """删除缓存"""
+        client = await self.get_client()
+        if not client:
+            return False
         try:
-            return bool(self.redis_client.delete(key))
+            pipe = client.pipeline(transaction=False)
+            pipe.unlink(key)
+            for namespace, members in self._group_by_namespace([key]).items():
+                pipe.zrem(self.index_key(namespace), *members)
+            return bool((await pipe.execute())[0])
         except Exception as e:
             print(f"缓存删除失败: {e}")
             return False
     
-    def exists(self, key: str) -> bool:
+    async def exists(self, key: str) -> bool:
         """检查缓存是否存在"""
+        client = await self.get_client()
+        if not client:
+            return False
         try:
-            return bool(self.redis_client.exists(key))
+            return bool(await client.exists(key))
         except Exception as e:
             print(f"缓存检查失败: {e}")
             return False
     
-    def get_ttl(self, key: str) -> int:
+    async def get_ttl(self, key: str) -> int:
         """获取缓存剩余时间"""
+        client = await self.get_client()
+        if not client:
+            return -1
         try:
-            return self.redis_client.ttl(key)
+            return await client.ttl(key)
         except Exception as e:
             print(f"获取TTL失败: {e}")
             return -1
     
-    def extend_ttl(self, key: str, ttl: int) -> bool:
+    async def extend_ttl(self, key: str, ttl: int) -> bool:
         """延长缓存时间"""
+        client = await self.get_client()
+        if not client:
+            return False
         try:
-            return bool(self.redis_client.expire(key, ttl))
+            return bool(await client.expire(key, ttl))
         except Exception as e:
             print(f"延长TTL失败: {e}")
             return False
     
-    def get_keys_by_pattern(self, pattern: str) -> List[str]:
-        """根据模式获取键列表"""
+    async def scan_keys(self, pattern: str, count: int = SCAN_COUNT) -> AsyncIterator[List[str]]:
+        """按模式增量遍历键，每次产出一批
+
+        使用基于游标的SCAN，每次调用只遍历一小部分键空间，不会像KEYS一样长时间阻塞Redis。
+        遍历期间新增或删除的键可能被漏掉或重复返回。
+        """
+        client = await self.get_client()
+        if not client:
+            return
+        cursor = 0
+        while True:
+            cursor, keys = await client.scan(cursor=cursor, match=pattern, count=count)
+            if keys:
+                yield [_decode(key) for key in keys]
+            if cursor == 0:
+                break
+
+    async def scan_keys_with_ttl(self, pattern: str, limit: Optional[int] = None) -> AsyncIterator[Tuple[str, int]]:
+        """按模式增量遍历键及其剩余时间（每批TTL通过一次管道读取）"""
+        returned = 0
+        async for keys in self.scan_keys(pattern):
+            if limit is not None:
+                keys = keys[:limit - returned]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.ttl(key)
+            for key, ttl in zip(keys, await pipe.execute()):
+                yield key, ttl
+            returned += len(keys)
+            if limit is not None and returned >= limit:
+                break
+
+    async def get_keys_by_pattern(self, pattern: str, limit: Optional[int] = None) -> List[str]:
+        """根据模式获取键列表（limit限制返回数量）"""
+        result: List[str] = []
         try:
-            return self.redis_client.keys(pattern)
+            async for keys in self.scan_keys(pattern):
+                result.extend(keys)
+                if limit is not None and len(result) >= limit:
+                    return result[:limit]
         except Exception as e:
             print(f"获取键列表失败: {e}")
-            return []
+        return result
     
-    def delete_by_pattern(self, pattern: str) -> int:
-        """根据模式删除缓存"""
+    async def delete_by_pattern(self, pattern: str) -> int:
+        """根据模式删除缓存
+
+        SCAN分批取键，以UNLINK在后台释放内存，并从所属命名空间索引中移除；频率限制状态不会被删除。
+        """
+        deleted = 0
         try:
-            keys = self.get_keys_by_pattern(pattern)
-            if keys:
-                return self.redis_client.delete(*keys)
-            return 0
+            async for keys in self.scan_keys(pattern):
+                keys = [key for key in keys if not key.startswith(PROTECTED_KEY_PREFIXES)]
+                for i in range(0, len(keys), UNLINK_BATCH_SIZE):
+                    batch = keys[i:i + UNLINK_BATCH_SIZE]
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    pipe.unlink(*batch)
+                    for namespace, members in self._group_by_namespace(batch).items():
+                        pipe.zrem(self.index_key(namespace), *members)
+                    deleted += (await pipe.execute())[0]
         except Exception as e:
             print(f"批量删除失败: {e}")
+        return deleted
+
+    @staticmethod
+    def index_key(namespace: str) -> str:
+        """命名空间索引键"""
+        return f"{INDEX_KEY_PREFIX}{namespace}"
+
+    @staticmethod
+    def _group_by_namespace(keys: List[str]) -> Dict[str, List[str]]:
+        """按命名空间（键中第一个冒号之前的部分）分组"""
+        groups: Dict[str, List[str]] = {}
+        for key in keys:
+            namespace, sep, _ = key.partition(":")
+            if sep and not key.startswith(INDEX_KEY_PREFIX):
+                groups.setdefault(namespace, []).append(key)
+        return groups
+
+    async def index_exists(self, namespace: str) -> bool:
+        """命名空间索引是否存在"""
+        client = await self.get_client()
+        if not client:
+            return False
+        try:
+            return bool(await client.exists(self.index_key(namespace)))
+        except Exception as e:
+            print(f"检查索引失败: {e}")
+            return False
+
+    async def count_by_expiry(self, namespace: str, boundaries: List[int]) -> Tuple[int, List[int]]:
+        """按剩余时间区间统计索引中的键数，返回(未过期总数, 各区间数量)
+
+        boundaries为升序的区间边界(秒)，返回len(boundaries)+1个区间的数量，每个区间一次ZCOUNT。
+        """
+        now = time.time()
+        edges = [now] + [now + boundary for boundary in boundaries] + [float("inf")]
+        index_key = self.index_key(namespace)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zcount(index_key, f"({now}", "+inf")
+        for low, high in zip(edges, edges[1:]):
+            pipe.zcount(index_key, f"({low}", high if high != float("inf") else "+inf")
+        counts = await pipe.execute()
+        return counts[0], counts[1:]
+
+    async def prune_index(self, namespace: str) -> int:
+        """移除索引中已过期的键，返回移除数量"""
+        client = await self.get_client()
+        if not client:
             return 0
+        try:
+            return await client.zremrangebyscore(self.index_key(namespace), "-inf", time.time())
+        except Exception as e:
+            print(f"清理索引失败: {e}")
+            return 0
+
+    async def rebuild_index(self, namespace: str) -> int:
+        """按当前键空间重建命名空间索引（逐批SCAN，用于启用索引前已存在的键），返回索引的键数"""
+        indexed = 0
+        try:
+            index_key = self.index_key(namespace)
+            now = time.time()
+            async for keys in self.scan_keys(f"{namespace}:*"):
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.ttl(key)
+                members = {
+                    key: now + ttl
+                    for key, ttl in zip(keys, await pipe.execute())
+                    if ttl > 0
+                }
+                if members:
+                    await self.redis_client.zadd(index_key, members)
+                    indexed += len(members)
+        except Exception as e:
+            print(f"重建索引失败: {e}")
+        return indexed
     
-    def get_cache_info(self) -> Dict[str, Any]:
+    async def get_cache_info(self) -> Dict[str, Any]:
         """获取缓存信息"""
+        client = await self.get_client()
+        if not client:
+            return {}
         try:
-            info = self.redis_client.info()
+            info = await client.info()
             return {
-                "used_memory": info.get("used_memory_human", "0B"),
-                "used_memory_peak": info.get("used_memory_peak_human", "0B"),
+                "used_memory": _decode(info.get("used_memory_human", "0B")),
+                "used_memory_peak": _decode(info.get("used_memory_peak_human", "0B")),
                 "keyspace_hits": info.get("keyspace_hits", 0),
                 "keyspace_misses": info.get("keyspace_misses", 0),
                 "connected_clients": info.get("connected_clients", 0),
@@ -156,10 +354,21 @@ class CacheManager:
         total = hits + misses
         return (hits / total * 100) if total > 0 else 0
     
-    def flush_all(self) -> bool:
-        """清空所有缓存"""
+    async def flush_all(self) -> bool:
+        """清空所有缓存命名空间的键及其索引
+
+        不使用FLUSHALL：同一Redis中的频率限制状态等其他数据不受影响。
+        """
+        client = await self.get_client()
+        if not client:
+            return False
         try:
-            return self.redis_client.flushall()
+            for namespace in CACHE_NAMESPACES:
+                async for keys in self.scan_keys(f"{namespace}:*"):
+                    for i in range(0, len(keys), UNLINK_BATCH_SIZE):
+                        await client.unlink(*keys[i:i + UNLINK_BATCH_SIZE])
+            await client.unlink(*(self.index_key(namespace) for namespace in CACHE_NAMESPACES))
+            return True
         except Exception as e:
             print(f"清空缓存失败: {e}")
             return False
@@ -171,77 +380,102 @@ class IPQueryCache:
     def __init__(self, cache_manager: CacheManager):
         self.cache_manager = cache_manager
         self.cache_prefix = "ip_query:"
+        # 与查询服务（cache_service）写入时登记的索引相同
+        self.index_namespace = "ip_query"
         self.default_ttl = 86400  # 24小时
+        self.serializer: CacheSerializer = get_serializer(settings.cache_serializer, settings.cache_compression)
     
     def _generate_cache_key(self, ip_address: str) -> str:
         """生成缓存键"""
         return f"{self.cache_prefix}{ip_address}"
     
-    def get_ip_info(self, ip_address: str) -> Optional[Dict[str, Any]]:
-        """获取IP信息缓存"""
+    async def get_ip_info(self, ip_address: str) -> Optional[Dict[str, Any]]:
+        """获取IP信息缓存（按查询服务相同的编码格式解码）"""
         cache_key = self._generate_cache_key(ip_address)
-        return self.cache_manager.get(cache_key)
+        value = await self.cache_manager.get_raw(cache_key)
+        if not value:
+            return None
+        try:
+            result = decode_result(value)
+        except Exception as e:
+            print(f"缓存解码失败 {cache_key}: {e}")
+            return None
+        data = result.model_dump()
+        # 负缓存记录不含IP
+        data["ip"] = data["ip"] or ip_address
+        return data
     
-    def set_ip_info(self, ip_address: str, ip_info: Dict[str, Any], ttl: Optional[int] = None) -> bool:
-        """设置IP信息缓存"""
+    async def set_ip_info(self, ip_address: str, ip_info: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """设置IP信息缓存（按CACHE_SERIALIZER编码，与查询服务写入的格式相同）"""
         cache_key = self._generate_cache_key(ip_address)
         ttl = ttl or self.default_ttl
-        
-        # 添加缓存时间戳
-        ip_info["cached_at"] = datetime.utcnow().isoformat()
-        ip_info["cache_ttl"] = ttl
-        
-        return self.cache_manager.set(cache_key, ip_info, ttl)
+        result = IPQueryResult.model_validate({**ip_info, "ip": ip_address})
+        index = self.index_namespace if settings.cache_key_index_enabled else None
+        return await self.cache_manager.set_raw(cache_key, self.serializer.encode(result), ttl, index=index)
     
-    def delete_ip_info(self, ip_address: str) -> bool:
+    async def delete_ip_info(self, ip_address: str) -> bool:
         """删除IP信息缓存"""
         cache_key = self._generate_cache_key(ip_address)
-        return self.cache_manager.delete(cache_key)
+        return await self.cache_manager.delete(cache_key)
     
-    def get_cache_stats(self) -> Dict[str, Any]:
-        """获取IP查询缓存统计"""
-        pattern = f"{self.cache_prefix}*"
-        keys = self.cache_manager.get_keys_by_pattern(pattern)
-        
-        total_cached_ips = len(keys)
-        
-        # 统计不同TTL的缓存
+    # TTL分布的区间边界(秒)及名称
+    TTL_BOUNDARIES = [3600, 86400, 604800]
+    TTL_RANGES = ["< 1 hour", "1-24 hours", "1-7 days", "> 7 days"]
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        """获取IP查询缓存统计
+
+        启用键索引且索引存在时通过有序集合的区间计数得到总数和TTL分布（每个区间一次ZCOUNT，不遍历键）；
+        否则SCAN采样STATS_SAMPLE_SIZE个键估计TTL分布。
+        """
+        if settings.cache_key_index_enabled and await self.cache_manager.index_exists(self.index_namespace):
+            try:
+                total, counts = await self.cache_manager.count_by_expiry(self.index_namespace, self.TTL_BOUNDARIES)
+                return {
+                    "total_cached_ips": total,
+                    "ttl_distribution": {
+                        name: count for name, count in zip(self.TTL_RANGES, counts) if count
+                    },
+                    "cache_prefix": self.cache_prefix,
+                    "source": "index"
+                }
+            except Exception as e:
+                print(f"读取缓存索引失败: {e}")
+
         ttl_distribution = {}
-        for key in keys[:100]:  # 限制检查数量
-            ttl = self.cache_manager.get_ttl(key)
-            if ttl > 0:
-                ttl_range = self._get_ttl_range(ttl)
-                ttl_distribution[ttl_range] = ttl_distribution.get(ttl_range, 0) + 1
-        
+        sampled = 0
+        try:
+            async for _, ttl in self.cache_manager.scan_keys_with_ttl(f"{self.cache_prefix}*", limit=STATS_SAMPLE_SIZE):
+                sampled += 1
+                if ttl > 0:
+                    ttl_range = self._get_ttl_range(ttl)
+                    ttl_distribution[ttl_range] = ttl_distribution.get(ttl_range, 0) + 1
+        except Exception as e:
+            print(f"采样缓存键失败: {e}")
+
         return {
-            "total_cached_ips": total_cached_ips,
+            "total_cached_ips": sampled,
             "ttl_distribution": ttl_distribution,
-            "cache_prefix": self.cache_prefix
+            "cache_prefix": self.cache_prefix,
+            "source": "sample",
+            # 采样达到上限时总数只是下限
+            "truncated": sampled >= STATS_SAMPLE_SIZE
         }
     
     def _get_ttl_range(self, ttl: int) -> str:
         """获取TTL范围"""
-        if ttl < 3600:
-            return "< 1 hour"
-        elif ttl < 86400:
-            return "1-24 hours"
-        elif ttl < 604800:
-            return "1-7 days"
-        else:
-            return "> 7 days"
-    
-    def cleanup_expired(self) -> int:
-        """清理过期缓存"""
-        pattern = f"{self.cache_prefix}*"
-        keys = self.cache_manager.get_keys_by_pattern(pattern)
-        
-        expired_count = 0
-        for key in keys:
-            ttl = self.cache_manager.get_ttl(key)
-            if ttl == -2:  # 键不存在
-                expired_count += 1
-        
-        return expired_count
+        for boundary, name in zip(self.TTL_BOUNDARIES, self.TTL_RANGES):
+            if ttl < boundary:
+                return name
+        return self.TTL_RANGES[-1]
+    
+    async def cleanup_expired(self) -> int:
+        """清理索引中已过期的缓存键，返回清理数量（键本身由Redis按TTL删除）"""
+        return await self.cache_manager.prune_index(self.index_namespace)
+
+    async def rebuild_index(self) -> int:
+        """为已存在的IP缓存键重建索引"""
+        return await self.cache_manager.rebuild_index(self.index_namespace)
 
 
 class QueryResultCache:
@@ -259,12 +493,12 @@ class QueryResultCache:
         query_hash = hashlib.md5(query_string.encode()).hexdigest()
         return f"{self.cache_prefix}{query_hash}"
     
-    def get_query_result(self, query_params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def get_query_result(self, query_params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """获取查询结果缓存"""
         cache_key = self._generate_cache_key(query_params)
-        return self.cache_manager.get(cache_key)
+        return await self.cache_manager.get(cache_key)
     
-    def set_query_result(self, query_params: Dict[str, Any], result: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+    async def set_query_result(self, query_params: Dict[str, Any], result: Dict[str, Any], ttl: Optional[int] = None) -> bool:
         """设置查询结果缓存"""
         cache_key = self._generate_cache_key(query_params)
         ttl = ttl or self.default_ttl
@@ -277,7 +511,7 @@ class QueryResultCache:
             "cache_ttl": ttl
         }
         
-        return self.cache_manager.set(cache_key, cached_result, ttl)
+        return await self.cache_manager.set(cache_key, cached_result, ttl)
 
 
 class StatisticsCache:
@@ -288,12 +522,12 @@ class StatisticsCache:
         self.cache_prefix = "stats:"
         self.default_ttl = 1800  # 30分钟
     
-    def get_statistics(self, stats_type: str, params: Optional[Dict] = None) -> Optional[Dict[str, Any]]:
+    async def get_statistics(self, stats_type: str, params: Optional[Dict] = None) -> Optional[Dict[str, Any]]:
         """获取统计数据缓存"""
         cache_key = self._generate_stats_key(stats_type, params)
-        return self.cache_manager.get(cache_key)
+        return await self.cache_manager.get(cache_key)
     
-    def set_statistics(self, stats_type: str, data: Dict[str, Any], params: Optional[Dict] = None, ttl: Optional[int] = None) -> bool:
+    async def set_statistics(self, stats_type: str, data: Dict[str, Any], params: Optional[Dict] = None, ttl: Optional[int] = None) -> bool:
         """设置统计数据缓存"""
         cache_key = self._generate_stats_key(stats_type, params)
         ttl = ttl or self.default_ttl
@@ -305,7 +539,7 @@ class StatisticsCache:
             "params": params
         }
         
-        return self.cache_manager.set(cache_key, cached_data, ttl)
+        return await self.cache_manager.set(cache_key, cached_data, ttl)
     
     def _generate_stats_key(self, stats_type: str, params: Optional[Dict] = None) -> str:
         """生成统计缓存键"""
@@ -315,28 +549,28 @@ class StatisticsCache:
             return f"{self.cache_prefix}{stats_type}:{params_hash}"
         return f"{self.cache_prefix}{stats_type}"
     
-    def invalidate_statistics(self, stats_type: str) -> int:
+    async def invalidate_statistics(self, stats_type: str) -> int:
         """使统计缓存失效"""
         pattern = f"{self.cache_prefix}{stats_type}*"
-        return self.cache_manager.delete_by_pattern(pattern)
+        return await self.cache_manager.delete_by_pattern(pattern)
 
 
 def cache_result(cache_manager: CacheManager, ttl: int = 3600, key_prefix: str = "func:"):
-    """缓存装饰器"""
+    """缓存装饰器（用于异步函数）"""
     def decorator(func):
         @wraps(func)
-        def wrapper(*args, **kwargs):
+        async def wrapper(*args, **kwargs):
             # 生成缓存键
             cache_key = f"{key_prefix}{func.__name__}:{hashlib.md5(str(args + tuple(kwargs.items())).encode()).hexdigest()[:8]}"
             
             # 尝试从缓存获取
-            cached_result = cache_manager.get(cache_key)
+            cached_result = await cache_manager.get(cache_key)
             if cached_result is not None:
                 return cached_result
             
             # 执行函数并缓存结果
-            result = func(*args, **kwargs)
-            cache_manager.set(cache_key, result, ttl)
+            result = await func(*args, **kwargs)
+            await cache_manager.set(cache_key, result, ttl)
             
             return result
         return wrapper
@@ -349,9 +583,9 @@ class CacheOptimizer:
     def __init__(self, cache_manager: CacheManager):
         self.cache_manager = cache_manager
     
-    def analyze_cache_performance(self) -> Dict[str, Any]:
+    async def analyze_cache_performance(self) -> Dict[str, Any]:
         """分析缓存性能"""
-        cache_info = self.cache_manager.get_cache_info()
+        cache_info = await self.cache_manager.get_cache_info()
         
         # 计算性能指标
         hit_rate = cache_info.get("hit_rate", 0)
@@ -420,29 +654,30 @@ class CacheOptimizer:
         
         return recommendations
     
-    def optimize_cache_settings(self) -> Dict[str, Any]:
+    async def optimize_cache_settings(self) -> Dict[str, Any]:
         """优化缓存设置"""
-        cache_info = self.cache_manager.get_cache_info()
+        cache_info = await self.cache_manager.get_cache_info()
         
         # 基于当前性能调整设置
         optimizations = []
         
         hit_rate = cache_info.get("hit_rate", 0)
-        if hit_rate < 70:
+        client = await self.cache_manager.get_client()
+        if hit_rate < 70 and client:
             # 调整淘汰策略
             try:
-                self.cache_manager.redis_client.config_set("maxmemory-policy", "allkeys-lfu")
+                await client.config_set("maxmemory-policy", "allkeys-lfu")
                 optimizations.append("调整淘汰策略为LFU")
             except:
                 pass
         
         return {
             "optimizations_applied": optimizations,
-            "new_cache_info": self.cache_manager.get_cache_info()
+            "new_cache_info": await self.cache_manager.get_cache_info()
         }
 
 
-# 全局缓存管理器实例
+# 全局缓存管理器实例（不建立连接）
 cache_config = CacheConfig()
 cache_manager = CacheManager(cache_config)
 ip_query_cache = IPQueryCache(cache_manager)
@@ -1,17 +1,27 @@
 """
 系统优化路由
 """
+import json
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from .cache import cache_manager, cache_optimizer, ip_query_cache, statistics_cache
 from .performance import performance_optimizer
 from .security import security_manager
+from ..core.security_middleware import malicious_pattern_scanner
+from ..core.rate_limit import rate_limiter
 from ..admin.models import AdminUser
 from ..admin.auth.dependencies import get_current_active_user, require_super_admin
 from ..database import get_db
+from ..services.cache_warmup import cache_warmer, CacheWarmupRequest
+from ..services.cache_service import cache_service
+
+# 流式返回缓存键时每次输出的行数
+KEY_STREAM_CHUNK_SIZE = 500
 
 router = APIRouter(prefix="/api/admin/optimization", tags=["系统优化"])
 
@@ -23,8 +33,8 @@ async def get_cache_info(
     current_user: AdminUser = Depends(get_current_active_user)
 ):
     """获取缓存信息"""
-    cache_info = cache_manager.get_cache_info()
-    ip_cache_stats = ip_query_cache.get_cache_stats()
+    cache_info = await cache_manager.get_cache_info()
+    ip_cache_stats = await ip_query_cache.get_cache_stats()
     
     return {
         "cache_info": cache_info,
@@ -38,7 +48,7 @@ async def get_cache_performance(
     current_user: AdminUser = Depends(get_current_active_user)
 ):
     """获取缓存性能分析"""
-    performance_analysis = cache_optimizer.analyze_cache_performance()
+    performance_analysis = await cache_optimizer.analyze_cache_performance()
     return performance_analysis
 
 
@@ -47,7 +57,7 @@ async def optimize_cache(
     current_user: AdminUser = Depends(require_super_admin)
 ):
     """优化缓存设置"""
-    optimization_result = cache_optimizer.optimize_cache_settings()
+    optimization_result = await cache_optimizer.optimize_cache_settings()
     return optimization_result
 
 
@@ -56,34 +66,115 @@ async def clear_cache(
     pattern: Optional[str] = Query(None, description="缓存键模式"),
     current_user: AdminUser = Depends(require_super_admin)
 ):
-    """清理缓存"""
+    """清理缓存
+
+    按模式删除时通过SCAN分批取键并以UNLINK删除，不阻塞Redis。
+    """
     if pattern:
-        deleted_count = cache_manager.delete_by_pattern(pattern)
+        deleted_count = await cache_manager.delete_by_pattern(pattern)
+        # 查询结果缓存可能被删除，清除各worker的L1
+        await cache_service.invalidate_near_cache()
         return {
             "message": f"已删除匹配模式 '{pattern}' 的 {deleted_count} 个缓存项",
             "deleted_count": deleted_count
         }
     else:
-        success = cache_manager.flush_all()
+        success = await cache_manager.flush_all()
+        await cache_service.invalidate_near_cache()
         return {
             "message": "已清空所有缓存" if success else "清空缓存失败",
             "success": success
         }
 
 
+@router.get("/cache/keys")
+async def list_cache_keys(
+    pattern: str = Query("ip_query:*", description="缓存键模式"),
+    limit: int = Query(1000, ge=1, le=1000000, description="最多返回的键数"),
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """流式返回匹配模式的缓存键及剩余时间(秒)
+
+    每行一个JSON对象（NDJSON），通过SCAN逐批读取，大键空间下也不会阻塞Redis或一次性占用大量内存。
+    """
+    async def generate():
+        lines = []
+        async for key, ttl in cache_manager.scan_keys_with_ttl(pattern, limit=limit):
+            lines.append(json.dumps({"key": key, "ttl": ttl}, ensure_ascii=False))
+            if len(lines) >= KEY_STREAM_CHUNK_SIZE:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.post("/cache/index/rebuild")
+async def rebuild_cache_index(
+    current_user: AdminUser = Depends(require_super_admin)
+):
+    """为已存在的IP缓存键重建索引并清理已过期的索引成员"""
+    pruned = await ip_query_cache.cleanup_expired()
+    indexed = await ip_query_cache.rebuild_index()
+    return {
+        "message": f"已索引 {indexed} 个缓存键，清理 {pruned} 个过期索引项",
+        "indexed": indexed,
+        "pruned": pruned
+    }
+
+
 @router.post("/cache/ip/{ip_address}/refresh")
 async def refresh_ip_cache(
     ip_address: str,
     current_user: AdminUser = Depends(require_super_admin)
 ):
-    """刷新IP缓存"""
-    deleted = ip_query_cache.delete_ip_info(ip_address)
+    """刷新IP缓存（网段键模式下同时删除IP所属网段的缓存，并通知各worker清除L1）"""
+    deleted = await cache_service.delete_cache(ip_address)
     return {
         "message": f"IP {ip_address} 缓存已{'删除' if deleted else '不存在'}",
         "deleted": deleted
     }
 
 
+@router.get("/cache/warmup")
+async def get_cache_warmup_progress(
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取缓存预热进度"""
+    return cache_warmer.get_progress()
+
+
+@router.post("/cache/warmup")
+async def start_cache_warmup(
+    request: CacheWarmupRequest,
+    current_user: AdminUser = Depends(require_super_admin)
+):
+    """启动缓存预热
+
+    未提供IP列表时从查询记录中选取最近查询最频繁的IP，批量查询后写入Redis。
+    """
+    try:
+        return await cache_warmer.start(request)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+
+
+@router.post("/cache/warmup/cancel")
+async def cancel_cache_warmup(
+    current_user: AdminUser = Depends(require_super_admin)
+):
+    """取消缓存预热"""
+    cancelled = await cache_warmer.cancel()
+    return {
+        "message": "缓存预热已取消" if cancelled else "没有正在运行的缓存预热",
+        "cancelled": cancelled
+    }
+
+
 # 性能监控路由
 
 @router.get("/performance/metrics")
@@ -240,6 +331,28 @@ async def get_blocked_ips(
     }
 
 
+@router.get("/security/pattern-hits")
+async def get_pattern_hits(
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取请求输入恶意模式的命中统计"""
+    return {
+        **malicious_pattern_scanner.get_stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/security/rate-limit")
+async def get_rate_limit_stats(
+    current_user: AdminUser = Depends(get_current_active_user)
+):
+    """获取频率限制统计"""
+    return {
+        **rate_limiter.get_stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
 @router.post("/security/block-ip")
 async def block_ip(
     ip_address: str,
@@ -317,7 +430,7 @@ async def get_optimization_dashboard(
 ):
     """获取优化仪表板"""
     # 缓存性能
-    cache_performance = cache_optimizer.analyze_cache_performance()
+    cache_performance = await cache_optimizer.analyze_cache_performance()
     
     # 系统性能
     system_performance = performance_optimizer.get_system_performance_report()
@@ -339,19 +452,19 @@ async def optimize_all_systems(
     current_user: AdminUser = Depends(require_super_admin)
 ):
     """优化所有系统"""
-    def run_full_optimization():
+    async def run_full_optimization():
         results = {}
         
         # 缓存优化
         try:
-            cache_result = cache_optimizer.optimize_cache_settings()
+            cache_result = await cache_optimizer.optimize_cache_settings()
             results["cache"] = cache_result
         except Exception as e:
             results["cache"] = {"error": str(e)}
         
         # 性能优化
         try:
-            performance_result = performance_optimizer.optimize_system()
+            performance_result = await run_in_threadpool(performance_optimizer.optimize_system)
             results["performance"] = performance_result
         except Exception as e:
             results["performance"] = {"error": str(e)}
@@ -370,7 +483,7 @@ async def optimization_system_health(
     """优化系统健康检查"""
     try:
         # 检查缓存系统
-        cache_info = cache_manager.get_cache_info()
+        cache_info = await cache_manager.get_cache_info()
         cache_healthy = cache_info.get("hit_rate", 0) > 50
         
         # 检查性能监控
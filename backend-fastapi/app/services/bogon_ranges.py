@@ -0,0 +1,81 @@
+"""
+保留地址区间表
+私有、回环、链路本地、文档、组播等不在公网路由的地址段（IANA特殊用途地址注册表），
+预编译为排序的整数区间数组。这些地址不会出现在GeoIP数据库中，直接由区间表应答，
+不查询缓存和数据库读取器。
+"""
+from bisect import bisect_right
+from typing import Optional, Dict, List
+
+from app.models.schemas import IPQueryResult, LocationInfo, ISPInfo
+from app.services.geoip_records import EMPTY_LOCATION, EMPTY_ISP
+from app.services.isp_ranges import RangeTable, compile_ranges
+from app.services.prefix_cache import parse_ip
+
+# 保留地址段（organization为地址段用途，更具体的网段优先于更宽泛的网段）
+BOGON_RANGES: List[Dict[str, str]] = [
+    # IPv4
+    {"network": "0.0.0.0/8", "organization": "This Network (RFC 791)"},
+    {"network": "10.0.0.0/8", "organization": "Private-Use (RFC 1918)"},
+    {"network": "100.64.0.0/10", "organization": "Shared Address Space (RFC 6598)"},
+    {"network": "127.0.0.0/8", "organization": "Loopback (RFC 1122)"},
+    {"network": "169.254.0.0/16", "organization": "Link Local (RFC 3927)"},
+    {"network": "172.16.0.0/12", "organization": "Private-Use (RFC 1918)"},
+    {"network": "192.0.0.0/24", "organization": "IETF Protocol Assignments (RFC 6890)"},
+    {"network": "192.0.2.0/24", "organization": "Documentation (RFC 5737)"},
+    {"network": "192.168.0.0/16", "organization": "Private-Use (RFC 1918)"},
+    {"network": "198.18.0.0/15", "organization": "Benchmarking (RFC 2544)"},
+    {"network": "198.51.100.0/24", "organization": "Documentation (RFC 5737)"},
+    {"network": "203.0.113.0/24", "organization": "Documentation (RFC 5737)"},
+    {"network": "224.0.0.0/4", "organization": "Multicast (RFC 5771)"},
+    {"network": "240.0.0.0/4", "organization": "Reserved (RFC 1112)"},
+    {"network": "255.255.255.255/32", "organization": "Limited Broadcast (RFC 919)"},
+
+    # IPv6
+    {"network": "::/128", "organization": "Unspecified Address (RFC 4291)"},
+    {"network": "::1/128", "organization": "Loopback (RFC 4291)"},
+    {"network": "64:ff9b:1::/48", "organization": "IPv4-IPv6 Translation (RFC 8215)"},
+    {"network": "100::/64", "organization": "Discard-Only (RFC 6666)"},
+    {"network": "2001:db8::/32", "organization": "Documentation (RFC 3849)"},
+    {"network": "fc00::/7", "organization": "Unique-Local (RFC 4193)"},
+    {"network": "fe80::/10", "organization": "Link-Local Unicast (RFC 4291)"},
+    {"network": "ff00::/8", "organization": "Multicast (RFC 4291)"},
+]
+
+
+class BogonTable:
+    """预编译的保留地址区间表（只读，可在任意线程中查询）"""
+
+    def __init__(self, entries: Optional[List[Dict[str, str]]] = None):
+        self._tables: Dict[int, RangeTable] = compile_ranges(BOGON_RANGES if entries is None else entries)
+
+    def lookup(self, ip: str) -> Optional[Dict[str, str]]:
+        """二分查找IP所属的保留地址段，返回ISP信息（organization为用途），公网地址返回None"""
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+
+        version, ip_int = parsed
+        starts, ends, infos = self._tables[version]
+        index = bisect_right(starts, ip_int) - 1
+        if index >= 0 and ip_int <= ends[index]:
+            return infos[index]
+        return None
+
+    def build_result(self, ip: str) -> Optional[IPQueryResult]:
+        """保留地址直接构建查询结果（标记为缓存结果），公网地址返回None"""
+        info = self.lookup(ip)
+        if info is None:
+            return None
+        return IPQueryResult.model_construct(
+            ip=ip,
+            location=LocationInfo.model_construct(**EMPTY_LOCATION),
+            isp=ISPInfo.model_construct(**{**EMPTY_ISP, **info}),
+            query_time=0.0,
+            cached=True,
+            error=None
+        )
+
+
+# 全局保留地址区间表
+bogon_table = BogonTable()
@@ -0,0 +1,200 @@
+"""
+缓存值编解码
+ip_query:* 缓存值的可插拔序列化层。新格式为带版本头的定长字段元组（msgpack，未安装时退化为JSON数组），
+可选用预置字典的deflate压缩重复的国家/时区/ISP字符串；读取时兼容旧的JSON对象格式。
+所有数据库中都没有记录的地址（负缓存）只存储3字节的记录头，不含任何字段。
+解码通过model_construct直接构建结果，不再重复校验（缓存内容均由服务端写入）。
+"""
+import json
+import zlib
+from typing import Optional, Dict, Any
+
+try:
+    import msgpack
+except ImportError:  # 未安装msgpack时定长元组以JSON数组编码
+    msgpack = None
+
+from app.models.schemas import IPQueryResult, LocationInfo, ISPInfo
+from app.services.geoip_records import LOCATION_FIELDS, ISP_FIELDS, EMPTY_LOCATION, EMPTY_ISP
+
+# 二进制记录头：标记字节 + 记录版本 + 编码标识
+# 标记字节使用msgpack保留不用的0xC1，不会与JSON（'{'）或msgpack数据的首字节冲突
+RECORD_MARKER = 0xC1
+# 字段顺序或压缩字典变化时需要提升版本，旧版本记录按未命中处理
+RECORD_VERSION = 1
+
+# 编码标识：低4位为打包方式，高4位为压缩方式
+PACK_NEGATIVE = 0x00
+PACK_MSGPACK = 0x01
+PACK_JSON = 0x02
+COMPRESS_ZLIB = 0x10
+
+# 负缓存记录：只有记录头
+NEGATIVE_RECORD = bytes((RECORD_MARKER, RECORD_VERSION, PACK_NEGATIVE))
+
+# deflate预置字典：缓存值中最常重复的国家、时区和ISP字符串（越常见越靠后）
+ZLIB_DICTIONARY = "".join((
+    "Republic of KoreaRussiaIndiaBrazilCanadaAustraliaNetherlandsFranceGermanyUnited Kingdom",
+    "SingaporeTaiwanHong KongJapan",
+    "Europe/MoscowEurope/AmsterdamEurope/BerlinEurope/LondonAsia/SingaporeAsia/Hong_KongAsia/Tokyo",
+    "America/ChicagoAmerica/New_YorkAmerica/Los_Angeles",
+    "MICROSOFT-CORP-MSN-AS-BLOCKAMAZON-AESAMAZON-02Comcast Cable Communications, LLC",
+    "Alibaba (US) Technology Co., Ltd.Hangzhou Alibaba Advertising Co.,Ltd.",
+    "Shenzhen Tencent Computer Systems Company LimitedTencent Building, Kejizhongyi Avenue",
+    "China Mobile Communications CorporationChina Mobile communications corporation",
+    "CHINA UNICOM China169 BackboneChina Unicom",
+    "Chinanet BackboneCHINANET-BACKBONECHINANET Guangdong province networkChina Telecom",
+    "GuangdongBeijingShanghaiZhejiangJiangsu",
+    "Asia/ShanghaiUnited StatesChinaCNUS",
+)).encode("utf-8")
+
+
+def is_negative(result: IPQueryResult) -> bool:
+    """是否为负结果：查询成功但位置和ISP信息全部为空（地址不在任何数据库中）"""
+    if result.error:
+        return False
+    return (
+        all(getattr(result.location, field) is None for field in LOCATION_FIELDS)
+        and all(getattr(result.isp, field) is None for field in ISP_FIELDS)
+    )
+
+
+class CacheSerializer:
+    """缓存值序列化器基类"""
+
+    name = "base"
+
+    def encode(self, result: IPQueryResult) -> bytes:
+        """编码查询结果"""
+        raise NotImplementedError
+
+
+class JSONSerializer(CacheSerializer):
+    """旧格式：完整的JSON对象（用于回滚到只识别JSON的旧版本）"""
+
+    name = "json"
+
+    def encode(self, result: IPQueryResult) -> bytes:
+        data = result.model_dump()
+        data["cached"] = False  # 存储时标记为非缓存
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class TupleSerializer(CacheSerializer):
+    """定长字段元组：[ip, 位置字段值, ISP字段值, 查询耗时]，字段名不再随每个值存储"""
+
+    name = "tuple"
+
+    def __init__(self, compression: Optional[str] = None):
+        if compression not in (None, "none", "zlib"):
+            raise ValueError(f"不支持的缓存压缩方式: {compression}")
+        self.compress = compression == "zlib"
+        self.pack_flag = PACK_MSGPACK if msgpack is not None else PACK_JSON
+
+    def encode(self, result: IPQueryResult) -> bytes:
+        if is_negative(result):
+            return NEGATIVE_RECORD
+
+        location = result.location
+        isp = result.isp
+        record = [
+            result.ip,
+            [getattr(location, field) for field in LOCATION_FIELDS],
+            [getattr(isp, field) for field in ISP_FIELDS],
+            result.query_time
+        ]
+
+        if self.pack_flag == PACK_MSGPACK:
+            payload = msgpack.packb(record, use_bin_type=True)
+        else:
+            payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        flags = self.pack_flag
+        if self.compress:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZLIB_DICTIONARY)
+            compressed = compressor.compress(payload) + compressor.flush()
+            # 短记录压缩后可能反而更长，此时保留原始数据
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= COMPRESS_ZLIB
+
+        return bytes((RECORD_MARKER, RECORD_VERSION, flags)) + payload
+
+
+# 可用的序列化器
+SERIALIZERS = {
+    "json": JSONSerializer,
+    "tuple": TupleSerializer,
+}
+
+
+def get_serializer(name: str, compression: Optional[str] = None) -> CacheSerializer:
+    """按名称创建序列化器"""
+    if name not in SERIALIZERS:
+        raise ValueError(f"不支持的缓存序列化方式: {name}，可选值: {', '.join(SERIALIZERS)}")
+    if name == "tuple":
+        return TupleSerializer(compression)
+    return SERIALIZERS[name]()
+
+
+def _construct_result(
+    ip: str,
+    location: Dict[str, Any],
+    isp: Dict[str, Any],
+    query_time: float,
+    error: Optional[str] = None
+) -> IPQueryResult:
+    """不经校验构建缓存命中的查询结果"""
+    return IPQueryResult.model_construct(
+        ip=ip,
+        location=LocationInfo.model_construct(**location),
+        isp=ISPInfo.model_construct(**isp),
+        query_time=query_time,
+        cached=True,
+        error=error
+    )
+
+
+def decode_result(data: bytes) -> IPQueryResult:
+    """解码缓存值，同时支持二进制元组格式和旧的JSON对象格式"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    if data[:1] == b"{":
+        record = json.loads(data)
+        return _construct_result(
+            record["ip"],
+            record.get("location") or {},
+            record.get("isp") or {},
+            record.get("query_time", 0.0),
+            record.get("error")
+        )
+
+    if len(data) < 3 or data[0] != RECORD_MARKER:
+        raise ValueError("无法识别的缓存数据格式")
+    if data[1] != RECORD_VERSION:
+        raise ValueError(f"缓存记录版本不匹配: {data[1]}")
+
+    flags = data[2]
+    if flags == PACK_NEGATIVE:
+        # 负缓存记录不含IP，读取方按请求IP重新标记
+        return _construct_result("", dict(EMPTY_LOCATION), dict(EMPTY_ISP), 0.0)
+
+    payload = data[3:]
+    if flags & COMPRESS_ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=ZLIB_DICTIONARY)
+        payload = decompressor.decompress(payload) + decompressor.flush()
+
+    if flags & 0x0F == PACK_MSGPACK:
+        if msgpack is None:
+            raise ValueError("缓存记录使用msgpack编码，但未安装msgpack")
+        ip, location, isp, query_time = msgpack.unpackb(payload, raw=False)
+    else:
+        ip, location, isp, query_time = json.loads(payload)
+
+    return _construct_result(
+        ip,
+        dict(zip(LOCATION_FIELDS, location)),
+        dict(zip(ISP_FIELDS, isp)),
+        query_time
+    )
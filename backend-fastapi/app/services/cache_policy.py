@@ -0,0 +1,184 @@
+"""
+缓存准入与自适应TTL策略
+以count-min sketch（TinyLFU风格，计数饱和于15并定期减半老化）估计每个IP近期的访问频率：
+频率低于准入阈值的IP（只出现一次的扫描流量等）不写入Redis，避免在maxmemory下挤出有用的条目；
+准入的IP按频率在最短和最长TTL之间按对数插值，越热的IP缓存越久。
+TTL不超过数据库预计的下一次更新时间（构建时间 + 更新周期），按计划更新的数据安装后旧结果随之过期；
+手动切换数据库时旧结果由cache_service.purge_results删除。
+"""
+import math
+import time
+from typing import Optional, Dict, Any, Tuple
+
+# 计数上限（4位饱和计数）
+MAX_FREQUENCY = 15
+# 各行哈希使用的奇数乘数
+ROW_SEEDS = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+)
+# 老化时所有计数减半的映射表
+HALVE_TABLE = bytes(value >> 1 for value in range(256))
+HASH_MASK = (1 << 64) - 1
+
+
+class FrequencySketch:
+    """count-min sketch频率估计
+
+    每行为一个bytearray，估计值取各行计数的最小值；累计写入sample_size次后所有计数减半，
+    使估计值反映近期而不是全部历史的访问频率。只在事件循环线程中访问，不需要加锁。
+    """
+
+    def __init__(self, width: int = 65536, sample_factor: int = 10):
+        # 宽度取2的幂，用位与代替取模
+        self.width = 1 << max(4, (max(1, width) - 1).bit_length())
+        self._mask = self.width - 1
+        self._rows = [bytearray(self.width) for _ in ROW_SEEDS]
+        self.sample_size = self.width * sample_factor
+        self._additions = 0
+        self.resets = 0
+
+    def _indexes(self, key: str) -> Tuple[int, ...]:
+        """各行的计数位置"""
+        key_hash = hash(key) & HASH_MASK
+        return tuple(((key_hash * seed) & HASH_MASK) >> 40 & self._mask for seed in ROW_SEEDS)
+
+    def estimate(self, key: str) -> int:
+        """估计访问频率"""
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def increment(self, key: str) -> int:
+        """记录一次访问，返回记录后的频率估计
+
+        只增加等于当前最小值的计数（conservative update），减少哈希冲突造成的高估。
+        """
+        indexes = self._indexes(key)
+        current = min(row[index] for row, index in zip(self._rows, indexes))
+        if current < MAX_FREQUENCY:
+            for row, index in zip(self._rows, indexes):
+                if row[index] == current:
+                    row[index] = current + 1
+            current += 1
+
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._reset()
+        return current
+
+    def _reset(self) -> None:
+        """所有计数减半（老化）"""
+        for row in self._rows:
+            row[:] = row.translate(HALVE_TABLE)
+        self._additions //= 2
+        self.resets += 1
+
+    def clear(self) -> None:
+        """清空所有计数"""
+        for row in self._rows:
+            row[:] = bytes(self.width)
+        self._additions = 0
+
+
+class CachePolicy:
+    """缓存准入和TTL策略"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_frequency: int = 2,
+        min_ttl: int = 300,
+        max_ttl: int = 86400,
+        sketch_width: int = 65536,
+        update_interval: int = 604800
+    ):
+        self.enabled = enabled
+        self.min_frequency = max(1, min(min_frequency, MAX_FREQUENCY))
+        self.min_ttl = max(1, min_ttl)
+        self.max_ttl = max(self.min_ttl, max_ttl)
+        self.update_interval = update_interval
+        self.sketch = FrequencySketch(sketch_width)
+        # 当前数据库的构建时间（Unix时间戳）
+        self.build_epoch: Optional[int] = None
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "bypassed": 0,
+            "ttl_assigned": 0,
+            "ttl_total": 0,
+            "ttl_capped": 0
+        }
+
+    def record(self, ip: str) -> None:
+        """记录一次访问（缓存命中和未命中都需要记录）"""
+        if self.enabled:
+            self.sketch.increment(ip)
+
+    def is_admissible(self, ip: str) -> bool:
+        """按当前频率估计判断是否会被准入（不计入统计）"""
+        return not self.enabled or self.sketch.estimate(ip) >= self.min_frequency
+
+    def admit(self, ip: str) -> bool:
+        """是否允许写入缓存"""
+        if not self.enabled:
+            return True
+        if self.is_admissible(ip):
+            self.stats["admitted"] += 1
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def bypass(self) -> None:
+        """记录一次跳过准入判断的写入（如缓存预热）"""
+        self.stats["bypassed"] += 1
+
+    def ttl_for(self, ip: str, default_ttl: int, adaptive: bool = True) -> int:
+        """按访问频率计算TTL（未启用或adaptive为False时使用default_ttl），不超过数据库预计的下一次更新时间"""
+        if self.enabled and adaptive:
+            frequency = self.sketch.estimate(ip)
+            span = MAX_FREQUENCY - self.min_frequency
+            # 准入阈值处为最短TTL，频率饱和时为最长TTL，中间按对数插值
+            ratio = (
+                math.log1p(max(0, frequency - self.min_frequency)) / math.log1p(span)
+                if span > 0 else 1.0
+            )
+            ttl = int(self.min_ttl * (self.max_ttl / self.min_ttl) ** min(ratio, 1.0))
+        else:
+            ttl = default_ttl
+
+        capped = self.cap_ttl(ttl)
+        if capped < ttl:
+            self.stats["ttl_capped"] += 1
+        self.stats["ttl_assigned"] += 1
+        self.stats["ttl_total"] += capped
+        return capped
+
+    def cap_ttl(self, ttl: int) -> int:
+        """按数据库预计的下一次更新时间限制TTL
+
+        数据库已超过预计更新时间（更新延迟或未配置更新周期）时不再限制。
+        """
+        if not self.build_epoch or self.update_interval <= 0:
+            return ttl
+        remaining = int(self.build_epoch + self.update_interval - time.time())
+        if remaining <= 0:
+            return ttl
+        return max(1, min(ttl, remaining))
+
+    def set_build_epoch(self, build_epoch: Optional[int]) -> None:
+        """更新当前数据库的构建时间"""
+        self.build_epoch = build_epoch
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取策略统计信息"""
+        decisions = self.stats["admitted"] + self.stats["rejected"]
+        assigned = self.stats["ttl_assigned"]
+        return {
+            "enabled": self.enabled,
+            **self.stats,
+            "admission_rate": round(self.stats["admitted"] / decisions, 4) if decisions > 0 else 1.0,
+            "avg_ttl": round(self.stats["ttl_total"] / assigned, 1) if assigned > 0 else 0.0,
+            "build_epoch": self.build_epoch,
+            "sketch_resets": self.sketch.resets
+        }
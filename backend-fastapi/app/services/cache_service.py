@@ -1,30 +1,118 @@
 """
 异步缓存服务
-使用Redis提供高性能缓存功能
+两级缓存：进程内近端缓存（L1）在前，Redis（L2）在后。
+清空、删除缓存和数据库切换时通过Redis发布/订阅通知所有worker清除各自的L1。
+缓存未命中时按IP合并并发的查询（single-flight），可选用Redis锁扩展到多个worker；
+刚过期的结果在宽限期内先返回旧值，同时在后台刷新。
+cache_key_mode为prefix时，结果按GeoIP数据库返回的网段缓存（ip_query:1.2.3.0/24），
+读取时探测IP所属的各候选网段，命中后按请求IP重新标记ip和query_time。
+不在任何数据库中的地址以较短的TTL负缓存；私有、回环等保留地址由区间表直接应答，不访问Redis。
+写入Redis前由准入策略按IP近期访问频率决定是否缓存及缓存多久（见cache_policy）。
 """
-import json
+import asyncio
+import ipaddress
 import time
-from typing import Optional, Dict, Any, List
-import redis.asyncio as redis
+import uuid
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 from redis.asyncio import Redis
 
 from app.config import settings
 from app.core.logging import get_logger
+from app.core.redis_client import get_redis
 from app.core.exceptions import CacheException
 from app.models.schemas import IPQueryResult, CacheStats
+from app.services.bogon_ranges import bogon_table
+from app.services.cache_codec import CacheSerializer, get_serializer, decode_result, is_negative
+from app.services.cache_policy import CachePolicy
+from app.services.near_cache import NearCache
+from app.services.prefix_cache import ADDRESS_BITS, parse_ip
 
 logger = get_logger(__name__)
 
+# L1失效广播频道，消息为IP地址、网段（清除网段内所有IP）或"*"（清空全部）
+INVALIDATION_CHANNEL = "ip_query:invalidate"
+INVALIDATE_ALL = "*"
+# 订阅连接断开后的重试间隔(秒)
+INVALIDATION_RETRY_DELAY = 5
+
+# 只释放自己持有的查询锁
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# 可选的缓存键粒度
+CACHE_KEY_MODES = ("ip", "prefix")
+
+# 网段键模式下已使用的前缀长度索引（成员为"版本:前缀长度"）及本地副本的刷新间隔(秒)
+PREFIX_INDEX_KEY = "ip_query_index:prefix_lengths"
+PREFIX_INDEX_REFRESH_INTERVAL = 30
+
+# 缓存键索引（有序集合，成员为缓存键，分数为过期时间戳），供管理端统计和失效使用，
+# 与app/optimization/cache.py中ip_query命名空间的索引相同；已过期成员的清理间隔(秒)
+KEY_INDEX = "cache_index:ip_query"
+KEY_INDEX_PRUNE_INTERVAL = 60
+
+# 删除全部查询结果时SCAN每次迭代建议返回的键数（每批一条UNLINK）
+PURGE_SCAN_COUNT = 1000
+
+# 数据库切换后删除旧结果的认领键（按数据库构建时间区分，每个构建只由一个worker删除）及其过期时间(秒)
+PURGE_CLAIM_PREFIX = "ip_query_purge"
+PURGE_CLAIM_TTL = 86400
+
+# 缓存未命中时的查询函数
+ResultLoader = Callable[[str], Awaitable[IPQueryResult]]
+
 
 class AsyncCacheService:
     """异步缓存服务"""
     
     def __init__(self):
+        if settings.cache_key_mode not in CACHE_KEY_MODES:
+            raise ValueError(
+                f"不支持的缓存键粒度: {settings.cache_key_mode}，可选值: {', '.join(CACHE_KEY_MODES)}"
+            )
         self.redis: Optional[Redis] = None
+        self.serializer: CacheSerializer = get_serializer(
+            settings.cache_serializer, settings.cache_compression
+        )
+        self.near_cache = NearCache(
+            max_size=settings.cache_l1_max_size,
+            ttl=settings.cache_l1_ttl,
+            jitter=settings.cache_l1_ttl_jitter
+        )
+        self.policy = CachePolicy(
+            enabled=settings.cache_policy_enabled,
+            min_frequency=settings.cache_admission_min_frequency,
+            min_ttl=settings.cache_ttl_min,
+            max_ttl=settings.cache_ttl_max,
+            sketch_width=settings.cache_admission_sketch_width,
+            update_interval=settings.cache_database_update_interval
+        )
+        self._invalidation_task: Optional[asyncio.Task] = None
+        # 进行中的查询（按IP），并发的未命中请求等待同一个任务
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._release_lock = None
+        # 网段键模式下各IP版本已使用的前缀长度（从长到短）
+        self._prefix_lengths: Dict[int, Tuple[int, ...]] = {4: (), 6: ()}
+        self._prefix_index_loaded_at = 0.0
+        self._key_index_pruned_at = 0.0
         self.stats = {
             "hit_count": 0,
             "miss_count": 0,
-            "total_operations": 0
+            "total_operations": 0,
+            "l1_hit_count": 0,
+            "l2_hit_count": 0,
+            "coalesced_count": 0,
+            "lock_wait_count": 0,
+            "lock_wait_hit_count": 0,
+            "stale_served_count": 0,
+            "background_refresh_count": 0,
+            "bogon_count": 0,
+            "negative_hit_count": 0,
+            "negative_cached_count": 0
         }
     
     async def initialize(self) -> None:
@@ -34,22 +122,18 @@ class AsyncCacheService:
             return
         
         try:
-            # 创建Redis连接
-            redis_url = f"redis://{settings.redis_host}:{settings.redis_port}/{settings.redis_db}"
-            if settings.redis_password:
-                redis_url = f"redis://:{settings.redis_password}@{settings.redis_host}:{settings.redis_port}/{settings.redis_db}"
-            
-            self.redis = await redis.from_url(
-                redis_url,
-                encoding="utf-8",
-                decode_responses=True,
-                socket_timeout=5,
-                socket_connect_timeout=5
-            )
+            # 使用共享连接池（缓存值为二进制编码，不做字符串解码）
+            self.redis = get_redis()
             
             # 测试连接
             await self.redis.ping()
             logger.info(f"Redis缓存服务初始化成功: {settings.redis_host}:{settings.redis_port}")
+
+            self._release_lock = self.redis.register_script(RELEASE_LOCK_SCRIPT)
+
+            # 订阅L1失效广播
+            if self.near_cache.enabled:
+                self._invalidation_task = asyncio.create_task(self._listen_invalidations())
             
         except Exception as e:
             logger.error(f"Redis缓存服务初始化失败: {e}")
@@ -58,9 +142,18 @@ class AsyncCacheService:
     
     async def close(self) -> None:
         """关闭缓存服务"""
+        if self._invalidation_task:
+            self._invalidation_task.cancel()
+            try:
+                await self._invalidation_task
+            except asyncio.CancelledError:
+                pass
+            self._invalidation_task = None
+        self.near_cache.clear()
+
         if self.redis:
             try:
-                await self.redis.close()
+                await self.redis.aclose()
                 logger.info("Redis缓存服务已关闭")
             except Exception as e:
                 logger.error(f"关闭Redis连接时出错: {e}")
@@ -70,58 +163,473 @@ class AsyncCacheService:
     def _get_cache_key(self, ip: str) -> str:
         """生成缓存键"""
         return f"ip_query:{ip}"
+
+    def _get_lock_key(self, ip: str) -> str:
+        """生成跨worker查询锁的键"""
+        return f"ip_query_lock:{ip}"
+
+    @staticmethod
+    def _get_network_key(version: int, ip_int: int, prefix_len: int) -> str:
+        """生成网段缓存键"""
+        shift = ADDRESS_BITS[version] - prefix_len
+        network = (ip_int >> shift) << shift
+        address = ipaddress.IPv4Address(network) if version == 4 else ipaddress.IPv6Address(network)
+        return f"ip_query:{address}/{prefix_len}"
+
+    def _candidate_keys(self, ip: str) -> List[str]:
+        """IP可能命中的缓存键：精确IP键在前，其后为已知前缀长度从长到短的网段键"""
+        keys = [self._get_cache_key(ip)]
+        if settings.cache_key_mode != "prefix":
+            return keys
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return keys
+        version, ip_int = parsed
+        for prefix_len in self._prefix_lengths[version]:
+            keys.append(self._get_network_key(version, ip_int, prefix_len))
+        return keys
+
+    def _get_write_key(self, result: IPQueryResult) -> Tuple[str, Optional[str]]:
+        """结果的写入键，返回(缓存键, 需要加入前缀索引的成员)
+
+        前缀长度未知、覆盖整个地址（IPv4的/32）或IPv6前缀长于cache_ipv6_max_prefix时
+        仍按单个IP缓存，避免为单个地址生成网段键。
+        """
+        prefix_len = result._prefix_len
+        if settings.cache_key_mode != "prefix" or prefix_len is None:
+            return self._get_cache_key(result.ip), None
+        parsed = parse_ip(result.ip)
+        if parsed is None:
+            return self._get_cache_key(result.ip), None
+
+        version, ip_int = parsed
+        max_prefix = ADDRESS_BITS[version] - 1 if version == 4 else settings.cache_ipv6_max_prefix
+        if not 0 <= prefix_len <= max_prefix:
+            return self._get_cache_key(result.ip), None
+
+        member = None
+        if prefix_len not in self._prefix_lengths[version]:
+            self._prefix_lengths[version] = tuple(sorted(self._prefix_lengths[version] + (prefix_len,), reverse=True))
+            member = f"{version}:{prefix_len}"
+        return self._get_network_key(version, ip_int, prefix_len), member
+
+    async def _refresh_prefix_index(self) -> None:
+        """定期从Redis同步其他worker写入的前缀长度"""
+        if settings.cache_key_mode != "prefix":
+            return
+        now = time.monotonic()
+        if now - self._prefix_index_loaded_at < PREFIX_INDEX_REFRESH_INTERVAL:
+            return
+        self._prefix_index_loaded_at = now
+
+        members = await self.redis.smembers(PREFIX_INDEX_KEY)
+        lengths: Dict[int, set] = {4: set(self._prefix_lengths[4]), 6: set(self._prefix_lengths[6])}
+        for member in members:
+            try:
+                version, prefix_len = (int(part) for part in member.decode("utf-8").split(":"))
+                lengths[version].add(prefix_len)
+            except (ValueError, KeyError):
+                continue
+        self._prefix_lengths = {
+            version: tuple(sorted(values, reverse=True)) for version, values in lengths.items()
+        }
+
+    @staticmethod
+    def _as_cached(result: IPQueryResult) -> IPQueryResult:
+        """写入L1的结果副本（之后从L1返回时标记为缓存结果）"""
+        return result.model_copy(update={"cached": True})
+
+    @staticmethod
+    def _restamp(result: IPQueryResult, ip: str, query_time: float) -> IPQueryResult:
+        """网段键命中的结果按请求IP重新标记"""
+        if result.ip == ip:
+            return result
+        return result.model_copy(update={"ip": ip, "query_time": query_time})
+
+    def _index_keys(self, pipe: Any, key_ttls: Dict[str, int]) -> None:
+        """在写入管道中登记缓存键索引（键 -> 过期时间），并定期清理已过期的索引成员"""
+        if not settings.cache_key_index_enabled or not key_ttls:
+            return
+        now = time.time()
+        pipe.zadd(KEY_INDEX, {key: now + ttl for key, ttl in key_ttls.items()})
+        if now - self._key_index_pruned_at >= KEY_INDEX_PRUNE_INTERVAL:
+            self._key_index_pruned_at = now
+            pipe.zremrangebyscore(KEY_INDEX, "-inf", now)
+
+    def _ttl_for(self, result: IPQueryResult, adaptive: bool = True) -> Tuple[int, bool]:
+        """结果在Redis中的过期时间（含旧值宽限期），返回(过期时间, 是否为负缓存)
+
+        普通结果的TTL由准入策略按访问频率决定（adaptive为False时使用cache_ttl），
+        负结果使用cache_negative_ttl，为0时与普通结果相同。两者都不超过数据库预计的下一次更新时间
+        （手动切换数据库时由purge_results删除旧结果）。
+        """
+        grace = max(0, settings.cache_stale_ttl)
+        if settings.cache_negative_ttl > 0 and is_negative(result):
+            return self.policy.cap_ttl(settings.cache_negative_ttl) + grace, True
+        return self.policy.ttl_for(result.ip, settings.cache_ttl, adaptive) + grace, False
+
+    def set_build_epoch(self, build_epoch: Optional[int]) -> None:
+        """更新当前数据库的构建时间（缓存TTL不超过其预计的下一次更新时间）"""
+        self.policy.set_build_epoch(build_epoch)
+
+    def _lookup_bogon(self, ip: str) -> Optional[IPQueryResult]:
+        """保留地址直接由区间表应答"""
+        if not settings.cache_bogon_enabled:
+            return None
+        result = bogon_table.build_result(ip)
+        if result is not None:
+            self.stats["bogon_count"] += 1
+        return result
+
+    async def _listen_invalidations(self) -> None:
+        """接收其他worker广播的L1失效消息
+
+        订阅建立前或断开期间可能错过消息，因此每次（重新）订阅时都清空本地L1。
+        """
+        while self.redis:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self.near_cache.clear()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        self._apply_invalidation(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"L1失效订阅中断，{INVALIDATION_RETRY_DELAY}秒后重试: {e}")
+                await asyncio.sleep(INVALIDATION_RETRY_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def _apply_invalidation(self, data: Any) -> None:
+        """处理一条失效消息"""
+        target = data.decode("utf-8") if isinstance(data, bytes) else str(data)
+        if target == INVALIDATE_ALL:
+            self.near_cache.clear()
+        elif "/" in target:
+            self.near_cache.delete_network(target)
+        else:
+            self.near_cache.delete(target)
+
+    async def invalidate_near_cache(self, ip: Optional[str] = None) -> None:
+        """清除本地L1并通知其他worker（ip可以是IP或网段，为空时清空全部）"""
+        target = ip or INVALIDATE_ALL
+        self._apply_invalidation(target)
+        if not self.redis or not self.near_cache.enabled:
+            return
+        try:
+            await self.redis.publish(INVALIDATION_CHANNEL, target)
+        except Exception as e:
+            logger.error(f"广播L1失效消息失败: {e}")
     
     async def get_cached_result(self, ip: str) -> Optional[IPQueryResult]:
-        """获取缓存的查询结果"""
+        """获取缓存的查询结果（宽限期内的旧值同样返回）"""
+        result, _ = await self._fetch(ip)
+        return result
+
+    async def _fetch(self, ip: str) -> Tuple[Optional[IPQueryResult], bool]:
+        """依次查询L1和Redis，返回(结果, 是否为宽限期内的旧值)"""
         if not self.redis:
-            return None
-        
+            return None, False
+
+        result = self.near_cache.get(ip)
+        if result is not None:
+            self.stats["hit_count"] += 1
+            self.stats["l1_hit_count"] += 1
+            self.stats["total_operations"] += 1
+            if is_negative(result):
+                self.stats["negative_hit_count"] += 1
+            logger.debug(f"L1缓存命中: {ip}")
+            return result, False
+
         try:
-            cache_key = self._get_cache_key(ip)
-            cached_data = await self.redis.get(cache_key)
+            start_time = time.perf_counter()
+            generation = self.near_cache.generation
+            cached_data, remaining_ms = await self._read_l2(ip)
+            stale = 0 <= remaining_ms <= settings.cache_stale_ttl * 1000
             
             if cached_data:
-                # 解析缓存数据
-                data = json.loads(cached_data)
-                result = IPQueryResult(**data)
-                result.cached = True
+                # 解析缓存数据（兼容旧的JSON格式）
+                result = self._restamp(decode_result(cached_data), ip, time.perf_counter() - start_time)
+                if not stale:
+                    self.near_cache.put(ip, result, generation)
                 
                 # 更新统计
                 self.stats["hit_count"] += 1
+                self.stats["l2_hit_count"] += 1
                 self.stats["total_operations"] += 1
+                if is_negative(result):
+                    self.stats["negative_hit_count"] += 1
                 
                 logger.debug(f"缓存命中: {ip}")
-                return result
+                return result, stale
             else:
                 # 缓存未命中
                 self.stats["miss_count"] += 1
                 self.stats["total_operations"] += 1
                 
                 logger.debug(f"缓存未命中: {ip}")
-                return None
+                return None, False
                 
         except Exception as e:
             logger.error(f"获取缓存失败: {e}")
-            return None
+            return None, False
+
+    async def _read_l2(self, ip: str) -> Tuple[Optional[bytes], int]:
+        """从Redis读取IP的缓存值，返回(数据, 剩余过期毫秒数)
+
+        所有候选键在一次往返中读取，取最先命中（最具体）的键；
+        开启宽限期时同时读取剩余过期时间，未开启时剩余时间返回-1。
+        """
+        await self._refresh_prefix_index()
+        keys = self._candidate_keys(ip)
+        with_ttl = settings.cache_stale_ttl > 0
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.mget(keys)
+        if with_ttl:
+            for key in keys:
+                pipe.pttl(key)
+        responses = await pipe.execute()
+
+        for index, cached_data in enumerate(responses[0]):
+            if cached_data:
+                return cached_data, responses[1 + index] if with_ttl else -1
+        return None, -1
+
+    async def get_or_load(self, ip: str, loader: ResultLoader) -> IPQueryResult:
+        """获取缓存结果，未命中时查询并写入缓存
+
+        同一worker内对同一IP的并发未命中只执行一次查询；开启cache_lock_enabled时，
+        其他worker正在查询的IP会等待其写入Redis后直接读取。
+        宽限期内的旧值立即返回，并在后台刷新。
+        """
+        result = self._lookup_bogon(ip)
+        if result is not None:
+            return result
+
+        self.policy.record(ip)
+        result, stale = await self._fetch(ip)
+        if result is not None:
+            if stale:
+                self.stats["stale_served_count"] += 1
+                if ip not in self._inflight:
+                    self.stats["background_refresh_count"] += 1
+                    self._start_load(ip, loader)
+            return result
+
+        if not settings.cache_single_flight_enabled:
+            return await self._load(ip, loader)
+
+        task = self._inflight.get(ip)
+        if task is not None:
+            self.stats["coalesced_count"] += 1
+        else:
+            task = self._start_load(ip, loader)
+        # 请求被取消时不影响其他等待同一查询的请求
+        return await asyncio.shield(task)
+
+    def _start_load(self, ip: str, loader: ResultLoader) -> asyncio.Task:
+        """启动一个共享的查询任务"""
+        task = asyncio.create_task(self._load(ip, loader))
+        self._inflight[ip] = task
+
+        def _done(finished: asyncio.Task) -> None:
+            if self._inflight.get(ip) is finished:
+                del self._inflight[ip]
+            # 后台刷新的异常没有调用方读取，在此记录
+            if not finished.cancelled() and finished.exception() is not None:
+                logger.debug(f"查询任务失败 {ip}: {finished.exception()}")
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _load(self, ip: str, loader: ResultLoader) -> IPQueryResult:
+        """查询并写入缓存（开启Redis锁时只有持锁的worker执行查询）
+
+        不会被准入的IP不加锁：结果不会写入Redis，其他worker等待也读不到。
+        """
+        token = None
+        if settings.cache_lock_enabled and self.redis and self.policy.is_admissible(ip):
+            token = uuid.uuid4().hex
+            try:
+                acquired = await self.redis.set(
+                    self._get_lock_key(ip), token,
+                    nx=True, px=int(settings.cache_lock_timeout * 1000)
+                )
+            except Exception as e:
+                logger.warning(f"获取查询锁失败 {ip}: {e}")
+                acquired = True
+                token = None
+
+            if not acquired:
+                token = None
+                result = await self._wait_for_peer(ip)
+                if result is not None:
+                    return result
+
+        try:
+            result = await loader(ip)
+            if not result.error:
+                await self.cache_result(result)
+            return result
+        finally:
+            if token:
+                try:
+                    await self._release_lock(keys=[self._get_lock_key(ip)], args=[token])
+                except Exception as e:
+                    logger.warning(f"释放查询锁失败 {ip}: {e}")
+
+    async def _wait_for_peer(self, ip: str) -> Optional[IPQueryResult]:
+        """等待持锁的worker写入结果，超时返回None"""
+        self.stats["lock_wait_count"] += 1
+        deadline = time.monotonic() + settings.cache_lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.cache_lock_poll_interval)
+            try:
+                generation = self.near_cache.generation
+                cached_data, _ = await self._read_l2(ip)
+                if cached_data:
+                    result = self._restamp(decode_result(cached_data), ip, settings.cache_lock_poll_interval)
+                    self.near_cache.put(ip, result, generation)
+                    self.stats["lock_wait_hit_count"] += 1
+                    return result
+            except Exception as e:
+                logger.warning(f"等待查询结果失败 {ip}: {e}")
+                return None
+        logger.debug(f"等待其他worker查询超时: {ip}")
+        return None
     
-    async def cache_result(self, result: IPQueryResult) -> bool:
-        """缓存查询结果"""
+    async def get_cached_results(self, ips: List[str]) -> Tuple[Dict[str, IPQueryResult], List[str]]:
+        """批量获取缓存的查询结果，返回(按IP索引的命中结果, 未命中的IP列表)
+
+        保留地址由区间表直接应答（同样计入命中结果），再查L1，其余的键通过一次管道往返读取：
+        键数超过cache_mget_chunk_size时拆分为多条MGET，避免单条命令过大阻塞Redis。重复的IP只读取一次。
+        """
+        unique_ips = list(dict.fromkeys(ips))
+        bogons: Dict[str, IPQueryResult] = {}
+        if settings.cache_bogon_enabled:
+            for ip in unique_ips:
+                result = self._lookup_bogon(ip)
+                if result is not None:
+                    bogons[ip] = result
+            if bogons:
+                unique_ips = [ip for ip in unique_ips if ip not in bogons]
+        for ip in unique_ips:
+            self.policy.record(ip)
+        if not self.redis or not unique_ips:
+            return bogons, unique_ips
+
+        hits: Dict[str, IPQueryResult] = {}
+        remote_ips: List[str] = []
+        for ip in unique_ips:
+            result = self.near_cache.get(ip)
+            if result is not None:
+                hits[ip] = result
+            else:
+                remote_ips.append(ip)
+        l1_hits = len(hits)
+
+        if not remote_ips:
+            self.stats["hit_count"] += l1_hits
+            self.stats["l1_hit_count"] += l1_hits
+            self.stats["total_operations"] += l1_hits
+            self.stats["negative_hit_count"] += sum(1 for result in hits.values() if is_negative(result))
+            return {**bogons, **hits}, []
+
+        try:
+            start_time = time.perf_counter()
+            generation = self.near_cache.generation
+            await self._refresh_prefix_index()
+            ip_keys = [self._candidate_keys(ip) for ip in remote_ips]
+            keys = [key for candidates in ip_keys for key in candidates]
+            chunk_size = max(1, settings.cache_mget_chunk_size)
+            chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+            if len(chunks) == 1:
+                values = await self.redis.mget(chunks[0])
+            else:
+                pipe = self.redis.pipeline(transaction=False)
+                for chunk in chunks:
+                    pipe.mget(chunk)
+                values = [value for chunk_values in await pipe.execute() for value in chunk_values]
+        except Exception as e:
+            logger.error(f"批量获取缓存失败: {e}")
+            return {**bogons, **hits}, remote_ips
+
+        query_time = time.perf_counter() - start_time
+        misses: List[str] = []
+        # 同一网段键在本批中只解码一次
+        decoded: Dict[str, Optional[IPQueryResult]] = {}
+        position = 0
+        for ip, candidates in zip(remote_ips, ip_keys):
+            ip_values = values[position:position + len(candidates)]
+            position += len(candidates)
+            key, cached_data = next(
+                ((key, value) for key, value in zip(candidates, ip_values) if value), (None, None)
+            )
+            if cached_data is None:
+                misses.append(ip)
+                continue
+            if key not in decoded:
+                try:
+                    decoded[key] = decode_result(cached_data)
+                except Exception as e:
+                    logger.warning(f"缓存数据解析失败 {key}: {e}")
+                    decoded[key] = None
+            if decoded[key] is None:
+                misses.append(ip)
+                continue
+            result = self._restamp(decoded[key], ip, query_time)
+            hits[ip] = result
+            self.near_cache.put(ip, result, generation)
+
+        # 整批统一更新统计
+        self.stats["hit_count"] += len(hits)
+        self.stats["l1_hit_count"] += l1_hits
+        self.stats["l2_hit_count"] += len(hits) - l1_hits
+        self.stats["miss_count"] += len(misses)
+        self.stats["total_operations"] += len(unique_ips)
+        self.stats["negative_hit_count"] += sum(1 for result in hits.values() if is_negative(result))
+
+        logger.debug(
+            f"批量缓存读取: 保留地址{len(bogons)}个，L1命中{l1_hits}个，"
+            f"L2命中{len(hits) - l1_hits}个，未命中{len(misses)}个"
+        )
+        return {**bogons, **hits}, misses
+
+    async def cache_result(self, result: IPQueryResult, bypass_admission: bool = False) -> bool:
+        """缓存查询结果（bypass_admission为True时跳过准入判断并使用cache_ttl）"""
         if not self.redis or result.error:
             return False
+        if bypass_admission:
+            self.policy.bypass()
+        elif not self.policy.admit(result.ip):
+            return False
         
         try:
-            cache_key = self._get_cache_key(result.ip)
-            
-            # 准备缓存数据
-            cache_data = result.dict()
-            cache_data["cached"] = False  # 存储时标记为非缓存
+            cache_key, index_member = self._get_write_key(result)
+            ttl, negative = self._ttl_for(result, adaptive=not bypass_admission)
             
             # 设置缓存
-            await self.redis.setex(
+            generation = self.near_cache.generation
+            pipe = self.redis.pipeline(transaction=False)
+            if index_member:
+                pipe.sadd(PREFIX_INDEX_KEY, index_member)
+            pipe.setex(
                 cache_key,
-                settings.cache_ttl,
-                json.dumps(cache_data, ensure_ascii=False)
+                ttl,
+                self.serializer.encode(result)
             )
+            self._index_keys(pipe, {cache_key: ttl})
+            await pipe.execute()
+            self.near_cache.put(result.ip, self._as_cached(result), generation)
+            if negative:
+                self.stats["negative_cached_count"] += 1
             
             logger.debug(f"缓存已保存: {result.ip}")
             return True
@@ -130,8 +638,11 @@ class AsyncCacheService:
             logger.error(f"保存缓存失败: {e}")
             return False
     
-    async def cache_batch_results(self, results: List[IPQueryResult]) -> int:
-        """批量缓存查询结果"""
+    async def cache_batch_results(self, results: List[IPQueryResult], bypass_admission: bool = False) -> int:
+        """批量缓存查询结果，返回写入的结果数
+
+        未通过准入判断的结果不写入；bypass_admission为True时（如缓存预热）全部写入并使用cache_ttl。
+        """
         if not self.redis:
             return 0
         
@@ -139,24 +650,42 @@ class AsyncCacheService:
         
         try:
             # 使用管道批量操作
+            generation = self.near_cache.generation
             pipe = self.redis.pipeline()
+            cached_results = []
+            written_keys: Dict[str, int] = {}
+            negative_count = 0
             
             for result in results:
-                if not result.error:
-                    cache_key = self._get_cache_key(result.ip)
-                    cache_data = result.model_dump()
-                    cache_data["cached"] = False
-                    
+                if result.error:
+                    continue
+                if bypass_admission:
+                    self.policy.bypass()
+                elif not self.policy.admit(result.ip):
+                    continue
+                cache_key, index_member = self._get_write_key(result)
+                if index_member:
+                    pipe.sadd(PREFIX_INDEX_KEY, index_member)
+                # 网段键模式下同一网段的多个IP只写入一次
+                if cache_key not in written_keys:
+                    ttl, negative = self._ttl_for(result, adaptive=not bypass_admission)
+                    written_keys[cache_key] = ttl
+                    negative_count += negative
                     pipe.setex(
                         cache_key,
-                        settings.cache_ttl,
-                        json.dumps(cache_data, ensure_ascii=False)
+                        ttl,
+                        self.serializer.encode(result)
                     )
-                    cached_count += 1
+                cached_results.append(result)
+            cached_count = len(cached_results)
+            self._index_keys(pipe, written_keys)
             
             # 执行批量操作
             if cached_count > 0:
                 await pipe.execute()
+                for result in cached_results:
+                    self.near_cache.put(result.ip, self._as_cached(result), generation)
+                self.stats["negative_cached_count"] += negative_count
                 logger.debug(f"批量缓存完成: {cached_count} 条记录")
             
         except Exception as e:
@@ -167,13 +696,44 @@ class AsyncCacheService:
     
     async def get_cache_stats(self) -> CacheStats:
         """获取缓存统计信息"""
+        near_stats = self.near_cache.get_stats()
+        policy_stats = self.policy.get_stats()
+        # 不需要查询数据库即得到结果的请求比例（缓存命中、保留地址、合并到进行中的查询）
+        lookups = self.stats["hit_count"] + self.stats["miss_count"] + self.stats["bogon_count"]
+        served = self.stats["hit_count"] + self.stats["bogon_count"] + self.stats["coalesced_count"]
+        tier_stats = {
+            "l1_enabled": self.near_cache.enabled,
+            "l1_hit_count": self.stats["l1_hit_count"],
+            "l2_hit_count": self.stats["l2_hit_count"],
+            "l1_hit_rate": near_stats["hit_rate"],
+            "l1_size": near_stats["size"],
+            "l1_max_size": near_stats["max_size"],
+            "l1_evictions": near_stats["evictions"],
+            "coalesced_count": self.stats["coalesced_count"],
+            "lock_wait_count": self.stats["lock_wait_count"],
+            "lock_wait_hit_count": self.stats["lock_wait_hit_count"],
+            "stale_served_count": self.stats["stale_served_count"],
+            "background_refresh_count": self.stats["background_refresh_count"],
+            "bogon_count": self.stats["bogon_count"],
+            "negative_hit_count": self.stats["negative_hit_count"],
+            "negative_cached_count": self.stats["negative_cached_count"],
+            "effective_hit_rate": round(served / lookups, 4) if lookups > 0 else 0.0,
+            "policy_enabled": policy_stats["enabled"],
+            "admission_rate": policy_stats["admission_rate"],
+            "admission_rejected_count": policy_stats["rejected"],
+            "avg_ttl": policy_stats["avg_ttl"],
+            "ttl_capped_count": policy_stats["ttl_capped"],
+            "database_build_epoch": policy_stats["build_epoch"]
+        }
+
         if not self.redis:
             return CacheStats(
                 enabled=False,
                 total_keys=0,
                 hit_count=self.stats["hit_count"],
                 miss_count=self.stats["miss_count"],
-                hit_rate=0.0
+                hit_rate=0.0,
+                **tier_stats
             )
         
         try:
@@ -194,7 +754,8 @@ class AsyncCacheService:
                 hit_count=self.stats["hit_count"],
                 miss_count=self.stats["miss_count"],
                 hit_rate=round(hit_rate, 4),
-                memory_usage=info.get("used_memory_human", "N/A")
+                memory_usage=info.get("used_memory_human", "N/A"),
+                **tier_stats
             )
             
         except Exception as e:
@@ -204,32 +765,90 @@ class AsyncCacheService:
                 total_keys=0,
                 hit_count=self.stats["hit_count"],
                 miss_count=self.stats["miss_count"],
-                hit_rate=0.0
+                hit_rate=0.0,
+                **tier_stats
             )
     
-    async def clear_cache(self) -> bool:
-        """清空缓存"""
+    async def claim_once(self, key: str, ttl: int, value: bytes = b"1") -> bool:
+        """以SET NX在各worker间认领一次性任务，只有第一个认领的worker返回True（Redis不可用或出错时为False）"""
         if not self.redis:
             return False
-        
         try:
-            await self.redis.flushdb()
-            logger.info("缓存已清空")
-            return True
-            
+            return bool(await self.redis.set(key, value, nx=True, ex=ttl))
         except Exception as e:
-            logger.error(f"清空缓存失败: {e}")
+            logger.error(f"认领任务失败 {key}: {e}")
             return False
-    
+
+    async def clear_cache(self) -> bool:
+        """清空查询结果缓存（只删除ip_query:*键，同库的频率限制状态等不受影响）"""
+        if not self.redis:
+            return False
+        if await self.purge_results() is None:
+            return False
+        logger.info("缓存已清空")
+        return True
+
+    async def purge_results(self) -> Optional[int]:
+        """删除Redis中的全部查询结果（ip_query:*）并清除各worker的L1，返回删除的键数（失败时为None）
+
+        用于清空缓存和数据库切换（预计更新时间只能截断按计划更新前写入的TTL，手动切换的数据库
+        不会让旧结果过期）。不使用FLUSHDB，同库的频率限制状态等其他键不受影响：
+        SCAN分批遍历（键索引可能未启用或不完整），以UNLINK在后台释放内存；
+        键索引和前缀长度索引整体删除，查询锁不受影响。
+        """
+        if not self.redis:
+            return None
+
+        deleted = 0
+        try:
+            cursor = 0
+            while True:
+                cursor, keys = await self.redis.scan(cursor=cursor, match="ip_query:*", count=PURGE_SCAN_COUNT)
+                if keys:
+                    deleted += await self.redis.unlink(*keys)
+                if cursor == 0:
+                    break
+            await self.redis.unlink(KEY_INDEX, PREFIX_INDEX_KEY)
+            self._prefix_lengths = {4: (), 6: ()}
+            logger.info(f"已删除{deleted}条查询结果缓存")
+        except Exception as e:
+            logger.error(f"删除查询结果缓存失败: {e}")
+            deleted = None
+        await self.invalidate_near_cache()
+        return deleted
+
+    async def purge_for_build(self, build_epoch: Optional[int]) -> Optional[int]:
+        """数据库切换后删除旧数据库的查询结果，返回删除的键数（未认领到或失败时为None）
+
+        每个worker都会各自切换数据库并调用本方法，以SET NX按构建时间认领，只有第一个worker
+        执行SCAN+UNLINK并广播清空L1；其余worker只清空本地L1，不再重复删除其他worker
+        已按新数据库写入的结果。
+        """
+        if build_epoch and not await self.claim_once(f"{PURGE_CLAIM_PREFIX}:{build_epoch}", PURGE_CLAIM_TTL):
+            self.near_cache.clear()
+            return None
+        return await self.purge_results()
+
     async def delete_cache(self, ip: str) -> bool:
         """删除指定IP的缓存"""
         if not self.redis:
             return False
         
         try:
-            cache_key = self._get_cache_key(ip)
-            result = await self.redis.delete(cache_key)
-            return result > 0
+            # 网段键模式下同时删除IP所属网段的缓存（先同步其他worker写入的前缀长度）
+            await self._refresh_prefix_index()
+            keys = self._candidate_keys(ip)
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.unlink(key)
+            pipe.zrem(KEY_INDEX, *keys)
+            deleted = [key for key, count in zip(keys, await pipe.execute()) if count]
+
+            # 网段键上读到的结果按各自的IP存入L1，删除网段键时清除整个网段；
+            # 候选网段从长到短排列，最宽的已删除网段包含其余网段和IP本身
+            networks = [key for key in deleted if "/" in key]
+            await self.invalidate_near_cache(networks[-1].split(":", 1)[1] if networks else ip)
+            return bool(deleted)
             
         except Exception as e:
             logger.error(f"删除缓存失败: {e}")
@@ -0,0 +1,277 @@
+"""
+缓存预热
+从IP查询记录表中选出查询最频繁的IP（网段键模式下按网段聚合），或使用给定的IP列表，
+通过GeoIP批量查询后以管道批量写入Redis，写入速率可限制。
+启动时的预热完成（或超时）之前，就绪检查返回未就绪；多个worker同时启动时只有认领到
+当前数据库构建的一个worker执行预热，其余worker等待其结束。
+"""
+import asyncio
+import ipaddress
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from pydantic import BaseModel, Field
+from sqlalchemy import func, desc
+
+from app.config import settings
+from app.core.logging import get_logger
+from app.database import SessionLocal
+from app.data_management.models import IPQueryRecord, QueryStatus
+from app.services.cache_service import cache_service
+from app.services.geoip_service import geoip_service
+
+logger = get_logger(__name__)
+
+# 网段键模式下先多取若干倍的IP，再按网段聚合
+PREFIX_OVERSAMPLE = 5
+# 按网段聚合查询记录时使用的前缀长度（数据库返回的实际网段在查询后才知道）
+AGGREGATE_PREFIX_LEN = {4: 24, 6: 48}
+# 每批IP交给GeoIP执行器时的分块大小
+LOOKUP_CHUNK_SIZE = 200
+
+# 启动预热的认领键（按数据库构建时间区分，值为执行状态）及其过期时间(秒)，过期前同一构建不再重复预热
+STARTUP_CLAIM_PREFIX = "ip_query_warmup"
+STARTUP_CLAIM_TTL = 3600
+STARTUP_RUNNING = b"running"
+STARTUP_DONE = b"done"
+# 未认领到启动预热的worker检查预热是否结束的间隔(秒)
+STARTUP_POLL_INTERVAL = 1.0
+
+
+class CacheWarmupRequest(BaseModel):
+    """缓存预热请求"""
+    ips: Optional[List[str]] = Field(None, description="要预热的IP列表（为空时从查询记录中选取）")
+    limit: int = Field(10000, ge=1, le=1000000, description="从查询记录中选取的IP数量")
+    days: int = Field(7, ge=1, le=365, description="统计最近多少天的查询记录")
+
+
+class CacheWarmer:
+    """缓存预热器（同一时间只运行一个预热任务）"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        # 启动预热的状态：未配置启动预热时直接视为完成
+        self._startup_pending = False
+        self._startup_deadline = 0.0
+        # 本worker的预热任务，或等待其他worker预热结束的任务
+        self._startup_task: Optional[asyncio.Task] = None
+        # 本worker认领到的启动预热键，预热结束后标记为完成
+        self._startup_claim_key: Optional[str] = None
+        self.progress: Dict[str, Any] = self._new_progress(None, "idle")
+
+    @staticmethod
+    def _new_progress(source: Optional[str], status: str = "pending") -> Dict[str, Any]:
+        """初始化进度信息"""
+        return {
+            "status": status,
+            "source": source,
+            "total": 0,
+            "processed": 0,
+            "cached": 0,
+            "failed": 0,
+            "rate": 0.0,
+            "started_at": None,
+            "finished_at": None,
+            "error": None
+        }
+
+    @property
+    def running(self) -> bool:
+        """是否有预热任务在运行"""
+        return self._task is not None and not self._task.done()
+
+    @property
+    def ready(self) -> bool:
+        """启动预热是否已结束（完成、失败或超过就绪等待时间）"""
+        if not self._startup_pending:
+            return True
+        if (
+            self._startup_task is None
+            or self._startup_task.done()
+            or time.monotonic() >= self._startup_deadline
+        ):
+            self._startup_pending = False
+            return True
+        return False
+
+    def _select_from_records(self, limit: int, days: int) -> List[str]:
+        """从查询记录中选出查询最频繁的IP（在线程池中执行）"""
+        since = datetime.utcnow() - timedelta(days=days)
+        prefix_mode = settings.cache_key_mode == "prefix"
+        fetch_limit = limit * PREFIX_OVERSAMPLE if prefix_mode else limit
+
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(IPQueryRecord.ip_address, func.count(IPQueryRecord.id).label("count"))
+                .filter(
+                    IPQueryRecord.created_at >= since,
+                    IPQueryRecord.status.in_([QueryStatus.SUCCESS.value, QueryStatus.CACHED.value])
+                )
+                .group_by(IPQueryRecord.ip_address)
+                .order_by(desc("count"))
+                .limit(fetch_limit)
+                .all()
+            )
+        finally:
+            db.close()
+
+        if not prefix_mode:
+            return [ip for ip, _ in rows]
+
+        # 网段键模式下同一网段只需预热一个IP，按网段总查询次数排序
+        networks: Dict[Tuple[int, int], List[Any]] = {}
+        for ip, count in rows:
+            try:
+                ip_obj = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            shift = (32 if ip_obj.version == 4 else 128) - AGGREGATE_PREFIX_LEN[ip_obj.version]
+            key = (ip_obj.version, int(ip_obj) >> shift)
+            if key in networks:
+                networks[key][1] += count
+            else:
+                networks[key] = [ip, count]
+        ranked = sorted(networks.values(), key=lambda item: item[1], reverse=True)
+        return [ip for ip, _ in ranked[:limit]]
+
+    async def start(self, request: CacheWarmupRequest) -> Dict[str, Any]:
+        """启动预热任务"""
+        if self.running:
+            raise ValueError("已有缓存预热任务在运行")
+        if not cache_service.redis:
+            raise ValueError("Redis缓存不可用")
+
+        self.progress = self._new_progress("list" if request.ips else "records")
+        self._task = asyncio.create_task(self._run(request))
+        return self.get_progress()
+
+    async def start_on_startup(self) -> None:
+        """应用启动时按配置从查询记录预热，预热结束前就绪检查返回未就绪
+
+        各worker以SET NX认领当前数据库构建的启动预热，未认领到的worker不重复查询和写入，
+        只等待认领者将状态标记为完成（或认领键过期）。
+        """
+        if not cache_service.redis:
+            logger.warning("启动缓存预热跳过: Redis缓存不可用")
+            return
+
+        claim_key = f"{STARTUP_CLAIM_PREFIX}:{cache_service.policy.build_epoch}"
+        if await cache_service.claim_once(claim_key, STARTUP_CLAIM_TTL, STARTUP_RUNNING):
+            request = CacheWarmupRequest(limit=settings.cache_warmup_limit, days=settings.cache_warmup_days)
+            self._startup_claim_key = claim_key
+            try:
+                await self.start(request)
+            except ValueError as e:
+                logger.warning(f"启动缓存预热跳过: {e}")
+                await self._finish_startup_claim()
+                return
+            self._startup_task = self._task
+        else:
+            logger.info("启动缓存预热由其他worker执行，等待其完成")
+            self._startup_task = asyncio.create_task(self._wait_for_claim(claim_key))
+
+        self._startup_pending = True
+        self._startup_deadline = time.monotonic() + settings.cache_warmup_ready_timeout
+
+    async def _finish_startup_claim(self) -> None:
+        """将本worker认领的启动预热标记为完成，其他worker随之就绪"""
+        claim_key, self._startup_claim_key = self._startup_claim_key, None
+        if not claim_key or not cache_service.redis:
+            return
+        try:
+            await cache_service.redis.set(claim_key, STARTUP_DONE, xx=True, ex=STARTUP_CLAIM_TTL)
+        except Exception as e:
+            logger.error(f"标记启动预热完成失败: {e}")
+
+    async def _wait_for_claim(self, claim_key: str) -> None:
+        """等待认领启动预热的worker结束（标记完成或认领键过期）"""
+        while True:
+            try:
+                state = await cache_service.redis.get(claim_key)
+            except Exception as e:
+                logger.warning(f"读取启动预热状态失败，不再等待: {e}")
+                return
+            if state != STARTUP_RUNNING:
+                return
+            await asyncio.sleep(STARTUP_POLL_INTERVAL)
+
+    async def cancel(self) -> bool:
+        """取消正在运行的预热任务"""
+        if self._startup_task is not None and not self._startup_task.done() and self._startup_task is not self._task:
+            self._startup_task.cancel()
+        if not self.running:
+            return False
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def _run(self, request: CacheWarmupRequest) -> None:
+        """执行预热"""
+        progress = self.progress
+        progress["status"] = "running"
+        progress["started_at"] = datetime.utcnow().isoformat()
+        start_time = time.monotonic()
+
+        try:
+            if request.ips:
+                ips = list(dict.fromkeys(ip.strip() for ip in request.ips if ip.strip()))
+            else:
+                ips = await asyncio.get_event_loop().run_in_executor(
+                    None, self._select_from_records, request.limit, request.days
+                )
+            progress["total"] = len(ips)
+            logger.info(f"开始缓存预热: {len(ips)} 个IP（来源: {progress['source']}）")
+
+            batch_size = max(1, settings.cache_warmup_batch_size)
+            rate = settings.cache_warmup_rate
+            for offset in range(0, len(ips), batch_size):
+                chunk = ips[offset:offset + batch_size]
+                columns = await geoip_service.query_batch_columns(chunk, batch_size=LOOKUP_CHUNK_SIZE)
+                results = geoip_service.build_results(columns)
+                # 预热的IP来自查询记录或指定列表，跳过准入判断
+                progress["cached"] += await cache_service.cache_batch_results(results, bypass_admission=True)
+                progress["failed"] += sum(1 for result in results if result.error)
+                progress["processed"] += len(chunk)
+
+                elapsed = time.monotonic() - start_time
+                progress["rate"] = round(progress["processed"] / elapsed, 1) if elapsed > 0 else 0.0
+                # 限制写入速率，避免预热期间占满Redis和GeoIP查询资源
+                if rate > 0:
+                    delay = progress["processed"] / rate - elapsed
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+            progress["status"] = "completed"
+            logger.info(
+                f"缓存预热完成: 写入{progress['cached']}个，失败{progress['failed']}个，"
+                f"耗时{time.monotonic() - start_time:.1f}秒"
+            )
+        except asyncio.CancelledError:
+            progress["status"] = "cancelled"
+            logger.info("缓存预热已取消")
+            raise
+        except Exception as e:
+            progress["status"] = "failed"
+            progress["error"] = str(e)
+            logger.error(f"缓存预热失败: {e}")
+        finally:
+            progress["finished_at"] = datetime.utcnow().isoformat()
+            await self._finish_startup_claim()
+
+    def get_progress(self) -> Dict[str, Any]:
+        """获取预热进度"""
+        progress = dict(self.progress)
+        progress["percent"] = (
+            round(progress["processed"] / progress["total"] * 100, 2) if progress["total"] else 0.0
+        )
+        progress["ready"] = self.ready
+        return progress
+
+
+# 全局预热器实例
+cache_warmer = CacheWarmer()
@@ -0,0 +1,80 @@
+"""
+GeoIP原始记录合并
+将maxminddb原始记录合并为与LocationInfo/ISPInfo字段一致的字典，
+在线查询和离线快照构建共用同一套合并规则
+"""
+from typing import Optional, Dict, Any
+
+from app.models.schemas import LocationInfo, ISPInfo
+
+# 合并记录的空模板（字段与LocationInfo/ISPInfo一致）
+EMPTY_LOCATION: Dict[str, Any] = {field: None for field in LocationInfo.model_fields}
+EMPTY_ISP: Dict[str, Any] = {field: None for field in ISPInfo.model_fields}
+
+# 字段顺序（用于按元组存储或传输结果行）
+LOCATION_FIELDS = tuple(EMPTY_LOCATION)
+ISP_FIELDS = tuple(EMPTY_ISP)
+
+# 名称字段使用的语言（与geoip2.database.Reader默认locales一致）
+NAME_LOCALE = "en"
+
+
+def get_name(node: Dict[str, Any]) -> Optional[str]:
+    """获取记录节点的名称"""
+    names = node.get("names")
+    return names.get(NAME_LOCALE) if names else None
+
+
+def merge_asn(isp: Dict[str, Any], asn_number: int, asn_organization: Optional[str]) -> None:
+    """合并ASN信息到ISP记录"""
+    isp["asn"] = str(asn_number)
+    isp["asn_organization"] = asn_organization
+    isp["isp"] = asn_organization
+    isp["organization"] = asn_organization
+
+
+def merge_city_record(record: Dict[str, Any], location: Dict[str, Any], isp: Dict[str, Any]) -> None:
+    """将城市数据库的原始记录合并到位置和ISP信息中"""
+    country = record.get("country")
+    if country:
+        location["country"] = get_name(country)
+        location["country_code"] = country.get("iso_code")
+
+    subdivisions = record.get("subdivisions")
+    if subdivisions:
+        most_specific = subdivisions[-1]
+        location["region"] = get_name(most_specific)
+        location["region_code"] = most_specific.get("iso_code")
+
+    city = record.get("city")
+    if city:
+        location["city"] = get_name(city)
+
+    postal = record.get("postal")
+    if postal:
+        location["postal_code"] = postal.get("code")
+
+    geo = record.get("location")
+    if geo:
+        latitude = geo.get("latitude")
+        longitude = geo.get("longitude")
+        location["latitude"] = float(latitude) if latitude else None
+        location["longitude"] = float(longitude) if longitude else None
+        location["timezone"] = geo.get("time_zone")
+
+    traits = record.get("traits")
+    if traits and traits.get("autonomous_system_number"):
+        merge_asn(isp, traits["autonomous_system_number"], traits.get("autonomous_system_organization"))
+
+
+def merge_country_record(record: Dict[str, Any], location: Dict[str, Any]) -> None:
+    """将国家数据库的原始记录合并到位置信息中"""
+    country = record.get("country") or {}
+    location["country"] = get_name(country)
+    location["country_code"] = country.get("iso_code")
+
+
+def merge_asn_record(record: Dict[str, Any], isp: Dict[str, Any]) -> None:
+    """将ASN数据库的原始记录合并到ISP信息中"""
+    if record.get("autonomous_system_number"):
+        merge_asn(isp, record["autonomous_system_number"], record.get("autonomous_system_organization"))
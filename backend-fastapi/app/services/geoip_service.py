@@ -3,35 +3,68 @@
 提供高性能的IP地理位置查询功能
 """
 import asyncio
+import multiprocessing
+import os
+import threading
 import time
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 from pathlib import Path
 import geoip2.database
-import geoip2.errors
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from app.config import settings
 from app.core.logging import get_logger
 from app.core.exceptions import GeoIPException
 from app.models.schemas import IPQueryResult, LocationInfo, ISPInfo
+from app.services.geoip_records import (
+    EMPTY_LOCATION, EMPTY_ISP, merge_city_record, merge_country_record, merge_asn_record
+)
+from app.services.prefix_cache import PrefixLRUCache, ADDRESS_BITS, parse_ip
+from app.services.isp_ranges import ISPRangeTable
+from app.services.geoip_snapshot import GeoIPSnapshot
+from app.services.reader_set import ReaderSet, SHARED_READER_MODES, get_file_signature
+from app.services import lookup_pool
 
 logger = get_logger(__name__)
 
+# 可配置的查询执行方式
+EXECUTOR_MODES = ("thread", "process", "inline")
+
+
+def _raw_lookup(reader: geoip2.database.Reader, ip: str) -> Tuple[Optional[Dict[str, Any]], int]:
+    """在底层maxminddb读取器上查找IP，返回原始记录和网络前缀长度"""
+    return reader._db_reader.get_with_prefix_len(ip)
+
 
 class AsyncGeoIPService:
     """异步GeoIP查询服务"""
 
     def __init__(self):
-        self.db_reader: Optional[geoip2.database.Reader] = None  # 城市数据库读取器
-        self.asn_reader: Optional[geoip2.database.Reader] = None  # ASN数据库读取器
-        self.country_reader: Optional[geoip2.database.Reader] = None  # 国家数据库读取器
+        # 当前生效的读取器集合，切换时整体替换
+        self.readers: ReaderSet = ReaderSet()
         self.executor: Optional[ThreadPoolExecutor] = None
+        # 进程池模式下执行批量查询的进程池，worker各自打开当前读取器集合对应的数据库
+        self.process_pool: Optional[ProcessPoolExecutor] = None
+        self._process_pool_restart: Optional[asyncio.Task] = None
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        # 读取器切换后的回调（如清除依赖旧数据库结果的缓存）
+        self._reload_listeners: List[Callable[[], Awaitable[None]]] = []
         # 独立的数据库文件选择
         self.current_city_db: str = ""     # 当前使用的城市数据库文件key
         self.current_asn_db: str = ""      # 当前使用的ASN数据库文件key
         self.current_country_db: str = ""  # 当前使用的国家数据库文件key
+        self.current_snapshot_db: str = "" # 当前使用的合并快照文件key（选中时替代上面三个数据库）
         self.available_databases = {}      # 存储可用的数据库信息
+        # 进程内网络前缀结果缓存
+        self.result_cache = PrefixLRUCache(
+            max_size=settings.geoip_cache_max_size,
+            ttl=settings.geoip_cache_ttl
+        )
+        # 预编译的ISP推断区间表
+        self.isp_ranges = ISPRangeTable(settings.geoip_isp_ranges_file)
         self.stats = {
             "total_queries": 0,
             "successful_queries": 0,
@@ -41,26 +74,64 @@ class AsyncGeoIPService:
             "current_city_db": "",
             "current_asn_db": "",
             "current_country_db": "",
-            "available_databases": []
+            "current_snapshot_db": "",
+            "available_databases": [],
+            "reader_version": 0,
+            "reloads": 0,
+            "auto_reloads": 0,
+            "reload_failures": 0
         }
-
-    def _close_readers(self, readers: List[geoip2.database.Reader]) -> None:
-        """批量关闭数据库读取器（同步方法，在线程池中执行）"""
-        for reader in readers:
-            try:
-                reader.close()
-            except Exception as e:
-                logger.warning(f"关闭数据库读取器时出错: {e}")
+        # 各查询阶段耗时统计（city/country/asn/infer），由线程池中的查询线程更新
+        self.stage_stats = {
+            stage: {"count": 0, "total_time": 0.0}
+            for stage in ("snapshot", "city", "country", "asn", "infer")
+        }
+        self._stage_lock = threading.Lock()
+
+    @property
+    def db_reader(self) -> Optional[geoip2.database.Reader]:
+        """城市数据库读取器"""
+        return self.readers.city_reader
+
+    @property
+    def asn_reader(self) -> Optional[geoip2.database.Reader]:
+        """ASN数据库读取器"""
+        return self.readers.asn_reader
+
+    @property
+    def country_reader(self) -> Optional[geoip2.database.Reader]:
+        """国家数据库读取器"""
+        return self.readers.country_reader
+
+    @property
+    def snapshot(self) -> Optional[GeoIPSnapshot]:
+        """合并快照"""
+        return self.readers.snapshot
+
+    def _acquire_readers(self) -> ReaderSet:
+        """获取当前读取器集合并登记进行中的查询，调用方需在结束后release"""
+        while True:
+            readers = self.readers
+            if readers.acquire():
+                return readers
 
     async def initialize(self) -> None:
         """初始化GeoIP服务"""
         try:
-            # 创建线程池执行器
+            if settings.geoip_executor_mode not in EXECUTOR_MODES:
+                raise ValueError(
+                    f"不支持的查询执行方式: {settings.geoip_executor_mode}，可选值: {', '.join(EXECUTOR_MODES)}"
+                )
+
+            # 创建线程池执行器（进程池模式下仍用于单IP查询和打开读取器）
             self.executor = ThreadPoolExecutor(
                 max_workers=settings.concurrent_limit,
                 thread_name_prefix="geoip"
             )
 
+            # 编译ISP推断区间表
+            self.isp_ranges.load()
+
             # 扫描可用的数据库
             await self._scan_available_databases()
 
@@ -70,6 +141,13 @@ class AsyncGeoIPService:
             # 初始化数据库读取器
             await self._initialize_readers()
 
+            # 报告各数据库实际加载的读取器模式
+            self._report_reader_modes()
+
+            # 启动数据库文件变化监测
+            if settings.geoip_auto_reload and self._watch_task is None:
+                self._watch_task = asyncio.create_task(self._watch_database_files())
+
             logger.info(f"GeoIP服务初始化成功，城市数据库: {self.current_city_db}, ASN数据库: {self.current_asn_db}")
 
         except Exception as e:
@@ -120,6 +198,8 @@ class AsyncGeoIPService:
                 return db_key == self.current_asn_db and self.asn_reader is not None
             elif db_info["type"] == "country":
                 return db_key == self.current_country_db and self.country_reader is not None
+            elif db_info["type"] == "snapshot":
+                return db_key == self.current_snapshot_db and self.snapshot is not None
             return False
         except:
             return False
@@ -133,6 +213,7 @@ class AsyncGeoIPService:
         api_city_path = Path("API/GeoLite2-City.mmdb")
         api_asn_path = Path("API/GeoLite2-ASN.mmdb")
         api_country_path = Path("API/GeoLite2-Country.mmdb")
+        api_snapshot_path = Path(settings.geoip_snapshot_path)
 
         if api_city_path.exists():
             db_key = "api_city"
@@ -173,7 +254,24 @@ class AsyncGeoIPService:
             }
             available_db_keys.append(db_key)
 
+        if api_snapshot_path.exists():
+            db_key = "api_snapshot"
+            self.available_databases[db_key] = {
+                "key": db_key,
+                "path": str(api_snapshot_path),
+                "type": "snapshot",
+                "source_location": "API目录",
+                "display_name": f"合并快照 (API目录)",
+                "file_name": api_snapshot_path.name,
+                **self._get_file_info(api_snapshot_path)
+            }
+            available_db_keys.append(db_key)
+
         self.stats["available_databases"] = available_db_keys
+
+        # ISP区间覆盖文件有变化时重新编译，并使旧的推断结果失效
+        if self.isp_ranges.reload_if_changed():
+            self.result_cache.clear()
         logger.info(f"发现可用数据库文件: {len(self.available_databases)} 个")
         logger.info(f"可用数据库: {available_db_keys}")
 
@@ -205,281 +303,385 @@ class AsyncGeoIPService:
             # 选择API目录的国家数据库
             self.current_country_db = country_dbs[0]  # 现在只有api_country
 
+        # 配置为优先使用合并快照时选择快照
+        snapshot_dbs = [key for key, db in self.available_databases.items() if db["type"] == "snapshot"]
+        if snapshot_dbs and settings.geoip_prefer_snapshot:
+            self.current_snapshot_db = snapshot_dbs[0]
+
         # 更新统计信息
         self.stats["current_city_db"] = self.current_city_db
         self.stats["current_asn_db"] = self.current_asn_db
         self.stats["current_country_db"] = self.current_country_db
+        self.stats["current_snapshot_db"] = self.current_snapshot_db
 
         logger.info(f"默认数据库设置 - 城市: {self.current_city_db}, ASN: {self.current_asn_db}, 国家: {self.current_country_db}")
 
     async def _initialize_readers(self) -> None:
-        """根据当前数据源初始化读取器"""
-        try:
-            # 关闭现有读取器（优化：批量关闭以减少事件循环调用）
-            readers_to_close = []
-            if self.db_reader:
-                readers_to_close.append(self.db_reader)
-                self.db_reader = None
-            if self.asn_reader:
-                readers_to_close.append(self.asn_reader)
-                self.asn_reader = None
-            if self.country_reader:
-                readers_to_close.append(self.country_reader)
-                self.country_reader = None
-
-            # 批量关闭读取器
-            if readers_to_close:
-                await asyncio.get_event_loop().run_in_executor(
-                    self.executor, self._close_readers, readers_to_close
-                )
-
-            # 根据选择的数据库文件获取路径
-            city_db_path = None
-            asn_db_path = None
-            country_db_path = None
-
-            # 获取城市数据库路径
-            if self.current_city_db and self.current_city_db in self.available_databases:
-                city_db_info = self.available_databases[self.current_city_db]
-                city_db_path = city_db_info["path"]
-
-            # 获取ASN数据库路径
-            if self.current_asn_db and self.current_asn_db in self.available_databases:
-                asn_db_info = self.available_databases[self.current_asn_db]
-                asn_db_path = asn_db_info["path"]
-
-            # 获取国家数据库路径
-            if self.current_country_db and self.current_country_db in self.available_databases:
-                country_db_info = self.available_databases[self.current_country_db]
-                country_db_path = country_db_info["path"]
-
-            # 初始化城市数据库
-            if city_db_path and Path(city_db_path).exists():
-                self.db_reader = await asyncio.get_event_loop().run_in_executor(
-                    self.executor,
-                    geoip2.database.Reader,
-                    city_db_path
-                )
+        """根据当前选择的数据库文件初始化读取器
 
-                logger.info(f"城市数据库初始化成功: {city_db_path} ({self.current_city_db})")
-            else:
-                logger.warning(f"未找到可用的城市数据库: {self.current_city_db}")
+        新读取器在线程池中打开并预热，完成后通过一次引用替换生效；
+        旧读取器在进行中的查询结束后才关闭，切换期间查询不会遇到已关闭或为空的读取器。
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
 
-            # 初始化ASN数据库
-            if asn_db_path and Path(asn_db_path).exists():
-                self.asn_reader = await asyncio.get_event_loop().run_in_executor(
+        async with self._reload_lock:
+            try:
+                # 根据选择的数据库文件获取路径
+                city_db_path = self._get_database_path(self.current_city_db)
+                asn_db_path = self._get_database_path(self.current_asn_db)
+                country_db_path = self._get_database_path(self.current_country_db)
+                snapshot_db_path = self._get_database_path(self.current_snapshot_db)
+
+                if not city_db_path:
+                    logger.warning(f"未找到可用的城市数据库: {self.current_city_db}")
+                if not asn_db_path:
+                    logger.warning(f"未找到可用的ASN数据库: {self.current_asn_db}")
+                if not country_db_path:
+                    logger.warning(f"未找到可用的国家数据库: {self.current_country_db}")
+
+                # 在后台打开并预热新的读取器集合
+                new_readers = await asyncio.get_event_loop().run_in_executor(
                     self.executor,
-                    geoip2.database.Reader,
-                    asn_db_path
+                    ReaderSet.open,
+                    self.readers.version + 1,
+                    city_db_path,
+                    asn_db_path,
+                    country_db_path,
+                    settings.geoip_reader_mode,
+                    settings.geoip_require_shared_pages,
+                    snapshot_db_path
                 )
 
-                logger.info(f"ASN数据库初始化成功: {asn_db_path} ({self.current_asn_db})")
-            else:
-                logger.warning(f"未找到可用的ASN数据库: {self.current_asn_db}")
+                # 原子替换，旧集合在进行中的查询结束后关闭
+                old_readers = self.readers
+                self.readers = new_readers
+                old_readers.retire()
+
+                # 数据库已变更，清空进程内前缀缓存
+                self.result_cache.clear()
+                await self._notify_reload_listeners()
+
+                if new_readers.snapshot:
+                    logger.info(f"合并快照初始化成功: {snapshot_db_path} ({self.current_snapshot_db})")
+                if new_readers.city_reader:
+                    logger.info(f"城市数据库初始化成功: {city_db_path} ({self.current_city_db})")
+                if new_readers.asn_reader:
+                    logger.info(f"ASN数据库初始化成功: {asn_db_path} ({self.current_asn_db})")
+                if new_readers.country_reader:
+                    logger.info(f"国家数据库初始化成功: {country_db_path} ({self.current_country_db})")
+
+                # 更新统计信息
+                self.stats["current_city_db"] = self.current_city_db
+                self.stats["current_asn_db"] = self.current_asn_db
+                self.stats["current_country_db"] = self.current_country_db
+                self.stats["current_snapshot_db"] = self.current_snapshot_db
+                self.stats["reader_version"] = new_readers.version
+                self.stats["reloads"] += 1
+
+                # 更新数据库状态
+                self._update_database_status()
+
+                # 进程池worker持有各自的读取器，随读取器集合一起替换
+                if settings.geoip_executor_mode == "process":
+                    await self._restart_process_pool()
 
-            # 初始化国家数据库
-            if country_db_path and Path(country_db_path).exists():
-                self.country_reader = await asyncio.get_event_loop().run_in_executor(
-                    self.executor,
-                    geoip2.database.Reader,
-                    country_db_path
-                )
+            except Exception as e:
+                self.stats["reload_failures"] += 1
+                logger.error(f"初始化数据库读取器失败: {e}")
+                raise
 
-                logger.info(f"国家数据库初始化成功: {country_db_path} ({self.current_country_db})")
-            else:
-                logger.warning(f"未找到可用的国家数据库: {self.current_country_db}")
+    def add_reload_listener(self, listener: Callable[[], Awaitable[None]]) -> None:
+        """注册读取器切换后的回调"""
+        self._reload_listeners.append(listener)
 
-            # 更新统计信息
-            self.stats["current_city_db"] = self.current_city_db
-            self.stats["current_asn_db"] = self.current_asn_db
-            self.stats["current_country_db"] = self.current_country_db
+    async def _notify_reload_listeners(self) -> None:
+        """通知读取器已切换（回调失败不影响切换本身）"""
+        for listener in self._reload_listeners:
+            try:
+                await listener()
+            except Exception as e:
+                logger.error(f"数据库切换回调执行失败: {e}")
 
-            # 更新数据库状态
-            self._update_database_status()
+    def get_reader_config(self) -> Dict[str, Any]:
+        """当前生效的数据库文件和读取器模式，供其他进程打开相同的数据库"""
+        return {
+            "version": self.readers.version,
+            "city_path": self._get_database_path(self.current_city_db),
+            "asn_path": self._get_database_path(self.current_asn_db),
+            "country_path": self._get_database_path(self.current_country_db),
+            "snapshot_path": self._get_database_path(self.current_snapshot_db),
+            "mode": settings.geoip_reader_mode,
+            "require_shared": settings.geoip_require_shared_pages
+        }
 
-        except Exception as e:
-            logger.error(f"初始化数据库读取器失败: {e}")
+    def open_readers_sync(self, config: Dict[str, Any]) -> None:
+        """按get_reader_config的结果在当前进程中打开读取器（不创建线程池和文件监测）"""
+        self.isp_ranges.load()
+        new_readers = ReaderSet.open(
+            config["version"],
+            config["city_path"],
+            config["asn_path"],
+            config["country_path"],
+            config["mode"],
+            config["require_shared"],
+            config["snapshot_path"]
+        )
+        old_readers = self.readers
+        self.readers = new_readers
+        old_readers.retire()
+        self.result_cache.clear()
+
+    async def _restart_process_pool(self) -> None:
+        """创建并预热新的进程池，就绪后替换旧进程池
+
+        worker进程按当前读取器集合打开数据库，旧进程池中进行中的分块完成后退出。
+        """
+        workers = settings.geoip_process_workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=lookup_pool.init_worker,
+            initargs=(self.get_reader_config(),)
+        )
+        try:
+            loop = asyncio.get_event_loop()
+            await asyncio.gather(*[
+                loop.run_in_executor(pool, lookup_pool.lookup_items, [])
+                for _ in range(workers)
+            ])
+        except Exception:
+            pool.shutdown(wait=False, cancel_futures=True)
             raise
-    
+
+        old_pool = self.process_pool
+        self.process_pool = pool
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+        logger.info(f"GeoIP查询进程池已就绪: {workers} 个worker，读取器集合 v{self.readers.version}")
+
+    def _on_process_pool_broken(self) -> None:
+        """进程池中有worker异常退出，后台重建进程池（期间批量查询回退到线程池）"""
+        self.process_pool = None
+        if self._process_pool_restart is None or self._process_pool_restart.done():
+            logger.error("GeoIP查询进程池不可用，正在重建")
+            self._process_pool_restart = asyncio.create_task(self._restart_process_pool())
+
+    def _report_reader_modes(self) -> None:
+        """输出各数据库实际加载的读取器模式"""
+        modes = self.readers.modes
+        if not modes:
+            return
+
+        summary = ", ".join(f"{name}={info['mode']}" for name, info in modes.items())
+        logger.info(f"GeoIP读取器模式(请求: {settings.geoip_reader_mode}): {summary}")
+
+        private_readers = [name for name, info in modes.items() if info["mode"] not in SHARED_READER_MODES]
+        if private_readers:
+            private_mb = sum(modes[name]["size_bytes"] for name in private_readers) / (1024 * 1024)
+            logger.warning(
+                f"数据库 {', '.join(private_readers)} 未使用共享内存映射，"
+                f"每个worker进程将额外占用约 {private_mb:.1f} MB"
+            )
+
+    def _get_database_path(self, db_key: str) -> Optional[str]:
+        """获取数据库key对应的文件路径"""
+        if db_key and db_key in self.available_databases:
+            return self.available_databases[db_key]["path"]
+        return None
+
+    def _database_files_changed(self) -> bool:
+        """检查当前使用的数据库文件是否有变化（新增、替换或删除）"""
+        selected_paths = [
+            self._get_database_path(db_key)
+            for db_key in (
+                (self.current_snapshot_db,) if self.current_snapshot_db
+                else (self.current_city_db, self.current_asn_db, self.current_country_db)
+            )
+        ]
+        current_signatures = {
+            path: get_file_signature(path)
+            for path in selected_paths if path
+        }
+        return current_signatures != self.readers.file_signatures
+
+    async def _watch_database_files(self) -> None:
+        """定期检查API目录中的数据库文件，变化稳定后自动热加载"""
+        pending_signatures = None
+        while True:
+            try:
+                await asyncio.sleep(settings.geoip_reload_check_interval)
+
+                await self._scan_available_databases()
+                if not self.current_city_db and not self.current_asn_db and not self.current_country_db:
+                    await self._set_default_databases()
+
+                if not self._database_files_changed():
+                    pending_signatures = None
+                    continue
+
+                # 文件可能仍在写入，等待签名在两次检查间保持不变后再加载
+                signatures = {
+                    path: get_file_signature(path)
+                    for path in (db["path"] for db in self.available_databases.values())
+                }
+                if signatures != pending_signatures:
+                    pending_signatures = signatures
+                    continue
+
+                logger.info("检测到数据库文件更新，开始热加载")
+                await self._initialize_readers()
+                self.stats["auto_reloads"] += 1
+                pending_signatures = None
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"数据库文件热加载失败: {e}")
+
     async def close(self) -> None:
         """关闭GeoIP服务"""
         try:
-            if self.db_reader:
-                await asyncio.get_event_loop().run_in_executor(
-                    self.executor,
-                    self.db_reader.close
-                )
-                self.db_reader = None
+            if self._watch_task:
+                self._watch_task.cancel()
+                try:
+                    await self._watch_task
+                except asyncio.CancelledError:
+                    pass
+                self._watch_task = None
 
-            if self.asn_reader:
-                await asyncio.get_event_loop().run_in_executor(
-                    self.executor,
-                    self.asn_reader.close
-                )
-                self.asn_reader = None
+            old_readers = self.readers
+            self.readers = ReaderSet(version=old_readers.version + 1)
+            old_readers.retire()
 
-            if self.country_reader:
-                await asyncio.get_event_loop().run_in_executor(
-                    self.executor,
-                    self.country_reader.close
-                )
-                self.country_reader = None
+            if self._process_pool_restart is not None:
+                self._process_pool_restart.cancel()
+                self._process_pool_restart = None
+
+            if self.process_pool:
+                self.process_pool.shutdown(wait=True, cancel_futures=True)
+                self.process_pool = None
 
             if self.executor:
                 self.executor.shutdown(wait=True)
                 self.executor = None
 
             logger.info("GeoIP服务已关闭")
-            
+
         except Exception as e:
             logger.error(f"关闭GeoIP服务时出错: {e}")
-    
+
+    def _record_stage(self, stage: str, elapsed: float) -> None:
+        """记录查询阶段耗时"""
+        stage_stats = self.stage_stats[stage]
+        with self._stage_lock:
+            stage_stats["count"] += 1
+            stage_stats["total_time"] += elapsed
+
+    def _get_stage_timings(self) -> Dict[str, Any]:
+        """获取各查询阶段的耗时统计"""
+        with self._stage_lock:
+            snapshot = {stage: (stats["count"], stats["total_time"]) for stage, stats in self.stage_stats.items()}
+
+        timings = {}
+        for stage, (count, total_time) in snapshot.items():
+            timings[stage] = {
+                "count": count,
+                "total_time": round(total_time, 6),
+                "avg_time_ms": round(total_time / count * 1000, 4) if count else 0.0
+            }
+        return timings
+
     def _query_ip_sync(self, ip: str) -> Dict[str, Any]:
         """同步查询IP信息（在线程池中执行）"""
+        readers = self._acquire_readers()
         try:
-            # 初始化位置信息
-            location = LocationInfo()
+            return self._lookup_merged(ip, readers)
+        finally:
+            readers.release()
 
-            # 优先使用城市数据库获取详细位置信息
-            if self.db_reader:
-                try:
-                    response = self.db_reader.city(ip)
-                    location = LocationInfo(
-                        country=response.country.name,
-                        country_code=response.country.iso_code,
-                        region=response.subdivisions.most_specific.name,
-                        region_code=response.subdivisions.most_specific.iso_code,
-                        city=response.city.name,
-                        postal_code=response.postal.code,
-                        latitude=float(response.location.latitude) if response.location.latitude else None,
-                        longitude=float(response.location.longitude) if response.location.longitude else None,
-                        timezone=response.location.time_zone
-                    )
-                except geoip2.errors.AddressNotFoundError:
-                    # 如果城市数据库中找不到，继续尝试其他数据库
-                    pass
-
-            # 如果没有城市数据库或城市数据库中找不到，尝试使用国家数据库
-            if not location.country and self.country_reader:
-                try:
-                    country_response = self.country_reader.country(ip)
-                    location.country = country_response.country.name
-                    location.country_code = country_response.country.iso_code
-                except geoip2.errors.AddressNotFoundError:
-                    pass
-            
-            # 提取ISP信息
-            isp = ISPInfo()
+    def _lookup_merged(self, ip: str, readers: ReaderSet) -> Dict[str, Any]:
+        """在指定读取器集合上查询IP并合并结果
 
-            # 首先尝试从城市数据库获取ASN信息
-            if self.db_reader:
-                try:
-                    city_response = self.db_reader.city(ip)
-                    if hasattr(city_response, 'traits') and city_response.traits.autonomous_system_number:
-                        isp.asn = str(city_response.traits.autonomous_system_number)
-                        isp.asn_organization = city_response.traits.autonomous_system_organization
-                        isp.isp = city_response.traits.autonomous_system_organization
-                        isp.organization = city_response.traits.autonomous_system_organization
-                except:
-                    pass
-
-            # 如果有专门的ASN数据库，使用它获取更详细的ISP信息
-            if self.asn_reader and (not isp.asn or not isp.isp):
-                try:
-                    asn_response = self.asn_reader.asn(ip)
-                    if asn_response.autonomous_system_number:
-                        isp.asn = str(asn_response.autonomous_system_number)
-                        isp.asn_organization = asn_response.autonomous_system_organization
-                        isp.isp = asn_response.autonomous_system_organization
-                        isp.organization = asn_response.autonomous_system_organization
-                except:
-                    pass
+        每个数据库最多遍历一次，直接读取底层maxminddb记录合并为一条结果，
+        避免重复的城市库查询和geoip2模型构建开销。
+        """
+        try:
+            location = dict(EMPTY_LOCATION)
+            isp = dict(EMPTY_ISP)
+            # 合并结果适用的网络前缀长度，取所有参与查询的数据库中最长的前缀
+            prefix_len = 0
+
+            # 合并快照：一次二分查找同时得到位置和ISP信息
+            if readers.snapshot:
+                stage_start = time.perf_counter()
+                row, prefix_len = readers.snapshot.lookup(ip)
+                if row:
+                    location.update(row[0])
+                    isp.update(row[1])
+                self._record_stage("snapshot", time.perf_counter() - stage_start)
+
+            # 城市数据库：一次查询同时提取位置信息和ASN特征
+            if readers.city_reader:
+                stage_start = time.perf_counter()
+                record, record_prefix = _raw_lookup(readers.city_reader, ip)
+                prefix_len = max(prefix_len, record_prefix)
+                if record:
+                    merge_city_record(record, location, isp)
+                self._record_stage("city", time.perf_counter() - stage_start)
+
+            # 城市数据库中没有国家信息时，回退到国家数据库
+            if not location["country"] and readers.country_reader:
+                stage_start = time.perf_counter()
+                record, record_prefix = _raw_lookup(readers.country_reader, ip)
+                prefix_len = max(prefix_len, record_prefix)
+                if record:
+                    merge_country_record(record, location)
+                self._record_stage("country", time.perf_counter() - stage_start)
+
+            # 城市数据库没有ASN信息时，使用专门的ASN数据库
+            if readers.asn_reader and (not isp["asn"] or not isp["isp"]):
+                stage_start = time.perf_counter()
+                record, record_prefix = _raw_lookup(readers.asn_reader, ip)
+                prefix_len = max(prefix_len, record_prefix)
+                if record:
+                    merge_asn_record(record, isp)
+                self._record_stage("asn", time.perf_counter() - stage_start)
 
             # 如果仍然没有ISP信息，尝试根据IP段推断
-            if not isp.isp:
-                isp_info = self._infer_isp_from_ip(ip)
+            if not isp["isp"]:
+                stage_start = time.perf_counter()
+                isp_info, infer_prefix = self._infer_isp_from_ip(ip)
+                # 推断结果只在命中区间（或空隙）对应的网段内保持一致
+                prefix_len = max(prefix_len, infer_prefix)
                 if isp_info:
-                    isp.isp = isp_info.get('isp')
-                    isp.organization = isp_info.get('organization')
-            
+                    isp["isp"] = isp_info.get('isp')
+                    isp["organization"] = isp_info.get('organization')
+                self._record_stage("infer", time.perf_counter() - stage_start)
+
             return {
-                "location": location.dict(),
-                "isp": isp.dict(),
+                "location": location,
+                "isp": isp,
+                "prefix_len": prefix_len,
                 "success": True
             }
-            
-        except geoip2.errors.AddressNotFoundError:
-            return {
-                "location": LocationInfo().model_dump(),
-                "isp": ISPInfo().model_dump(),
-                "success": False,
-                "error": "IP地址未找到地理位置信息"
-            }
+
         except Exception as e:
             return {
-                "location": LocationInfo().dict(),
-                "isp": ISPInfo().dict(),
+                "location": dict(EMPTY_LOCATION),
+                "isp": dict(EMPTY_ISP),
                 "success": False,
                 "error": str(e)
             }
 
-    def _infer_isp_from_ip(self, ip: str) -> Optional[Dict[str, str]]:
-        """根据IP地址推断ISP信息"""
+    def _infer_isp_from_ip(self, ip: str) -> Tuple[Optional[Dict[str, str]], int]:
+        """根据IP地址推断ISP信息（预编译区间表二分查找），返回(ISP信息, 结果适用的网段前缀长度)"""
         try:
-            import ipaddress
-            ip_obj = ipaddress.ip_address(ip)
-
-            # 知名的公共DNS和CDN服务
-            known_ranges = {
-                # Google DNS
-                "8.8.8.0/24": {"isp": "Google LLC", "organization": "Google Public DNS"},
-                "8.8.4.0/24": {"isp": "Google LLC", "organization": "Google Public DNS"},
-
-                # Cloudflare DNS
-                "1.1.1.0/24": {"isp": "Cloudflare, Inc.", "organization": "Cloudflare DNS"},
-                "1.0.0.0/24": {"isp": "Cloudflare, Inc.", "organization": "Cloudflare DNS"},
-
-                # Quad9 DNS
-                "9.9.9.0/24": {"isp": "Quad9", "organization": "Quad9 DNS"},
-
-                # OpenDNS
-                "208.67.222.0/24": {"isp": "Cisco OpenDNS", "organization": "OpenDNS"},
-                "208.67.220.0/24": {"isp": "Cisco OpenDNS", "organization": "OpenDNS"},
-
-                # 中国常见DNS
-                "114.114.114.0/24": {"isp": "114DNS", "organization": "114DNS Public DNS"},
-                "223.5.5.0/24": {"isp": "Alibaba Cloud", "organization": "Alibaba Public DNS"},
-                "223.6.6.0/24": {"isp": "Alibaba Cloud", "organization": "Alibaba Public DNS"},
-                "180.76.76.0/24": {"isp": "Baidu", "organization": "Baidu Public DNS"},
-
-                # 其他知名服务
-                "4.2.2.0/24": {"isp": "Level 3 Communications", "organization": "Level 3 DNS"},
-            }
-
-            # 检查IP是否在已知范围内
-            for network_str, info in known_ranges.items():
-                network = ipaddress.ip_network(network_str)
-                if ip_obj in network:
-                    return info
-
-            # 根据IP段特征推断
-            if ip.startswith("8.8."):
-                return {"isp": "Google LLC", "organization": "Google Services"}
-            elif ip.startswith("1.1.") or ip.startswith("1.0."):
-                return {"isp": "Cloudflare, Inc.", "organization": "Cloudflare Services"}
-            elif ip.startswith("114.114."):
-                return {"isp": "114DNS", "organization": "114DNS Public DNS"}
-            elif ip.startswith("223.5.") or ip.startswith("223.6."):
-                return {"isp": "Alibaba Cloud", "organization": "Alibaba Public DNS"}
-            elif ip.startswith("180.76."):
-                return {"isp": "Baidu", "organization": "Baidu Public DNS"}
-
-            return None
-
+            return self.isp_ranges.lookup_with_prefix(ip)
         except Exception as e:
             logger.debug(f"ISP推断失败: {e}")
-            return None
-    
+            return None, ADDRESS_BITS[6 if ":" in ip else 4]
+
     async def query_ip(self, ip: str) -> IPQueryResult:
         """异步查询单个IP地址"""
         start_time = time.time()
@@ -489,23 +691,34 @@ class AsyncGeoIPService:
             if not self.executor:
                 raise GeoIPException("GeoIP服务未初始化")
 
-            if not (self.db_reader or self.asn_reader or self.country_reader):
+            if not self.readers.has_readers:
                 raise GeoIPException("没有可用的数据库")
-            
-            # 在线程池中执行查询
-            result = await asyncio.get_event_loop().run_in_executor(
-                self.executor,
-                self._query_ip_sync,
-                ip
-            )
-            
+
+            # 先查进程内前缀缓存，命中时无需进入线程池
+            result = self.result_cache.get(ip) if settings.geoip_cache_enabled else None
+            if result is None:
+                cache_generation = self.result_cache.generation
+
+                if settings.geoip_executor_mode == "inline":
+                    result = self._query_ip_sync(ip)
+                else:
+                    # 在线程池中执行查询（单IP查询的跨进程开销大于查询本身，进程池模式下同样使用线程池）
+                    result = await asyncio.get_event_loop().run_in_executor(
+                        self.executor,
+                        self._query_ip_sync,
+                        ip
+                    )
+
+                if result["success"] and settings.geoip_cache_enabled:
+                    self.result_cache.put(ip, result["prefix_len"], result, cache_generation)
+
             query_time = time.time() - start_time
             
             # 更新统计信息
             self._update_stats(query_time, result["success"])
             
             # 构建查询结果
-            return IPQueryResult(
+            query_result = IPQueryResult(
                 ip=ip,
                 location=LocationInfo(**result["location"]),
                 isp=ISPInfo(**result["isp"]),
@@ -513,6 +726,8 @@ class AsyncGeoIPService:
                 cached=False,
                 error=result.get("error")
             )
+            query_result._prefix_len = result.get("prefix_len")
+            return query_result
             
         except Exception as e:
             query_time = time.time() - start_time
@@ -528,45 +743,220 @@ class AsyncGeoIPService:
                 error=str(e)
             )
     
+    def _query_batch_sync(self, items: List[Tuple[int, int, str]], cache_generation: int) -> Dict[str, List[Any]]:
+        """同步批量查询（在线程池中执行）
+
+        items为按(版本, 地址整数)排序的IP列表，相邻IP落在同一网段时直接复用上一条合并记录，
+        结果以列式结构返回，与items一一对应。
+        """
+        columns: Dict[str, List[Any]] = {"location": [], "isp": [], "error": [], "query_time": [], "prefix_len": []}
+        use_cache = settings.geoip_cache_enabled
+
+        # 整个分块使用同一组读取器
+        readers = self._acquire_readers()
+        try:
+            self._resolve_sorted_items(items, readers, cache_generation, columns, use_cache)
+        finally:
+            readers.release()
+
+        return columns
+
+    def _resolve_sorted_items(
+        self,
+        items: List[Tuple[int, int, str]],
+        readers: ReaderSet,
+        cache_generation: int,
+        columns: Dict[str, List[Any]],
+        use_cache: bool
+    ) -> None:
+        """按排序后的顺序解析IP并追加到列式结果"""
+        last_key: Optional[Tuple[int, int, int]] = None
+        last_result: Optional[Dict[str, Any]] = None
+
+        for version, ip_int, ip in items:
+            item_start = time.perf_counter()
+            bits = ADDRESS_BITS[version]
+            result = None
+
+            # 与上一个IP处于同一网段，直接复用
+            if last_key is not None and last_key[0] == version:
+                prefix_len = last_key[1]
+                if ip_int >> (bits - prefix_len) == last_key[2]:
+                    result = last_result
+
+            if result is None and use_cache:
+                result = self.result_cache.lookup(version, ip_int)
+
+            if result is None:
+                result = self._lookup_merged(ip, readers)
+                if result["success"] and use_cache:
+                    self.result_cache.store(version, ip_int, result["prefix_len"], result, cache_generation)
+
+            if result["success"] and "prefix_len" in result:
+                prefix_len = result["prefix_len"]
+                last_key = (version, prefix_len, ip_int >> (bits - prefix_len))
+                last_result = result
+            else:
+                last_key = None
+
+            columns["location"].append(result["location"])
+            columns["isp"].append(result["isp"])
+            columns["error"].append(result.get("error"))
+            columns["query_time"].append(time.perf_counter() - item_start)
+            columns["prefix_len"].append(result.get("prefix_len") if result["success"] else None)
+
+    def _prepare_batch(self, ips: List[str]) -> Tuple[Dict[str, Tuple[Any, Any, Any, float, Optional[int]]], List[Tuple[int, int, str]]]:
+        """去重并解析IP，返回(无效IP的结果, 按地址排序的待查询列表)"""
+        unique_results: Dict[str, Tuple[Any, Any, Any, float, Optional[int]]] = {}
+        items = []
+        for ip in dict.fromkeys(ips):
+            parsed = parse_ip(ip)
+            if parsed is None:
+                unique_results[ip] = (dict(EMPTY_LOCATION), dict(EMPTY_ISP), f"无效的IP地址: {ip}", 0.0, None)
+            else:
+                items.append((parsed[0], parsed[1], ip))
+        items.sort()
+        return unique_results, items
+
+    @staticmethod
+    def _collect_chunk(
+        unique_results: Dict[str, Tuple[Any, Any, Any, float, Optional[int]]],
+        chunk: List[Tuple[int, int, str]],
+        columns: Dict[str, List[Any]]
+    ) -> None:
+        """将一个分块的列式结果登记到按IP索引的结果表"""
+        for (_, _, ip), location, isp, error, query_time, prefix_len in zip(
+            chunk, columns["location"], columns["isp"], columns["error"],
+            columns["query_time"], columns["prefix_len"]
+        ):
+            unique_results[ip] = (location, isp, error, query_time, prefix_len)
+
+    def _expand_columns(
+        self,
+        ips: List[str],
+        unique_results: Dict[str, Tuple[Any, Any, Any, float, Optional[int]]],
+        elapsed: float
+    ) -> Dict[str, List[Any]]:
+        """按输入顺序展开为列并更新统计"""
+        columns: Dict[str, List[Any]] = {
+            "ip": [], "location": [], "isp": [], "error": [], "query_time": [], "prefix_len": []
+        }
+        for ip in ips:
+            location, isp, error, query_time, prefix_len = unique_results[ip]
+            columns["ip"].append(ip)
+            columns["location"].append(location)
+            columns["isp"].append(isp)
+            columns["error"].append(error)
+            columns["query_time"].append(query_time)
+            columns["prefix_len"].append(prefix_len)
+
+        failed_count = sum(1 for error in columns["error"] if error)
+        self._update_batch_stats(elapsed, len(ips) - failed_count, failed_count)
+        return columns
+
+    async def query_batch_columns(self, ips: List[str], batch_size: int = 50) -> Dict[str, List[Any]]:
+        """异步批量查询IP地址，返回与输入顺序一致的列式结果
+
+        返回字典包含 ip/location/isp/error/query_time/prefix_len 六列（prefix_len为结果适用的网络前缀长度）。IP先去重并按地址排序，
+        再按batch_size切分后整块交给执行器（线程池或进程池），每个分块只需一次切换。
+        """
+        if not self.executor:
+            raise GeoIPException("GeoIP服务未初始化")
+
+        if not self.readers.has_readers:
+            raise GeoIPException("没有可用的数据库")
+
+        start_time = time.time()
+        batch_size = max(1, batch_size)
+
+        # 去重并排序，使相邻IP共享网段
+        unique_results, items = self._prepare_batch(ips)
+
+        if items:
+            cache_generation = self.result_cache.generation
+            chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+            chunk_columns = await asyncio.gather(*[
+                self._run_batch_chunk(chunk, cache_generation) for chunk in chunks
+            ])
+
+            for chunk, columns in zip(chunks, chunk_columns):
+                self._collect_chunk(unique_results, chunk, columns)
+
+        return self._expand_columns(ips, unique_results, time.time() - start_time)
+
+    async def _run_batch_chunk(self, chunk: List[Tuple[int, int, str]], cache_generation: int) -> Dict[str, List[Any]]:
+        """按配置的执行方式查询一个已排序的分块"""
+        mode = settings.geoip_executor_mode
+        if mode == "inline":
+            return self._query_batch_sync(chunk, cache_generation)
+
+        loop = asyncio.get_event_loop()
+        if mode == "process" and self.process_pool is not None:
+            try:
+                packed = await loop.run_in_executor(self.process_pool, lookup_pool.lookup_items, chunk)
+                return lookup_pool.unpack_columns(packed)
+            except BrokenProcessPool:
+                self._on_process_pool_broken()
+
+        return await loop.run_in_executor(self.executor, self._query_batch_sync, chunk, cache_generation)
+
+    def query_batch_columns_sync(self, ips: List[str]) -> Dict[str, List[Any]]:
+        """在当前线程中完成批量查询，返回与query_batch_columns相同的列式结果
+
+        供没有事件循环的场景（如任务进程池中的worker）使用。
+        """
+        if not self.readers.has_readers:
+            raise GeoIPException("没有可用的数据库")
+
+        start_time = time.time()
+        unique_results, items = self._prepare_batch(ips)
+        if items:
+            columns = self._query_batch_sync(items, self.result_cache.generation)
+            self._collect_chunk(unique_results, items, columns)
+
+        return self._expand_columns(ips, unique_results, time.time() - start_time)
+
+    @staticmethod
+    def build_results(columns: Dict[str, List[Any]]) -> List[IPQueryResult]:
+        """将列式批量结果构建为IPQueryResult列表（数据已由服务端生成，跳过校验）"""
+        results = []
+        for ip, location, isp, error, query_time, prefix_len in zip(
+            columns["ip"], columns["location"], columns["isp"], columns["error"],
+            columns["query_time"], columns["prefix_len"]
+        ):
+            result = IPQueryResult.model_construct(
+                ip=ip,
+                location=LocationInfo.model_construct(**location),
+                isp=ISPInfo.model_construct(**isp),
+                query_time=query_time,
+                cached=False,
+                error=error
+            )
+            result._prefix_len = prefix_len
+            results.append(result)
+        return results
+
     async def query_batch_ips(self, ips: List[str], batch_size: int = 50) -> List[IPQueryResult]:
         """异步批量查询IP地址"""
-        results = []
+        try:
+            columns = await self.query_batch_columns(ips, batch_size=batch_size)
+        except Exception as e:
+            logger.error(f"批量查询中出现异常: {e}")
+            self._update_batch_stats(0.0, 0, len(ips))
+            return [
+                IPQueryResult(
+                    ip=ip,
+                    location=LocationInfo(),
+                    isp=ISPInfo(),
+                    query_time=0.0,
+                    cached=False,
+                    error=str(e)
+                )
+                for ip in ips
+            ]
 
-        # 使用信号量限制并发数
-        semaphore = asyncio.Semaphore(settings.concurrent_limit)
-
-        async def query_with_semaphore(ip: str) -> IPQueryResult:
-            """带信号量的查询"""
-            async with semaphore:
-                return await self.query_ip(ip)
-
-        # 分批处理
-        for i in range(0, len(ips), batch_size):
-            batch = ips[i:i + batch_size]
-
-            # 并发查询当前批次
-            tasks = [query_with_semaphore(ip) for ip in batch]
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            # 处理结果
-            for result in batch_results:
-                if isinstance(result, Exception):
-                    logger.error(f"批量查询中出现异常: {result}")
-                    # 创建错误结果
-                    error_result = IPQueryResult(
-                        ip="unknown",
-                        location=LocationInfo(),
-                        isp=ISPInfo(),
-                        query_time=0.0,
-                        cached=False,
-                        error=str(result)
-                    )
-                    results.append(error_result)
-                else:
-                    results.append(result)
+        return self.build_results(columns)
 
-        return results
-    
     def _update_stats(self, query_time: float, success: bool) -> None:
         """更新统计信息"""
         self.stats["total_queries"] += 1
@@ -583,13 +973,31 @@ class AsyncGeoIPService:
                 self.stats["total_query_time"] / self.stats["total_queries"]
             )
     
-    async def switch_database_file(self, city_db_key: str = None, asn_db_key: str = None, country_db_key: str = None) -> Dict[str, Any]:
-        """切换数据库文件"""
-        try:
-            old_city_db = self.current_city_db
-            old_asn_db = self.current_asn_db
-            old_country_db = self.current_country_db
+    def _update_batch_stats(self, total_time: float, success_count: int, failed_count: int) -> None:
+        """批量更新统计信息"""
+        self.stats["total_queries"] += success_count + failed_count
+        self.stats["total_query_time"] += total_time
+        self.stats["successful_queries"] += success_count
+        self.stats["failed_queries"] += failed_count
 
+        if self.stats["total_queries"] > 0:
+            self.stats["avg_query_time"] = (
+                self.stats["total_query_time"] / self.stats["total_queries"]
+            )
+
+    async def switch_database_file(
+        self,
+        city_db_key: str = None,
+        asn_db_key: str = None,
+        country_db_key: str = None,
+        snapshot_db_key: str = None
+    ) -> Dict[str, Any]:
+        """切换数据库文件（选中合并快照时优先使用快照）"""
+        old_city_db = self.current_city_db
+        old_asn_db = self.current_asn_db
+        old_country_db = self.current_country_db
+        old_snapshot_db = self.current_snapshot_db
+        try:
             # 验证并设置城市数据库
             if city_db_key is not None:
                 if city_db_key == "" or city_db_key == "null":
@@ -626,8 +1034,20 @@ class AsyncGeoIPService:
                         raise ValueError(f"数据库类型错误: {country_db_key} 不是国家数据库")
                     self.current_country_db = country_db_key
 
+            # 验证并设置合并快照
+            if snapshot_db_key is not None:
+                if snapshot_db_key == "" or snapshot_db_key == "null":
+                    # 空字符串或"null"表示不使用合并快照
+                    self.current_snapshot_db = ""
+                else:
+                    if snapshot_db_key not in self.available_databases:
+                        raise ValueError(f"不支持的合并快照: {snapshot_db_key}")
+                    if self.available_databases[snapshot_db_key]["type"] != "snapshot":
+                        raise ValueError(f"数据库类型错误: {snapshot_db_key} 不是合并快照")
+                    self.current_snapshot_db = snapshot_db_key
+
             # 验证至少选择了一个数据库
-            if not any([self.current_city_db, self.current_asn_db, self.current_country_db]):
+            if not any([self.current_city_db, self.current_asn_db, self.current_country_db, self.current_snapshot_db]):
                 raise ValueError("至少需要选择一个数据库进行查询")
 
             # 重新初始化读取器
@@ -640,6 +1060,8 @@ class AsyncGeoIPService:
                 changes.append(f"ASN数据库: {old_asn_db} → {self.current_asn_db}")
             if country_db_key is not None:
                 changes.append(f"国家数据库: {old_country_db} → {self.current_country_db}")
+            if snapshot_db_key is not None:
+                changes.append(f"合并快照: {old_snapshot_db} → {self.current_snapshot_db}")
 
             logger.info(f"数据库文件已切换: {', '.join(changes)}")
 
@@ -649,16 +1071,24 @@ class AsyncGeoIPService:
                 "changes": {
                     "city_db": {"old": old_city_db, "new": self.current_city_db},
                     "asn_db": {"old": old_asn_db, "new": self.current_asn_db},
-                    "country_db": {"old": old_country_db, "new": self.current_country_db}
+                    "country_db": {"old": old_country_db, "new": self.current_country_db},
+                    "snapshot_db": {"old": old_snapshot_db, "new": self.current_snapshot_db}
                 },
                 "current_databases": {
                     "city_db": self.current_city_db,
                     "asn_db": self.current_asn_db,
-                    "country_db": self.current_country_db
+                    "country_db": self.current_country_db,
+                    "snapshot_db": self.current_snapshot_db
                 }
             }
 
         except Exception as e:
+            # 新读取器未生效，恢复原有的数据库选择
+            self.current_city_db = old_city_db
+            self.current_asn_db = old_asn_db
+            self.current_country_db = old_country_db
+            self.current_snapshot_db = old_snapshot_db
+
             logger.error(f"切换数据库文件失败: {e}")
             return {
                 "success": False,
@@ -666,7 +1096,8 @@ class AsyncGeoIPService:
                 "current_databases": {
                     "city_db": self.current_city_db,
                     "asn_db": self.current_asn_db,
-                    "country_db": self.current_country_db
+                    "country_db": self.current_country_db,
+                    "snapshot_db": self.current_snapshot_db
                 }
             }
 
@@ -676,18 +1107,23 @@ class AsyncGeoIPService:
             "current_databases": {
                 "city_db": self.current_city_db,
                 "asn_db": self.current_asn_db,
-                "country_db": self.current_country_db
+                "country_db": self.current_country_db,
+                "snapshot_db": self.current_snapshot_db
             },
             "available_databases": self.available_databases,
             "database_status": {
                 "city_db": self.db_reader is not None,
                 "asn_db": self.asn_reader is not None,
-                "country_db": self.country_reader is not None
+                "country_db": self.country_reader is not None,
+                "snapshot_db": self.snapshot is not None
             },
+            "reader_set": self.readers.get_status(),
+            "reader_mode": settings.geoip_reader_mode,
             "database_files": {
                 "city_databases": [key for key, db in self.available_databases.items() if db["type"] == "city"],
                 "asn_databases": [key for key, db in self.available_databases.items() if db["type"] == "asn"],
-                "country_databases": [key for key, db in self.available_databases.items() if db["type"] == "country"]
+                "country_databases": [key for key, db in self.available_databases.items() if db["type"] == "country"],
+                "snapshot_databases": [key for key, db in self.available_databases.items() if db["type"] == "snapshot"]
             }
         }
 
@@ -710,32 +1146,43 @@ class AsyncGeoIPService:
                 "is_current": (
                     (db_info["type"] == "city" and db_key == self.current_city_db) or
                     (db_info["type"] == "asn" and db_key == self.current_asn_db) or
-                    (db_info["type"] == "country" and db_key == self.current_country_db)
+                    (db_info["type"] == "country" and db_key == self.current_country_db) or
+                    (db_info["type"] == "snapshot" and db_key == self.current_snapshot_db)
                 )
             }
         # 按类型分组数据库
         city_databases = {k: v for k, v in database_details.items() if v["type"] == "city"}
         asn_databases = {k: v for k, v in database_details.items() if v["type"] == "asn"}
         country_databases = {k: v for k, v in database_details.items() if v["type"] == "country"}
+        snapshot_databases = {k: v for k, v in database_details.items() if v["type"] == "snapshot"}
 
         return {
             "current_databases": {
                 "city_db": self.current_city_db,
                 "asn_db": self.current_asn_db,
-                "country_db": self.current_country_db
+                "country_db": self.current_country_db,
+                "snapshot_db": self.current_snapshot_db
             },
             "database_details": database_details,
             "city_databases": city_databases,
             "asn_databases": asn_databases,
-            "country_databases": country_databases
+            "country_databases": country_databases,
+            "snapshot_databases": snapshot_databases
         }
 
     async def get_service_stats(self) -> Dict[str, Any]:
         """获取服务统计信息"""
         return {
             "geoip_stats": self.stats.copy(),
+            "stage_timings": self._get_stage_timings(),
+            "result_cache": self.result_cache.get_stats(),
+            "isp_inference": self.isp_ranges.get_stats(),
             "database_info": await self.get_database_info(),
-            "concurrent_limit": settings.concurrent_limit
+            "concurrent_limit": settings.concurrent_limit,
+            "executor": {
+                "mode": settings.geoip_executor_mode,
+                "process_workers": self.process_pool._max_workers if self.process_pool else 0
+            }
         }
 
 
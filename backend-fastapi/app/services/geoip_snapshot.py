@@ -0,0 +1,396 @@
+"""
+GeoIP列式快照
+将城市/ASN/国家数据库离线编译为一个按区间排序的列式快照文件，
+启动时以内存映射方式加载，每个IP只需一次二分查找即可同时得到位置和ISP信息
+
+文件布局：8字节魔数 + 4字节头部长度 + JSON头部，随后是按8字节对齐的各列数据段
+（区间起止地址数组、区间行号数组、字典编码的行列数组、字符串偏移数组和字符串数据）
+"""
+import ipaddress
+import json
+import math
+import mmap
+import sys
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+import maxminddb
+
+from app.core.logging import get_logger
+from app.services.geoip_records import (
+    EMPTY_LOCATION, EMPTY_ISP, LOCATION_FIELDS, ISP_FIELDS,
+    merge_city_record, merge_country_record, merge_asn_record
+)
+from app.services.prefix_cache import ADDRESS_BITS, block_prefix_len
+
+logger = get_logger(__name__)
+
+SNAPSHOT_MAGIC = b"GEOSNAP1"
+SNAPSHOT_FORMAT_VERSION = 1
+
+# 行字段：位置字段在前，ISP字段在后；浮点字段以NaN表示空值，其余字段为字符串字典编号(0表示空值)
+ROW_FIELDS = list(LOCATION_FIELDS + ISP_FIELDS)
+FLOAT_FIELDS = ("latitude", "longitude")
+
+_U64_MASK = (1 << 64) - 1
+
+
+def _read_intervals(path: str) -> Tuple[Dict[int, List[Tuple[int, int, Dict[str, Any]]]], Dict[str, Any]]:
+    """遍历mmdb文件中的所有网段，返回按IP版本划分的有序区间列表和数据库元数据"""
+    intervals: Dict[int, List[Tuple[int, int, Dict[str, Any]]]] = {4: [], 6: []}
+    with maxminddb.open_database(path) as reader:
+        if not hasattr(reader, "__iter__"):
+            raise RuntimeError("当前maxminddb版本不支持遍历数据库，请升级到2.3.0及以上版本")
+        metadata = reader.metadata()
+        for network, record in reader:
+            if not record:
+                continue
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), record)
+            )
+
+    for version_intervals in intervals.values():
+        version_intervals.sort(key=lambda item: item[0])
+
+    return intervals, {
+        "path": path,
+        "database_type": metadata.database_type,
+        "build_epoch": metadata.build_epoch
+    }
+
+
+def _merge_row(
+    city_record: Optional[Dict[str, Any]],
+    asn_record: Optional[Dict[str, Any]],
+    country_record: Optional[Dict[str, Any]]
+) -> Tuple[Any, ...]:
+    """按在线查询相同的规则合并三个数据库的记录为一行"""
+    location = dict(EMPTY_LOCATION)
+    isp = dict(EMPTY_ISP)
+    if city_record:
+        merge_city_record(city_record, location, isp)
+    if not location["country"] and country_record:
+        merge_country_record(country_record, location)
+    if asn_record and (not isp["asn"] or not isp["isp"]):
+        merge_asn_record(asn_record, isp)
+    return tuple(location[field] for field in LOCATION_FIELDS) + tuple(isp[field] for field in ISP_FIELDS)
+
+
+def build_snapshot(
+    output_path: str,
+    city_path: Optional[str] = None,
+    asn_path: Optional[str] = None,
+    country_path: Optional[str] = None
+) -> Dict[str, Any]:
+    """将选定的城市/ASN/国家数据库编译为列式快照文件，返回快照头部信息"""
+    if array("I").itemsize != 4 or array("Q").itemsize != 8:
+        raise RuntimeError("当前平台的数组类型长度不受支持")
+
+    sources = {}
+    source_intervals = []
+    for name, path in (("city", city_path), ("asn", asn_path), ("country", country_path)):
+        if not path:
+            source_intervals.append({4: [], 6: []})
+            continue
+        intervals, metadata = _read_intervals(path)
+        sources[name] = metadata
+        source_intervals.append(intervals)
+        logger.info(f"已读取{name}数据库 {path}: IPv4 {len(intervals[4])} 个网段, IPv6 {len(intervals[6])} 个网段")
+
+    if not sources:
+        raise ValueError("至少需要一个数据库文件")
+
+    strings: Dict[str, int] = {}
+    rows: Dict[Tuple[Any, ...], int] = {}
+    merged_rows: Dict[Tuple[int, int, int], int] = {}
+    interval_columns = {}
+
+    for version in (4, 6):
+        per_source = [intervals[version] for intervals in source_intervals]
+
+        # 以所有网段边界切分基本区间
+        boundaries = sorted({
+            bound
+            for intervals in per_source
+            for start, end, _ in intervals
+            for bound in (start, end + 1)
+        })
+
+        starts: List[int] = []
+        ends: List[int] = []
+        row_ids = array("I")
+        positions = [0, 0, 0]
+        for start, next_start in zip(boundaries, boundaries[1:]):
+            covering = []
+            for index, intervals in enumerate(per_source):
+                position = positions[index]
+                while position < len(intervals) and intervals[position][1] < start:
+                    position += 1
+                positions[index] = position
+                if position < len(intervals) and intervals[position][0] <= start:
+                    covering.append(position)
+                else:
+                    covering.append(-1)
+
+            if covering == [-1, -1, -1]:
+                continue
+
+            # 相同的记录组合只合并一次
+            combination = tuple(covering)
+            row_id = merged_rows.get(combination)
+            if row_id is None:
+                records = [
+                    per_source[index][position][2] if position >= 0 else None
+                    for index, position in enumerate(covering)
+                ]
+                row = _merge_row(*records)
+                row_id = rows.setdefault(row, len(rows))
+                merged_rows[combination] = row_id
+
+            # 与上一区间相邻且结果相同则合并
+            if ends and ends[-1] == start - 1 and row_ids[-1] == row_id:
+                ends[-1] = next_start - 1
+            else:
+                starts.append(start)
+                ends.append(next_start - 1)
+                row_ids.append(row_id)
+
+        interval_columns[version] = (starts, ends, row_ids)
+        merged_rows.clear()
+
+    # 字典编码行列
+    row_columns: Dict[str, array] = {}
+    for field_index, field in enumerate(ROW_FIELDS):
+        if field in FLOAT_FIELDS:
+            column = array("d", (math.nan if row[field_index] is None else row[field_index] for row in rows))
+        else:
+            column = array("I")
+            for row in rows:
+                value = row[field_index]
+                if value is None:
+                    column.append(0)
+                else:
+                    column.append(strings.setdefault(str(value), len(strings) + 1))
+        row_columns[field] = column
+
+    string_offsets = array("I", [0])
+    string_blob = bytearray()
+    for value in strings:
+        string_blob += value.encode("utf-8")
+        string_offsets.append(len(string_blob))
+
+    sections: Dict[str, bytes] = {
+        "string_offsets": string_offsets.tobytes(),
+        "string_blob": bytes(string_blob),
+    }
+    for field, column in row_columns.items():
+        sections[f"row_{field}"] = column.tobytes()
+
+    v4_starts, v4_ends, v4_rows = interval_columns[4]
+    sections["ipv4_starts"] = array("I", v4_starts).tobytes()
+    sections["ipv4_ends"] = array("I", v4_ends).tobytes()
+    sections["ipv4_rows"] = v4_rows.tobytes()
+
+    v6_starts, v6_ends, v6_rows = interval_columns[6]
+    sections["ipv6_starts_hi"] = array("Q", (value >> 64 for value in v6_starts)).tobytes()
+    sections["ipv6_starts_lo"] = array("Q", (value & _U64_MASK for value in v6_starts)).tobytes()
+    sections["ipv6_ends_hi"] = array("Q", (value >> 64 for value in v6_ends)).tobytes()
+    sections["ipv6_ends_lo"] = array("Q", (value & _U64_MASK for value in v6_ends)).tobytes()
+    sections["ipv6_rows"] = v6_rows.tobytes()
+
+    # 计算各数据段偏移（相对于数据区起点，按8字节对齐）
+    section_index = {}
+    offset = 0
+    for name, data in sections.items():
+        section_index[name] = [offset, len(data)]
+        offset += len(data) + (-len(data) % 8)
+
+    header = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "built_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "sources": sources,
+        "row_fields": ROW_FIELDS,
+        "float_fields": list(FLOAT_FIELDS),
+        "row_count": len(rows),
+        "string_count": len(strings),
+        "interval_counts": {"4": len(v4_starts), "6": len(v6_starts)},
+        "sections": section_index
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix_len = len(SNAPSHOT_MAGIC) + 4 + len(header_bytes)
+    header_padding = -prefix_len % 8
+
+    output = Path(output_path)
+    temp_output = output.with_name(output.name + ".tmp")
+    with open(temp_output, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        f.write(b"\0" * header_padding)
+        for data in sections.values():
+            f.write(data)
+            f.write(b"\0" * (-len(data) % 8))
+    # 写入完成后再替换，避免正在运行的服务读到不完整的文件
+    temp_output.replace(output)
+
+    logger.info(
+        f"GeoIP快照已生成 {output_path}: IPv4 {len(v4_starts)} 个区间, IPv6 {len(v6_starts)} 个区间, "
+        f"{len(rows)} 行, {len(strings)} 个字符串"
+    )
+    return header
+
+
+class _U128Column:
+    """由高/低64位两列组成的128位整数只读序列，供bisect使用"""
+
+    def __init__(self, high: memoryview, low: memoryview):
+        self.high = high
+        self.low = low
+
+    def __len__(self) -> int:
+        return len(self.high)
+
+    def __getitem__(self, index: int) -> int:
+        return (self.high[index] << 64) | self.low[index]
+
+
+class GeoIPSnapshot:
+    """内存映射的GeoIP列式快照"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[memoryview] = []
+
+        try:
+            buffer = memoryview(self._mmap)
+            self._views.append(buffer)
+            if bytes(buffer[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+                raise ValueError(f"不是有效的GeoIP快照文件: {path}")
+
+            header_start = len(SNAPSHOT_MAGIC) + 4
+            header_len = int.from_bytes(buffer[len(SNAPSHOT_MAGIC):header_start], "little")
+            self.header: Dict[str, Any] = json.loads(bytes(buffer[header_start:header_start + header_len]))
+            if self.header.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(f"不支持的快照格式版本: {self.header.get('format_version')}")
+            if self.header.get("byteorder") != sys.byteorder:
+                raise ValueError("快照文件字节序与当前平台不一致，请在本机重新生成")
+
+            data_start = header_start + header_len
+            data_start += -data_start % 8
+            self._data_start = data_start
+
+            self._string_offsets = self._section("string_offsets", "I")
+            self._string_blob = self._section("string_blob")
+            self._row_columns = [
+                (field, field in self.header["float_fields"], self._section(f"row_{field}", "d" if field in self.header["float_fields"] else "I"))
+                for field in self.header["row_fields"]
+            ]
+            self._location_fields = [field for field in self.header["row_fields"] if field in EMPTY_LOCATION]
+            self._tables = {
+                4: (
+                    self._section("ipv4_starts", "I"),
+                    self._section("ipv4_ends", "I"),
+                    self._section("ipv4_rows", "I")
+                ),
+                6: (
+                    _U128Column(self._section("ipv6_starts_hi", "Q"), self._section("ipv6_starts_lo", "Q")),
+                    _U128Column(self._section("ipv6_ends_hi", "Q"), self._section("ipv6_ends_lo", "Q")),
+                    self._section("ipv6_rows", "I")
+                )
+            }
+        except Exception:
+            self.close()
+            raise
+
+    def _section(self, name: str, typecode: Optional[str] = None) -> memoryview:
+        """获取数据段的只读视图"""
+        offset, length = self.header["sections"][name]
+        start = self._data_start + offset
+        view = self._views[0][start:start + length]
+        self._views.append(view)
+        if typecode:
+            view = view.cast(typecode)
+            self._views.append(view)
+        return view
+
+    def _get_string(self, string_id: int) -> Optional[str]:
+        """按字典编号读取字符串"""
+        if string_id == 0:
+            return None
+        start = self._string_offsets[string_id - 1]
+        end = self._string_offsets[string_id]
+        return str(self._string_blob[start:end], "utf-8")
+
+    def _decode_row(self, row_id: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """解码一行为位置和ISP字典"""
+        location = {}
+        isp = {}
+        for field, is_float, column in self._row_columns:
+            if is_float:
+                value = column[row_id]
+                value = None if math.isnan(value) else value
+            else:
+                value = self._get_string(column[row_id])
+            if field in EMPTY_LOCATION:
+                location[field] = value
+            else:
+                isp[field] = value
+        return location, isp
+
+    def lookup(self, ip: str) -> Tuple[Optional[Tuple[Dict[str, Any], Dict[str, Any]]], int]:
+        """查找IP，返回((位置, ISP) 或 None, 结果适用的网络前缀长度)"""
+        ip_obj = ipaddress.ip_address(ip)
+
+        # IPv4映射地址和6to4地址按对应的IPv4地址查找
+        if ip_obj.version == 6:
+            if ip_obj.ipv4_mapped:
+                row, prefix_len = self._lookup_int(4, int(ip_obj.ipv4_mapped))
+                return row, 96 + prefix_len
+            if ip_obj.sixtofour:
+                row, prefix_len = self._lookup_int(4, int(ip_obj.sixtofour))
+                return row, 16 + prefix_len
+
+        return self._lookup_int(ip_obj.version, int(ip_obj))
+
+    def _lookup_int(self, version: int, ip_int: int) -> Tuple[Optional[Tuple[Dict[str, Any], Dict[str, Any]]], int]:
+        """按整数地址二分查找所在区间"""
+        bits = ADDRESS_BITS[version]
+        starts, ends, row_ids = self._tables[version]
+        index = bisect_right(starts, ip_int) - 1
+
+        if index >= 0 and ip_int <= ends[index]:
+            return self._decode_row(row_ids[index]), block_prefix_len(ip_int, starts[index], ends[index], bits)
+
+        # 未命中：结果在相邻两个区间之间的空隙内保持一致
+        gap_start = ends[index] + 1 if index >= 0 else 0
+        gap_end = starts[index + 1] - 1 if index + 1 < len(starts) else (1 << bits) - 1
+        return None, block_prefix_len(ip_int, gap_start, gap_end, bits)
+
+    def get_info(self) -> Dict[str, Any]:
+        """获取快照信息"""
+        return {
+            "path": self.path,
+            "built_at": self.header.get("built_at"),
+            "sources": self.header.get("sources"),
+            "row_count": self.header.get("row_count"),
+            "string_count": self.header.get("string_count"),
+            "interval_counts": self.header.get("interval_counts")
+        }
+
+    def close(self) -> None:
+        """释放所有视图并关闭内存映射"""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
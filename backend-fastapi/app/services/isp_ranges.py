@@ -0,0 +1,241 @@
+"""
+ISP推断区间表
+将已知IP段预编译为排序的整数区间数组，通过二分查找推断ISP信息
+"""
+import ipaddress
+import json
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.core.logging import get_logger
+from app.services.prefix_cache import ADDRESS_BITS, block_prefix_len, parse_ip
+
+logger = get_logger(__name__)
+
+# 内置的已知IP段（更具体的网段优先于更宽泛的网段）
+DEFAULT_ISP_RANGES: List[Dict[str, str]] = [
+    # Google DNS
+    {"network": "8.8.8.0/24", "isp": "Google LLC", "organization": "Google Public DNS"},
+    {"network": "8.8.4.0/24", "isp": "Google LLC", "organization": "Google Public DNS"},
+    {"network": "8.8.0.0/16", "isp": "Google LLC", "organization": "Google Services"},
+
+    # Cloudflare DNS
+    {"network": "1.1.1.0/24", "isp": "Cloudflare, Inc.", "organization": "Cloudflare DNS"},
+    {"network": "1.0.0.0/24", "isp": "Cloudflare, Inc.", "organization": "Cloudflare DNS"},
+    {"network": "1.1.0.0/16", "isp": "Cloudflare, Inc.", "organization": "Cloudflare Services"},
+    {"network": "1.0.0.0/16", "isp": "Cloudflare, Inc.", "organization": "Cloudflare Services"},
+
+    # Quad9 DNS
+    {"network": "9.9.9.0/24", "isp": "Quad9", "organization": "Quad9 DNS"},
+
+    # OpenDNS
+    {"network": "208.67.222.0/24", "isp": "Cisco OpenDNS", "organization": "OpenDNS"},
+    {"network": "208.67.220.0/24", "isp": "Cisco OpenDNS", "organization": "OpenDNS"},
+
+    # 中国常见DNS
+    {"network": "114.114.0.0/16", "isp": "114DNS", "organization": "114DNS Public DNS"},
+    {"network": "223.5.0.0/16", "isp": "Alibaba Cloud", "organization": "Alibaba Public DNS"},
+    {"network": "223.6.0.0/16", "isp": "Alibaba Cloud", "organization": "Alibaba Public DNS"},
+    {"network": "180.76.0.0/16", "isp": "Baidu", "organization": "Baidu Public DNS"},
+
+    # 其他知名服务
+    {"network": "4.2.2.0/24", "isp": "Level 3 Communications", "organization": "Level 3 DNS"},
+]
+
+# 单个IP版本的区间表：(起始地址数组, 结束地址数组, ISP信息数组)
+RangeTable = Tuple[List[int], List[int], List[Dict[str, str]]]
+
+_EMPTY_TABLE: RangeTable = ([], [], [])
+
+
+def parse_range_entry(entry: Any) -> Tuple[Any, Dict[str, str]]:
+    """校验一个区间条目，返回(网段, ISP信息)，格式错误时抛出ValueError"""
+    if not isinstance(entry, dict) or "network" not in entry:
+        raise ValueError(f"区间条目缺少network字段: {entry!r}")
+    network = ipaddress.ip_network(entry["network"], strict=False)
+    return network, {
+        "isp": entry.get("isp"),
+        "organization": entry.get("organization")
+    }
+
+
+def compile_ranges(entries: List[Dict[str, str]]) -> Dict[int, RangeTable]:
+    """将网段列表编译为按IP版本划分的不重叠区间表
+
+    网段之间允许嵌套，重叠部分由前缀最长（最具体）的网段决定；
+    相同网段后出现的条目覆盖先出现的条目。条目需先经过parse_range_entry校验。
+    """
+    networks: Dict[int, Dict[Any, Dict[str, str]]] = {4: {}, 6: {}}
+    for entry in entries:
+        network, info = parse_range_entry(entry)
+        networks[network.version][network] = info
+
+    tables = {}
+    for version, version_networks in networks.items():
+        if not version_networks:
+            tables[version] = _EMPTY_TABLE
+            continue
+
+        # 以所有网段边界切分为基本区间，按地址顺序扫描一次：
+        # CIDR网段之间只有嵌套或不相交两种关系，栈顶始终是覆盖当前区间的最具体网段
+        boundaries = sorted({
+            bound
+            for network in version_networks
+            for bound in (int(network.network_address), int(network.broadcast_address) + 1)
+        })
+        ordered = sorted(
+            (
+                (int(network.network_address), int(network.broadcast_address), info)
+                for network, info in version_networks.items()
+            ),
+            key=lambda item: (item[0], -item[1])
+        )
+
+        starts: List[int] = []
+        ends: List[int] = []
+        infos: List[Dict[str, str]] = []
+        stack: List[Tuple[int, Dict[str, str]]] = []
+        position = 0
+        for start, next_start in zip(boundaries, boundaries[1:]):
+            while stack and stack[-1][0] < start:
+                stack.pop()
+            while position < len(ordered) and ordered[position][0] == start:
+                stack.append((ordered[position][1], ordered[position][2]))
+                position += 1
+            if not stack:
+                continue
+
+            info = stack[-1][1]
+            # 与上一区间相邻且信息相同则合并
+            if ends and ends[-1] == start - 1 and infos[-1] == info:
+                ends[-1] = next_start - 1
+            else:
+                starts.append(start)
+                ends.append(next_start - 1)
+                infos.append(info)
+
+        tables[version] = (starts, ends, infos)
+
+    return tables
+
+
+class ISPRangeTable:
+    """预编译的ISP推断区间表"""
+
+    def __init__(self, overrides_file: Optional[str] = None):
+        self.overrides_file = overrides_file
+        self._tables: Dict[int, RangeTable] = {4: _EMPTY_TABLE, 6: _EMPTY_TABLE}
+        self._overrides_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "ranges": 0,
+            "override_ranges": 0,
+            "invalid_overrides": 0,
+            "loaded_at": None
+        }
+
+    def _load_overrides(self) -> List[Dict[str, str]]:
+        """读取覆盖配置文件（JSON数组，元素包含network/isp/organization）"""
+        if not self.overrides_file:
+            return []
+
+        path = Path(self.overrides_file)
+        if not path.exists():
+            self._overrides_mtime = None
+            return []
+
+        self._overrides_mtime = path.stat().st_mtime
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if not isinstance(entries, list):
+            raise ValueError(f"ISP区间覆盖文件格式错误，应为JSON数组: {path}")
+        return entries
+
+    def _validate_overrides(self, entries: List[Any]) -> List[Dict[str, str]]:
+        """逐条校验覆盖条目，跳过格式错误的条目（记录日志），返回有效条目"""
+        valid = []
+        invalid = 0
+        for index, entry in enumerate(entries):
+            try:
+                parse_range_entry(entry)
+            except (ValueError, TypeError) as e:
+                invalid += 1
+                logger.warning(f"跳过无效的ISP区间覆盖条目 #{index} ({self.overrides_file}): {e}")
+                continue
+            valid.append(entry)
+        self.stats["invalid_overrides"] = invalid
+        return valid
+
+    def load(self) -> None:
+        """编译内置区间和覆盖文件，原子替换当前区间表
+
+        覆盖文件无法读取时只使用内置区间，其中格式错误的条目逐条跳过，不影响其余条目。
+        """
+        with self._lock:
+            try:
+                overrides = self._validate_overrides(self._load_overrides())
+            except Exception as e:
+                logger.error(f"加载ISP区间覆盖文件失败 {self.overrides_file}: {e}")
+                overrides = []
+
+            tables = compile_ranges(DEFAULT_ISP_RANGES + overrides)
+            self._tables = tables
+            self.stats["ranges"] = sum(len(table[0]) for table in tables.values())
+            self.stats["override_ranges"] = len(overrides)
+            self.stats["loaded_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        logger.info(f"ISP推断区间表已加载: {self.stats['ranges']} 个区间，覆盖条目 {len(overrides)} 个")
+
+    def reload_if_changed(self) -> bool:
+        """覆盖文件发生变化时重新加载"""
+        if not self.overrides_file:
+            return False
+
+        path = Path(self.overrides_file)
+        mtime = path.stat().st_mtime if path.exists() else None
+        if mtime == self._overrides_mtime:
+            return False
+
+        self.load()
+        return True
+
+    def lookup(self, ip: str) -> Optional[Dict[str, str]]:
+        """二分查找IP所在区间的ISP信息"""
+        return self.lookup_with_prefix(ip)[0]
+
+    def lookup_with_prefix(self, ip: str) -> Tuple[Optional[Dict[str, str]], int]:
+        """二分查找IP所在区间的ISP信息，同时返回推断结果保持一致的网段前缀长度
+
+        前缀长度按实际命中的区间（未命中时为相邻区间之间的空隙）计算，
+        与其他位置的网段粒度无关。无效地址返回(None, 128)。
+        """
+        self.stats["lookups"] += 1
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None, ADDRESS_BITS[6]
+
+        version, ip_int = parsed
+        bits = ADDRESS_BITS[version]
+        starts, ends, infos = self._tables[version]
+        index = bisect_right(starts, ip_int) - 1
+        if index >= 0 and ip_int <= ends[index]:
+            self.stats["hits"] += 1
+            return infos[index], block_prefix_len(ip_int, starts[index], ends[index], bits)
+
+        gap_start = ends[index] + 1 if index >= 0 else 0
+        gap_end = starts[index + 1] - 1 if index + 1 < len(starts) else (1 << bits) - 1
+        return None, block_prefix_len(ip_int, gap_start, gap_end, bits)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取区间表统计信息"""
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "overrides_file": self.overrides_file,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups > 0 else 0.0
+        }
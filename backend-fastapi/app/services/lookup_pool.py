@@ -0,0 +1,76 @@
+"""
+GeoIP查询进程池worker
+每个worker进程按主进程当前的数据库配置打开自己的读取器（mmap方式时数据页仍由所有进程共享），
+主进程按分块发送已排序的IP，worker以紧凑的元组/数组形式返回结果，减少进程间序列化开销。
+"""
+from array import array
+from typing import Optional, Dict, Any, List, Tuple, TYPE_CHECKING
+
+from app.services.geoip_records import LOCATION_FIELDS, ISP_FIELDS
+
+if TYPE_CHECKING:
+    from app.services.geoip_service import AsyncGeoIPService
+
+# 紧凑结果：(去重后的结果行, 每个IP对应的行号, 错误信息, 查询耗时, 网络前缀长度)
+# 结果行为(位置字段值元组, ISP字段值元组)，同一分块内相同的行只传输一次
+PackedColumns = Tuple[List[Tuple[tuple, tuple]], array, List[Optional[str]], array, List[Optional[int]]]
+
+# worker进程内的查询服务（由进程池initializer创建）
+_service: Optional["AsyncGeoIPService"] = None
+
+
+def init_worker(reader_config: Dict[str, Any]) -> None:
+    """进程池initializer：打开与主进程相同的数据库"""
+    from app.services.geoip_service import AsyncGeoIPService
+
+    global _service
+    _service = AsyncGeoIPService()
+    _service.open_readers_sync(reader_config)
+
+
+def get_worker_service() -> "AsyncGeoIPService":
+    """获取worker进程内的查询服务"""
+    if _service is None:
+        raise RuntimeError("GeoIP查询worker未初始化")
+    return _service
+
+
+def pack_columns(columns: Dict[str, List[Any]]) -> PackedColumns:
+    """将列式结果压缩为紧凑形式"""
+    rows: List[Tuple[tuple, tuple]] = []
+    row_ids: Dict[Tuple[tuple, tuple], int] = {}
+    indexes = array("I")
+    for location, isp in zip(columns["location"], columns["isp"]):
+        row = (
+            tuple(location.get(field) for field in LOCATION_FIELDS),
+            tuple(isp.get(field) for field in ISP_FIELDS)
+        )
+        row_id = row_ids.get(row)
+        if row_id is None:
+            row_id = row_ids[row] = len(rows)
+            rows.append(row)
+        indexes.append(row_id)
+    return rows, indexes, columns["error"], array("d", columns["query_time"]), columns["prefix_len"]
+
+
+def unpack_columns(packed: PackedColumns) -> Dict[str, List[Any]]:
+    """将紧凑形式还原为列式结果（同一行的IP共享同一个字典）"""
+    rows, indexes, errors, query_times, prefix_lens = packed
+    decoded = [
+        (dict(zip(LOCATION_FIELDS, location)), dict(zip(ISP_FIELDS, isp)))
+        for location, isp in rows
+    ]
+    return {
+        "location": [decoded[index][0] for index in indexes],
+        "isp": [decoded[index][1] for index in indexes],
+        "error": errors,
+        "query_time": query_times.tolist(),
+        "prefix_len": prefix_lens
+    }
+
+
+def lookup_items(items: List[Tuple[int, int, str]]) -> PackedColumns:
+    """查询一个已按地址排序的分块，返回紧凑结果"""
+    service = get_worker_service()
+    columns = service._query_batch_sync(items, service.result_cache.generation)
+    return pack_columns(columns)
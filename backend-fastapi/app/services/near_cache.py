@@ -0,0 +1,122 @@
+"""
+进程内近端缓存（L1）
+位于Redis（L2）之前的有界LRU缓存，按IP保存已解码的查询结果。
+每个条目的过期时间带随机抖动，避免同一批写入的热点IP在各worker中同时过期、同时回源。
+跨worker的失效由cache_service通过Redis发布/订阅广播。
+"""
+import ipaddress
+import random
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from app.models.schemas import IPQueryResult
+from app.services.prefix_cache import parse_ip
+
+
+class NearCache:
+    """有界LRU缓存（TTL带随机抖动）
+
+    只在事件循环线程中访问，不需要加锁。
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60, jitter: float = 0.1):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self._entries: "OrderedDict[str, Tuple[float, IPQueryResult]]" = OrderedDict()
+        self._generation = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用"""
+        return self.max_size > 0 and self.ttl > 0
+
+    @property
+    def generation(self) -> int:
+        """缓存代数，每次清空后递增，用于丢弃清空前从L2读取的结果"""
+        return self._generation
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, ip: str) -> Optional[IPQueryResult]:
+        """获取缓存结果"""
+        entry = self._entries.get(ip)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._entries[ip]
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(ip)
+        self.stats["hits"] += 1
+        return result
+
+    def put(self, ip: str, result: IPQueryResult, generation: Optional[int] = None) -> bool:
+        """写入缓存结果"""
+        if not self.enabled:
+            return False
+        # 读取L2期间发生过失效，结果可能已过时
+        if generation is not None and generation != self._generation:
+            return False
+
+        ttl = self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+        if ip in self._entries:
+            self._entries.move_to_end(ip)
+        else:
+            while len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        self._entries[ip] = (time.monotonic() + ttl, result)
+        return True
+
+    def delete(self, ip: str) -> bool:
+        """删除指定IP的缓存"""
+        self._generation += 1
+        return self._entries.pop(ip, None) is not None
+
+    def delete_network(self, network: str) -> int:
+        """删除网段内所有IP的缓存（网段键被删除时，由其得到的各IP条目同时失效），返回删除的条目数"""
+        self._generation += 1
+        try:
+            target = ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            return 0
+        start, end = int(target.network_address), int(target.broadcast_address)
+        removed = 0
+        for ip in list(self._entries):
+            parsed = parse_ip(ip)
+            if parsed is not None and parsed[0] == target.version and start <= parsed[1] <= end:
+                del self._entries[ip]
+                removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        self._generation += 1
+        self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hit_rate": round(self.stats["hits"] / total, 4) if total > 0 else 0.0
+        }
@@ -0,0 +1,172 @@
+"""
+进程内网络前缀结果缓存
+以mmdb返回的网络前缀为键缓存GeoIP查询结果，同一网段内的所有IP共享一个缓存条目
+"""
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+# 缓存键：(IP版本, 前缀长度, 网络地址整数)
+PrefixKey = Tuple[int, int, int]
+
+# 各IP版本的地址位数
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+def parse_ip(ip: str) -> Optional[Tuple[int, int]]:
+    """解析IP地址为(版本, 整数值)，无效地址返回None"""
+    try:
+        ip_obj = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return ip_obj.version, int(ip_obj)
+
+
+def block_prefix_len(ip_int: int, start: int, end: int, bits: int) -> int:
+    """计算包含ip_int且完全落在[start, end]区间内的最大CIDR网段的前缀长度"""
+    host_bits = 0
+    while host_bits < bits:
+        size = 1 << (host_bits + 1)
+        network = ip_int & ~(size - 1)
+        if network < start or network + size - 1 > end:
+            break
+        host_bits += 1
+    return bits - host_bits
+
+
+class PrefixLRUCache:
+    """线程安全的网络前缀LRU缓存（支持TTL过期）"""
+
+    def __init__(self, max_size: int = 10000, ttl: int = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[PrefixKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # 每个IP版本下各前缀长度的条目数，用于确定探测哪些前缀
+        self._prefix_counts: Dict[int, Dict[int, int]] = {4: {}, 6: {}}
+        self._probe_order: Dict[int, Tuple[int, ...]] = {4: (), 6: ()}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    @property
+    def generation(self) -> int:
+        """缓存代数，每次清空后递增，用于丢弃清空前发起的查询结果"""
+        return self._generation
+
+    def get(self, ip: str) -> Optional[Dict[str, Any]]:
+        """查找包含该IP的网络前缀对应的缓存结果"""
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        return self.lookup(*parsed)
+
+    def lookup(self, version: int, ip_int: int) -> Optional[Dict[str, Any]]:
+        """按已解析的IP地址查找缓存结果"""
+        bits = ADDRESS_BITS[version]
+        now = time.monotonic()
+
+        with self._lock:
+            # 从最长前缀开始探测
+            for prefix_len in self._probe_order[version]:
+                key = (version, prefix_len, ip_int >> (bits - prefix_len))
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at <= now:
+                    self._remove(key)
+                    self.stats["expirations"] += 1
+                    break
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, ip: str, prefix_len: int, value: Dict[str, Any], generation: Optional[int] = None) -> bool:
+        """按IP所在网络前缀写入缓存结果"""
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return False
+        return self.store(*parsed, prefix_len, value, generation)
+
+    def store(
+        self,
+        version: int,
+        ip_int: int,
+        prefix_len: int,
+        value: Dict[str, Any],
+        generation: Optional[int] = None
+    ) -> bool:
+        """按已解析的IP地址写入缓存结果"""
+        bits = ADDRESS_BITS[version]
+        if not 0 <= prefix_len <= bits or self.max_size <= 0:
+            return False
+
+        key = (version, prefix_len, ip_int >> (bits - prefix_len))
+        expires_at = time.monotonic() + self.ttl
+
+        with self._lock:
+            # 清空后才完成的查询结果可能来自旧数据库，直接丢弃
+            if generation is not None and generation != self._generation:
+                return False
+
+            if key in self._entries:
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+                return True
+
+            while len(self._entries) >= self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.stats["evictions"] += 1
+
+            self._entries[key] = (expires_at, value)
+            counts = self._prefix_counts[version]
+            counts[prefix_len] = counts.get(prefix_len, 0) + 1
+            if counts[prefix_len] == 1:
+                self._probe_order[version] = tuple(sorted(counts, reverse=True))
+            return True
+
+    def _remove(self, key: PrefixKey) -> None:
+        """删除缓存条目（调用方需持有锁）"""
+        del self._entries[key]
+        version, prefix_len, _ = key
+        counts = self._prefix_counts[version]
+        counts[prefix_len] -= 1
+        if counts[prefix_len] == 0:
+            del counts[prefix_len]
+            self._probe_order[version] = tuple(sorted(counts, reverse=True))
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._prefix_counts = {4: {}, 6: {}}
+            self._probe_order = {4: (), 6: ()}
+            self._generation += 1
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hit_rate": round(self.stats["hits"] / total, 4) if total > 0 else 0.0,
+                "prefix_lengths": {
+                    f"ipv{version}": sorted(counts) for version, counts in self._prefix_counts.items()
+                }
+            }
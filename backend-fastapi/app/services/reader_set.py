@@ -0,0 +1,266 @@
+"""
+版本化的GeoIP数据库读取器集合
+新读取器集合在后台打开并预热后通过一次引用替换生效，
+旧集合在其进行中的查询全部结束后才关闭
+"""
+import mmap
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple
+
+import geoip2.database
+import maxminddb
+
+try:
+    from maxminddb.extension import Reader as ExtensionReader
+except ImportError:  # 未安装libmaxminddb C扩展
+    ExtensionReader = None
+
+from app.core.logging import get_logger
+from app.services.geoip_snapshot import GeoIPSnapshot
+
+logger = get_logger(__name__)
+
+# 打开新数据库后用于预热的样例IP
+WARMUP_IPS = ("8.8.8.8", "1.1.1.1", "114.114.114.114", "223.5.5.5")
+
+# 可配置的读取器模式
+READER_MODES = {
+    "auto": maxminddb.MODE_AUTO,          # 依次尝试C扩展、mmap、文件模式
+    "mmap_ext": maxminddb.MODE_MMAP_EXT,  # libmaxminddb C扩展（mmap）
+    "mmap": maxminddb.MODE_MMAP,          # 纯Python mmap
+    "file": maxminddb.MODE_FILE,          # 纯Python文件读取
+    "memory": maxminddb.MODE_MEMORY,      # 整个文件读入进程内存
+}
+
+# 通过只读共享映射访问文件的模式：数据页位于内核页缓存中，所有worker进程共享同一份物理内存
+SHARED_READER_MODES = ("mmap_ext", "mmap")
+
+
+def detect_reader_mode(reader: geoip2.database.Reader) -> str:
+    """检测读取器实际使用的模式"""
+    db_reader = reader._db_reader
+    if ExtensionReader is not None and isinstance(db_reader, ExtensionReader):
+        return "mmap_ext"
+    buffer = getattr(db_reader, "_buffer", None)
+    if isinstance(buffer, mmap.mmap):
+        return "mmap"
+    if isinstance(buffer, (bytes, bytearray)):
+        return "memory"
+    return "file"
+
+
+def get_file_signature(path: str) -> Optional[Tuple[float, int]]:
+    """获取文件签名(修改时间, 大小)，文件不存在时返回None"""
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class ReaderSet:
+    """一组同时生效的城市/ASN/国家数据库读取器（或一个合并快照）"""
+
+    def __init__(
+        self,
+        version: int = 0,
+        city_reader: Optional[geoip2.database.Reader] = None,
+        asn_reader: Optional[geoip2.database.Reader] = None,
+        country_reader: Optional[geoip2.database.Reader] = None,
+        snapshot: Optional[GeoIPSnapshot] = None,
+        file_signatures: Optional[Dict[str, Tuple[float, int]]] = None,
+        modes: Optional[Dict[str, Dict[str, Any]]] = None
+    ):
+        self.version = version
+        self.city_reader = city_reader
+        self.asn_reader = asn_reader
+        self.country_reader = country_reader
+        self.snapshot = snapshot
+        # 打开时各数据库文件的签名，用于检测文件变化
+        self.file_signatures = file_signatures or {}
+        # 各读取器实际加载的模式
+        self.modes = modes or {}
+        self.in_flight = 0
+        self.retired = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(
+        cls,
+        version: int,
+        city_path: Optional[str] = None,
+        asn_path: Optional[str] = None,
+        country_path: Optional[str] = None,
+        mode: str = "auto",
+        require_shared: bool = False,
+        snapshot_path: Optional[str] = None
+    ) -> "ReaderSet":
+        """打开并预热一组读取器（同步方法，在线程池中执行）
+
+        指定snapshot_path时只加载合并快照，快照已包含城市/ASN/国家数据，不再打开mmdb读取器。
+        任何一个文件打开失败都会关闭已打开的读取器并抛出异常，当前生效的集合不受影响。
+        require_shared为True时，实际模式不是共享映射（mmap_ext/mmap）的读取器视为打开失败，
+        避免每个worker进程各自持有一份数据库副本。
+        """
+        if mode not in READER_MODES:
+            raise ValueError(f"不支持的读取器模式: {mode}，可选值: {', '.join(READER_MODES)}")
+
+        if snapshot_path:
+            return cls._open_snapshot(version, snapshot_path)
+
+        readers: Dict[str, geoip2.database.Reader] = {}
+        signatures: Dict[str, Tuple[float, int]] = {}
+        modes: Dict[str, Dict[str, Any]] = {}
+        try:
+            for name, path in (("city", city_path), ("asn", asn_path), ("country", country_path)):
+                if not path:
+                    continue
+                signature = get_file_signature(path)
+                if signature is None:
+                    logger.warning(f"数据库文件不存在: {path}")
+                    continue
+                readers[name] = geoip2.database.Reader(path, mode=READER_MODES[mode])
+                signatures[path] = signature
+
+                loaded_mode = detect_reader_mode(readers[name])
+                modes[name] = {
+                    "path": path,
+                    "requested_mode": mode,
+                    "mode": loaded_mode,
+                    "shared": loaded_mode in SHARED_READER_MODES,
+                    "size_bytes": signature[1]
+                }
+                if require_shared and loaded_mode not in SHARED_READER_MODES:
+                    raise RuntimeError(f"数据库 {path} 以 {loaded_mode} 模式加载，无法在worker进程间共享内存")
+
+                cls._warm(readers[name])
+        except Exception:
+            for reader in readers.values():
+                try:
+                    reader.close()
+                except Exception:
+                    pass
+            raise
+
+        return cls(
+            version=version,
+            city_reader=readers.get("city"),
+            asn_reader=readers.get("asn"),
+            country_reader=readers.get("country"),
+            file_signatures=signatures,
+            modes=modes
+        )
+
+    @classmethod
+    def _open_snapshot(cls, version: int, snapshot_path: str) -> "ReaderSet":
+        """打开合并快照（始终以只读共享内存映射方式加载）"""
+        signature = get_file_signature(snapshot_path)
+        if signature is None:
+            raise FileNotFoundError(f"快照文件不存在: {snapshot_path}")
+
+        snapshot = GeoIPSnapshot(snapshot_path)
+        for ip in WARMUP_IPS:
+            snapshot.lookup(ip)
+
+        return cls(
+            version=version,
+            snapshot=snapshot,
+            file_signatures={snapshot_path: signature},
+            modes={
+                "snapshot": {
+                    "path": snapshot_path,
+                    "requested_mode": "mmap",
+                    "mode": "mmap",
+                    "shared": True,
+                    "size_bytes": signature[1]
+                }
+            }
+        )
+
+    @staticmethod
+    def _warm(reader: geoip2.database.Reader) -> None:
+        """预热读取器，提前加载搜索树顶部的页面"""
+        for ip in WARMUP_IPS:
+            try:
+                reader._db_reader.get(ip)
+            except Exception:
+                pass
+
+    @property
+    def has_readers(self) -> bool:
+        """是否至少有一个可用的读取器"""
+        return bool(self.city_reader or self.asn_reader or self.country_reader or self.snapshot)
+
+    @property
+    def build_epoch(self) -> Optional[int]:
+        """数据构建时间（Unix时间戳），多个数据库时取最早的一个，没有读取器时为None"""
+        if self.snapshot is not None:
+            epochs = [
+                source.get("build_epoch")
+                for source in (self.snapshot.header.get("sources") or {}).values()
+            ]
+        else:
+            epochs = [
+                reader.metadata().build_epoch
+                for reader in (self.city_reader, self.asn_reader, self.country_reader)
+                if reader is not None
+            ]
+        epochs = [epoch for epoch in epochs if epoch]
+        return min(epochs) if epochs else None
+
+    def acquire(self) -> bool:
+        """登记一个进行中的查询，集合已关闭时返回False"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        """结束一个进行中的查询，已退役的集合在最后一个查询结束时关闭"""
+        with self._lock:
+            self.in_flight -= 1
+            should_close = self.retired and self.in_flight == 0 and not self.closed
+            if should_close:
+                self.closed = True
+        if should_close:
+            self._close()
+
+    def retire(self) -> None:
+        """标记集合退役，没有进行中的查询时立即关闭"""
+        with self._lock:
+            self.retired = True
+            should_close = self.in_flight == 0 and not self.closed
+            if should_close:
+                self.closed = True
+        if should_close:
+            self._close()
+
+    def _close(self) -> None:
+        """关闭所有读取器"""
+        for reader in (self.city_reader, self.asn_reader, self.country_reader):
+            if reader is None:
+                continue
+            try:
+                reader.close()
+            except Exception as e:
+                logger.warning(f"关闭数据库读取器时出错: {e}")
+        if self.snapshot is not None:
+            try:
+                self.snapshot.close()
+            except Exception as e:
+                logger.warning(f"关闭GeoIP快照时出错: {e}")
+        logger.info(f"数据库读取器集合 v{self.version} 已关闭")
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取集合状态"""
+        return {
+            "version": self.version,
+            "in_flight": self.in_flight,
+            "retired": self.retired,
+            "closed": self.closed,
+            "files": list(self.file_signatures),
+            "modes": self.modes
+        }
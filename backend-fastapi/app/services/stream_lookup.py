@@ -0,0 +1,217 @@
+"""
+流式批量IP查询
+从分块上传的请求体中逐行读取IP（纯文本或CSV），按固定窗口交给GeoIP服务查询，
+并将结果以NDJSON或CSV逐窗口写回。同一时刻只持有一个窗口的输入和输出，
+上游读取由下游发送驱动，客户端接收变慢时不会继续读取请求体。
+"""
+import csv
+import io
+import json
+import time
+from typing import AsyncIterator, Dict, Any, List, Optional
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app.core.logging import get_logger
+from app.services.geoip_service import geoip_service
+
+logger = get_logger(__name__)
+
+# 支持的输出格式及对应的Content-Type
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# CSV输出列（location/isp字段展开为平铺列）
+CSV_COLUMNS = (
+    "ip", "country", "country_code", "region", "region_code", "city", "postal_code",
+    "latitude", "longitude", "timezone", "isp", "organization", "asn", "asn_organization",
+    "query_time", "error"
+)
+
+
+class StreamInputError(ValueError):
+    """上传内容无法解析（行过长、IP数量超限等）"""
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """边读取请求体边写出响应的流式响应
+
+    StreamingResponse会并发等待断开消息，与生成器中读取请求体争用同一个receive通道，
+    导致请求体消息被丢弃。这里只负责发送，客户端断开由请求体读取时的ClientDisconnect感知。
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_request_ips(
+    chunks: AsyncIterator[bytes],
+    max_line_length: int = 1024,
+    max_ips: int = 0
+) -> AsyncIterator[str]:
+    """从请求体分块中逐个解析IP
+
+    每行一个IP，或CSV格式（首行含ip列名时取该列，否则取第一列，字段可用双引号包围）。
+    空行和以#开头的注释行被忽略。任何一行超过max_line_length字节时抛出StreamInputError，
+    max_ips为0时不限制数量。
+    """
+    buffer = b""
+    column: Optional[int] = None
+    count = 0
+
+    def parse_line(raw: bytes) -> Optional[str]:
+        nonlocal column
+        if len(raw) > max_line_length:
+            raise StreamInputError(f"单行长度超过{max_line_length}字节")
+        line = raw.decode("utf-8", errors="replace").strip().lstrip("\ufeff")
+        if not line or line.startswith("#"):
+            return None
+
+        fields = [field.strip() for field in next(csv.reader([line], skipinitialspace=True), [])]
+        if column is None:
+            lowered = [field.lower() for field in fields]
+            if "ip" in lowered:
+                column = lowered.index("ip")
+                return None
+            column = 0
+        return fields[column] if column < len(fields) else ""
+
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > max_line_length:
+            raise StreamInputError(f"单行长度超过{max_line_length}字节")
+
+        for raw in lines:
+            ip = parse_line(raw)
+            if ip is None:
+                continue
+            count += 1
+            if max_ips and count > max_ips:
+                raise StreamInputError(f"流式查询数量不能超过{max_ips}个")
+            yield ip
+
+    if buffer:
+        ip = parse_line(buffer)
+        if ip is not None:
+            count += 1
+            if max_ips and count > max_ips:
+                raise StreamInputError(f"流式查询数量不能超过{max_ips}个")
+            yield ip
+
+
+def format_ndjson(columns: Dict[str, List[Any]]) -> str:
+    """将一个窗口的列式结果编码为NDJSON"""
+    return "".join(
+        json.dumps({
+            "ip": ip,
+            "location": location,
+            "isp": isp,
+            "query_time": query_time,
+            "cached": False,
+            "error": error
+        }, ensure_ascii=False) + "\n"
+        for ip, location, isp, error, query_time in zip(
+            columns["ip"], columns["location"], columns["isp"], columns["error"], columns["query_time"]
+        )
+    )
+
+
+def format_csv(columns: Dict[str, List[Any]], header: bool = False) -> str:
+    """将一个窗口的列式结果编码为CSV"""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for ip, location, isp, error, query_time in zip(
+        columns["ip"], columns["location"], columns["isp"], columns["error"], columns["query_time"]
+    ):
+        writer.writerow((
+            ip, location.get("country"), location.get("country_code"), location.get("region"),
+            location.get("region_code"), location.get("city"), location.get("postal_code"),
+            location.get("latitude"), location.get("longitude"), location.get("timezone"),
+            isp.get("isp"), isp.get("organization"), isp.get("asn"), isp.get("asn_organization"),
+            query_time, error
+        ))
+    return output.getvalue()
+
+
+def _format_record(output_format: str, kind: str, data: Dict[str, Any]) -> str:
+    """编码进度/汇总/错误记录（NDJSON为单独的对象行，CSV为#注释行）"""
+    if output_format == "ndjson":
+        return json.dumps({kind: data}, ensure_ascii=False) + "\n"
+    fields = " ".join(f"{key}={value}" for key, value in data.items())
+    return f"# {kind} {fields}\n"
+
+
+async def stream_lookup(
+    ips: AsyncIterator[str],
+    output_format: str = "ndjson",
+    window_size: int = 1000,
+    batch_size: int = 200,
+    progress: bool = True
+) -> AsyncIterator[str]:
+    """按窗口查询IP并逐窗口产出编码后的结果
+
+    progress为True时每个窗口后附带一条进度记录，结束时附带汇总记录；
+    输入解析或查询失败时产出错误记录并结束（响应头此时已发送，无法再改变状态码）。
+    """
+    start_time = time.time()
+    processed = 0
+    failed = 0
+    window: List[str] = []
+    header = output_format == "csv"
+
+    async def flush() -> str:
+        nonlocal processed, failed, header
+        columns = await geoip_service.query_batch_columns(window, batch_size=batch_size)
+        processed += len(window)
+        failed += sum(1 for error in columns["error"] if error)
+        if output_format == "csv":
+            body = format_csv(columns, header=header)
+            header = False
+        else:
+            body = format_ndjson(columns)
+        if progress:
+            body += _format_record(output_format, "progress", {
+                "processed": processed,
+                "failed": failed,
+                "elapsed": round(time.time() - start_time, 3)
+            })
+        return body
+
+    try:
+        async for ip in ips:
+            window.append(ip)
+            if len(window) >= window_size:
+                yield await flush()
+                window = []
+        if window:
+            yield await flush()
+            window = []
+        if header:
+            yield ",".join(CSV_COLUMNS) + "\n"
+    except Exception as e:
+        logger.warning(f"流式查询中止，已处理{processed}个: {e}")
+        message = str(e) if isinstance(e, StreamInputError) else "查询服务暂时不可用"
+        yield _format_record(output_format, "error", {"message": message, "processed": processed})
+        return
+
+    elapsed = time.time() - start_time
+    logger.info(f"流式查询完成，共{processed}个，失败{failed}个，耗时{elapsed:.2f}秒")
+    if progress:
+        yield _format_record(output_format, "summary", {
+            "total": processed,
+            "success_count": processed - failed,
+            "failed": failed,
+            "elapsed": round(elapsed, 3),
+            "rate": round(processed / elapsed, 1) if elapsed > 0 else 0.0
+        })
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+GeoIP查询执行方式基准测试
+分别以线程池、进程池和事件循环内直接执行三种方式运行相同的批量查询，比较吞吐量
+（需在backend-fastapi目录下运行，使用API目录中的数据库）
+"""
+import argparse
+import asyncio
+import random
+import sys
+import os
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.services.geoip_service import AsyncGeoIPService, EXECUTOR_MODES
+
+
+def generate_ips(count: int, seed: int) -> list:
+    """生成随机公网IPv4地址"""
+    rng = random.Random(seed)
+    return [
+        f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        for _ in range(count)
+    ]
+
+
+async def run_mode(mode: str, ips: list, args) -> dict:
+    """以指定执行方式运行一轮基准测试"""
+    settings.geoip_executor_mode = mode
+    settings.geoip_auto_reload = False
+    settings.geoip_cache_enabled = args.cache
+    if args.workers:
+        settings.geoip_process_workers = args.workers
+
+    service = AsyncGeoIPService()
+    await service.initialize()
+    try:
+        requests = [ips[i:i + args.request_size] for i in range(0, len(ips), args.request_size)]
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def run_request(request_ips):
+            async with semaphore:
+                columns = await service.query_batch_columns(request_ips, batch_size=args.batch_size)
+                if args.build_results:
+                    service.build_results(columns)
+
+        # 预热（进程池worker首次查询时加载数据页）
+        await run_request(requests[0])
+
+        start = time.perf_counter()
+        await asyncio.gather(*[run_request(request_ips) for request_ips in requests])
+        elapsed = time.perf_counter() - start
+    finally:
+        await service.close()
+
+    return {"mode": mode, "elapsed": elapsed, "rate": len(ips) / elapsed}
+
+
+async def main_async(args) -> None:
+    """依次运行各执行方式并输出结果"""
+    ips = generate_ips(args.count, args.seed)
+    print(f"IP数量: {args.count}, 请求大小: {args.request_size}, 分块大小: {args.batch_size}, "
+          f"并发请求: {args.concurrency}, 进程池worker: {args.workers or os.cpu_count()}, "
+          f"前缀缓存: {'开启' if args.cache else '关闭'}")
+
+    results = []
+    for mode in args.modes:
+        result = await run_mode(mode, ips, args)
+        results.append(result)
+        print(f"  {mode:<8} {result['elapsed']:8.3f} 秒  {result['rate']:12,.0f} IP/秒")
+
+    baseline = next((r for r in results if r["mode"] == "thread"), results[0])
+    for result in results:
+        print(f"  {result['mode']:<8} 相对 {baseline['mode']}: {result['rate'] / baseline['rate']:.2f}x")
+
+
+def main():
+    """解析参数并运行基准测试"""
+    parser = argparse.ArgumentParser(description="GeoIP查询执行方式基准测试")
+    parser.add_argument("--count", type=int, default=200000, help="查询的IP数量")
+    parser.add_argument("--request-size", type=int, default=1000, help="每个批量请求的IP数量")
+    parser.add_argument("--batch-size", type=int, default=250, help="每个执行分块的IP数量")
+    parser.add_argument("--concurrency", type=int, default=32, help="同时进行的批量请求数")
+    parser.add_argument("--workers", type=int, default=0, help="进程池worker数量（0为CPU核数）")
+    parser.add_argument("--modes", default=",".join(EXECUTOR_MODES), help="逗号分隔的执行方式")
+    parser.add_argument("--cache", action="store_true", help="开启进程内前缀缓存")
+    parser.add_argument("--build-results", action="store_true", help="同时构建IPQueryResult模型")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    args = parser.parse_args()
+
+    args.modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in args.modes if mode not in EXECUTOR_MODES]
+    if unknown:
+        parser.error(f"不支持的执行方式: {', '.join(unknown)}")
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+中间件栈基准测试
+以进程内ASGI传输向 /api/query 并发发送请求，输出吞吐量和延迟分位数，
+用于比较中间件栈改动前后的单次请求开销（不经过网络和服务器，不启用Redis）
+（需在backend-fastapi目录下运行，使用API目录中的数据库）
+"""
+import argparse
+import asyncio
+import random
+import sys
+import os
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from app.config import settings
+from app.core.logging import stop_logging
+
+
+def generate_ips(count: int, seed: int) -> list:
+    """生成随机公网IPv4地址"""
+    rng = random.Random(seed)
+    return [
+        f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        for _ in range(count)
+    ]
+
+
+def build_app(bare: bool):
+    """创建应用（不运行lifespan），放宽频率限制避免基准请求被拒绝"""
+    from app.main import create_app
+    from app.middleware.performance import RateLimitMiddleware
+
+    app = create_app()
+    if bare:
+        app.user_middleware = []
+    for middleware in app.user_middleware:
+        if middleware.cls is RateLimitMiddleware:
+            middleware.kwargs["calls_per_minute"] = 10 ** 9
+    return app
+
+
+def percentile(values: list, fraction: float) -> float:
+    """计算分位数（values需已排序）"""
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+async def main_async(args) -> None:
+    """运行基准测试并输出结果"""
+    from app.services.geoip_service import geoip_service
+
+    settings.redis_enabled = False
+    settings.geoip_auto_reload = False
+    await geoip_service.initialize()
+
+    app = build_app(args.bare)
+    ips = generate_ips(args.count, args.seed)
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+
+        async def run_request(index: int, ip: str, record: bool = True):
+            # 轮换来源地址，避免安全中间件的按IP限流
+            headers = {"X-Forwarded-For": f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get("/api/query", params={"ip": ip}, headers=headers)
+                elapsed = time.perf_counter() - start
+            if record:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        # 预热（构建中间件栈、加载数据页）
+        await asyncio.gather(*[
+            run_request(index, ip, record=False) for index, ip in enumerate(ips[:args.warmup])
+        ])
+
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            run_request(index + args.warmup, ip) for index, ip in enumerate(ips)
+        ])
+        total = time.perf_counter() - start
+
+    await geoip_service.close()
+    # 写完后台队列中的日志，避免其输出在结果之后
+    stop_logging()
+
+    latencies.sort()
+    print(f"请求数: {args.count}, 并发: {args.concurrency}, "
+          f"中间件: {'无' if args.bare else '完整'}, 状态码: {statuses}")
+    print(f"  吞吐量 {args.count / total:10,.0f} 请求/秒")
+    print(f"  p50    {percentile(latencies, 0.50) * 1000:10.2f} 毫秒")
+    print(f"  p99    {percentile(latencies, 0.99) * 1000:10.2f} 毫秒")
+
+
+def main():
+    """解析参数并运行基准测试"""
+    parser = argparse.ArgumentParser(description="中间件栈基准测试")
+    parser.add_argument("--count", type=int, default=5000, help="请求数量")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的请求数")
+    parser.add_argument("--warmup", type=int, default=200, help="预热请求数")
+    parser.add_argument("--bare", action="store_true", help="移除全部自定义中间件作为对照")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--quiet", action="store_true", help="关闭INFO及以下的日志输出（请求日志等）")
+    args = parser.parse_args()
+
+    if args.quiet:
+        # structlog日志按同名标准库记录器过滤，logging.disable同样生效
+        import logging
+        logging.disable(logging.INFO)
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
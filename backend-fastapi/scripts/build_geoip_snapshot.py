@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+生成GeoIP合并列式快照脚本
+将API目录中的城市/ASN/国家数据库编译为一个快照文件，供GeoIP服务以内存映射方式加载
+"""
+import argparse
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.services.geoip_snapshot import build_snapshot
+
+
+def main():
+    """解析参数并生成快照"""
+    parser = argparse.ArgumentParser(description="生成GeoIP合并列式快照")
+    parser.add_argument("--city", default="API/GeoLite2-City.mmdb", help="城市数据库路径，传空字符串表示不使用")
+    parser.add_argument("--asn", default="API/GeoLite2-ASN.mmdb", help="ASN数据库路径，传空字符串表示不使用")
+    parser.add_argument("--country", default="API/GeoLite2-Country.mmdb", help="国家数据库路径，传空字符串表示不使用")
+    parser.add_argument("--output", default=settings.geoip_snapshot_path, help="快照输出路径")
+    args = parser.parse_args()
+
+    paths = {}
+    for name in ("city", "asn", "country"):
+        path = getattr(args, name)
+        if path and not os.path.exists(path):
+            print(f"⚠️ {name}数据库不存在，已跳过: {path}")
+            path = None
+        paths[name] = path or None
+
+    try:
+        header = build_snapshot(
+            args.output,
+            city_path=paths["city"],
+            asn_path=paths["asn"],
+            country_path=paths["country"]
+        )
+    except Exception as e:
+        print(f"❌ 生成快照失败: {e}")
+        return False
+
+    print(f"✅ 快照已生成: {args.output}")
+    print(f"   IPv4区间: {header['interval_counts']['4']}, IPv6区间: {header['interval_counts']['6']}")
+    print(f"   行数: {header['row_count']}, 字符串数: {header['string_count']}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,37 @@
+"""
+测试公共工具：查询结果构建、fakeredis缓存服务及缓存配置
+"""
+import fakeredis
+import pytest
+
+from app.config import settings
+from app.models.schemas import IPQueryResult, LocationInfo, ISPInfo
+from app.services.cache_service import AsyncCacheService, RELEASE_LOCK_SCRIPT
+
+
+def make_result(ip: str = "8.8.8.8", city: str = "Mountain View") -> IPQueryResult:
+    """构建测试用查询结果"""
+    return IPQueryResult(
+        ip=ip,
+        location=LocationInfo(
+            country="United States", country_code="US", city=city,
+            latitude=37.386, longitude=-122.0838, timezone="America/Los_Angeles"
+        ),
+        isp=ISPInfo(isp="Google LLC", organization="Google LLC", asn="15169", asn_organization="Google LLC"),
+        query_time=0.0012
+    )
+
+
+def make_service(server: fakeredis.FakeServer) -> AsyncCacheService:
+    """连接到共享fakeredis服务器的缓存服务（相当于一个worker）"""
+    service = AsyncCacheService()
+    service.redis = fakeredis.aioredis.FakeRedis(server=server)
+    service._release_lock = service.redis.register_script(RELEASE_LOCK_SCRIPT)
+    return service
+
+
+@pytest.fixture
+def cache_settings(monkeypatch):
+    """关闭准入策略，所有结果都写入Redis"""
+    monkeypatch.setattr(settings, "cache_policy_enabled", False)
+    monkeypatch.setattr(settings, "cache_key_mode", "ip")
@@ -0,0 +1,92 @@
+"""
+缓存值编解码测试
+"""
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+from app.config import settings
+from app.models.schemas import IPQueryResult, LocationInfo, ISPInfo
+from app.optimization.cache import CacheConfig, CacheManager, IPQueryCache
+from app.services.cache_codec import (
+    NEGATIVE_RECORD, RECORD_MARKER, JSONSerializer, TupleSerializer, decode_result, is_negative
+)
+from tests.conftest import make_result
+
+
+def empty_result(ip: str = "192.0.2.1") -> IPQueryResult:
+    """构建负结果（所有字段为空）"""
+    return IPQueryResult(ip=ip, location=LocationInfo(), isp=ISPInfo(), query_time=0.001)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_tuple_round_trip(compression):
+    """测试定长元组格式编解码后结果不变"""
+    result = make_result()
+    data = TupleSerializer(compression).encode(result)
+
+    assert data[0] == RECORD_MARKER
+    decoded = decode_result(data)
+    assert decoded.cached is True
+    assert decoded.model_dump(exclude={"cached"}) == result.model_dump(exclude={"cached"})
+
+
+def test_tuple_is_smaller_than_json():
+    """测试压缩元组格式小于JSON格式"""
+    result = make_result()
+    assert len(TupleSerializer("zlib").encode(result)) < len(JSONSerializer().encode(result)) / 2
+
+
+def test_legacy_json_values_still_decode():
+    """测试旧的JSON对象格式缓存值仍可读取"""
+    result = make_result()
+    for data in (JSONSerializer().encode(result), json.dumps(result.model_dump()).encode("utf-8")):
+        decoded = decode_result(data)
+        assert decoded.ip == "8.8.8.8"
+        assert decoded.location.city == "Mountain View"
+        assert decoded.isp.asn == "15169"
+
+
+def test_negative_record():
+    """测试负结果只存储记录头，解码为空结果"""
+    result = empty_result()
+    assert is_negative(result)
+    assert not is_negative(result.model_copy(update={"error": "失败"}))
+
+    data = TupleSerializer("zlib").encode(result)
+    assert data == NEGATIVE_RECORD
+    decoded = decode_result(data)
+    assert decoded.ip == ""
+    assert is_negative(decoded)
+
+
+def test_unknown_data_is_rejected():
+    """测试无法识别的数据和旧版本记录按错误处理"""
+    with pytest.raises(ValueError):
+        decode_result(b"\x00\x01\x02")
+    with pytest.raises(ValueError):
+        decode_result(bytes((RECORD_MARKER, 99, 1)) + b"payload")
+
+
+def test_ip_query_cache_reads_service_encoding(monkeypatch):
+    """测试管理端IP缓存按查询服务的编码格式读写"""
+    monkeypatch.setattr(settings, "redis_enabled", True)
+    manager = CacheManager(CacheConfig())
+    manager.redis_client = fakeredis.aioredis.FakeRedis()
+    manager.redis_available = True
+    cache = IPQueryCache(manager)
+
+    async def run():
+        await manager.redis_client.set("ip_query:8.8.8.8", TupleSerializer("zlib").encode(make_result()))
+        await manager.redis_client.set("ip_query:192.0.2.1", NEGATIVE_RECORD)
+        assert (await cache.get_ip_info("8.8.8.8"))["isp"]["isp"] == "Google LLC"
+        assert (await cache.get_ip_info("192.0.2.1"))["ip"] == "192.0.2.1"
+
+        assert await cache.set_ip_info("1.1.1.1", make_result("1.1.1.1").model_dump())
+        raw = await manager.redis_client.get("ip_query:1.1.1.1")
+        assert decode_result(raw).ip == "1.1.1.1"
+        assert (await cache.get_ip_info("1.1.1.1"))["location"]["country_code"] == "US"
+
+    asyncio.run(run())
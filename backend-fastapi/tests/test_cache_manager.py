@@ -0,0 +1,101 @@
+"""
+缓存管理器（SCAN/UNLINK和键索引）测试
+"""
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.config import settings
+from app.optimization.cache import CacheConfig, CacheManager, IPQueryCache
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """连接到fakeredis的缓存管理器（启用键索引）"""
+    monkeypatch.setattr(settings, "redis_enabled", True)
+    monkeypatch.setattr(settings, "cache_key_index_enabled", True)
+    manager = CacheManager(CacheConfig())
+    manager.redis_client = fakeredis.aioredis.FakeRedis()
+    manager.redis_available = True
+    return manager
+
+
+def test_scan_and_delete_by_pattern(manager):
+    """测试按模式分批遍历和删除，删除时同时移出命名空间索引"""
+    async def run():
+        for i in range(25):
+            await manager.set(f"ip_query:10.0.0.{i}", {"i": i}, ttl=60, index="ip_query")
+        await manager.set("stats:daily", {"total": 1}, ttl=60)
+
+        batches = [keys async for keys in manager.scan_keys("ip_query:*", count=10)]
+        assert sum(len(keys) for keys in batches) == 25
+        assert len(await manager.get_keys_by_pattern("ip_query:*", limit=5)) == 5
+
+        assert await manager.delete_by_pattern("ip_query:*") == 25
+        assert await manager.get_keys_by_pattern("ip_query:*") == []
+        assert await manager.redis_client.zcard(manager.index_key("ip_query")) == 0
+        assert await manager.get("stats:daily") == {"total": 1}
+
+    asyncio.run(run())
+
+
+def test_index_counts_by_expiry(manager):
+    """测试通过索引按剩余时间统计，不遍历键"""
+    cache = IPQueryCache(manager)
+
+    async def run():
+        await manager.set("ip_query:1.1.1.1", {}, ttl=600, index="ip_query")
+        await manager.set("ip_query:2.2.2.2", {}, ttl=7200, index="ip_query")
+        await manager.set("ip_query:3.3.3.3", {}, ttl=7200, index="ip_query")
+
+        stats = await cache.get_cache_stats()
+        assert stats["source"] == "index"
+        assert stats["total_cached_ips"] == 3
+        assert stats["ttl_distribution"] == {"< 1 hour": 1, "1-24 hours": 2}
+
+        assert await manager.delete("ip_query:1.1.1.1")
+        assert (await cache.get_cache_stats())["total_cached_ips"] == 2
+
+    asyncio.run(run())
+
+
+def test_rebuild_and_prune_index(manager):
+    """测试为已有键重建索引，并移除已过期的索引成员"""
+    cache = IPQueryCache(manager)
+
+    async def run():
+        client = manager.redis_client
+        await client.setex("ip_query:1.1.1.1", 600, b"x")
+        await client.setex("ip_query:2.2.2.2", 600, b"x")
+        await client.set("ip_query:3.3.3.3", b"x")
+
+        stats = await cache.get_cache_stats()
+        assert stats["source"] == "sample"
+        assert stats["total_cached_ips"] == 3
+
+        # 没有过期时间的键不登记
+        assert await cache.rebuild_index() == 2
+        await client.zadd(manager.index_key("ip_query"), {"ip_query:9.9.9.9": 1})
+        assert await cache.cleanup_expired() == 1
+        assert (await cache.get_cache_stats())["total_cached_ips"] == 2
+
+    asyncio.run(run())
+
+
+def test_flush_all_keeps_rate_limit_state(manager):
+    """测试清空缓存和按模式删除都不会删除同库的频率限制状态"""
+    async def run():
+        client = manager.redis_client
+        await manager.set("ip_query:1.1.1.1", {}, ttl=60, index="ip_query")
+        await manager.set("stats:daily", {}, ttl=60)
+        await client.set("ratelimit:global:1.2.3.4", b"1")
+
+        assert await manager.flush_all()
+        assert await client.keys() == [b"ratelimit:global:1.2.3.4"]
+
+        await manager.set("ip_query:1.1.1.1", {}, ttl=60)
+        assert await manager.delete_by_pattern("*") == 1
+        assert await client.keys() == [b"ratelimit:global:1.2.3.4"]
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+"""
+缓存准入与自适应TTL策略测试
+"""
+import time
+
+from app.services.cache_policy import MAX_FREQUENCY, CachePolicy, FrequencySketch
+
+
+def test_sketch_counts_and_saturates():
+    """测试频率估计随访问增长并饱和于上限"""
+    sketch = FrequencySketch(width=1024)
+    assert sketch.estimate("8.8.8.8") == 0
+    for expected in range(1, MAX_FREQUENCY + 1):
+        assert sketch.increment("8.8.8.8") == expected
+    assert sketch.increment("8.8.8.8") == MAX_FREQUENCY
+    assert sketch.estimate("1.1.1.1") <= 1
+
+
+def test_sketch_ages_counts():
+    """测试累计写入sample_size次后所有计数减半"""
+    sketch = FrequencySketch(width=16, sample_factor=1)
+    for _ in range(8):
+        sketch.increment("8.8.8.8")
+    for i in range(sketch.sample_size - 8):
+        sketch.increment(f"10.0.0.{i}")
+    assert sketch.resets == 1
+    assert sketch.estimate("8.8.8.8") <= 4
+
+
+def test_admission_requires_min_frequency():
+    """测试只出现一次的IP不被准入"""
+    policy = CachePolicy(min_frequency=2)
+    policy.record("8.8.8.8")
+    assert not policy.admit("8.8.8.8")
+    policy.record("8.8.8.8")
+    assert policy.admit("8.8.8.8")
+    assert policy.get_stats()["admission_rate"] == 0.5
+
+    assert CachePolicy(enabled=False).admit("8.8.8.8")
+
+
+def test_ttl_grows_with_frequency():
+    """测试TTL从准入阈值处的最短TTL随频率增长到最长TTL"""
+    policy = CachePolicy(min_frequency=2, min_ttl=300, max_ttl=86400)
+    ttls = []
+    for _ in range(MAX_FREQUENCY):
+        policy.record("8.8.8.8")
+        if policy.is_admissible("8.8.8.8"):
+            ttls.append(policy.ttl_for("8.8.8.8", 3600))
+
+    assert ttls[0] == 300
+    assert ttls[-1] == 86400
+    assert ttls == sorted(ttls)
+    assert policy.ttl_for("8.8.8.8", 3600, adaptive=False) == 3600
+
+
+def test_ttl_capped_by_next_database_update():
+    """测试TTL不超过数据库预计的下一次更新时间，已超过预计时间时不再限制"""
+    policy = CachePolicy(enabled=False, update_interval=86400)
+    assert policy.cap_ttl(7200) == 7200
+
+    policy.set_build_epoch(int(time.time()) - 86400 + 600)
+    assert 590 <= policy.cap_ttl(7200) <= 600
+    assert policy.cap_ttl(60) == 60
+    assert policy.ttl_for("8.8.8.8", 7200) <= 600
+    assert policy.stats["ttl_capped"] == 1
+
+    policy.set_build_epoch(int(time.time()) - 2 * 86400)
+    assert policy.cap_ttl(7200) == 7200
@@ -0,0 +1,243 @@
+"""
+缓存服务测试（fakeredis）
+"""
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.config import settings
+from app.models.schemas import IPQueryResult, LocationInfo, ISPInfo
+from tests.conftest import make_result, make_service
+
+
+class CountingLoader:
+    """记录调用次数的查询函数，每次查询耗时delay秒"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, ip: str) -> IPQueryResult:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return make_result(ip)
+
+
+@pytest.fixture(autouse=True)
+def single_flight_settings(cache_settings, monkeypatch):
+    """在公共缓存配置基础上启用进程内合并，关闭Redis锁"""
+    monkeypatch.setattr(settings, "cache_single_flight_enabled", True)
+    monkeypatch.setattr(settings, "cache_lock_enabled", False)
+
+
+def test_concurrent_misses_are_coalesced():
+    """测试同一worker内同一IP的并发未命中只查询一次"""
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+        loader = CountingLoader()
+        results = await asyncio.gather(*(service.get_or_load("8.8.8.8", loader) for _ in range(10)))
+
+        assert loader.calls == 1
+        assert {result.location.city for result in results} == {"Mountain View"}
+        assert service.stats["coalesced_count"] == 9
+        assert service._inflight == {}
+
+        # 之后的请求由缓存应答
+        await service.get_or_load("8.8.8.8", loader)
+        assert loader.calls == 1
+        await service.close()
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_cancel_shared_load():
+    """测试取消其中一个等待的请求不影响其他请求"""
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+        loader = CountingLoader()
+        first = asyncio.create_task(service.get_or_load("8.8.8.8", loader))
+        second = asyncio.create_task(service.get_or_load("8.8.8.8", loader))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        assert (await second).ip == "8.8.8.8"
+        assert loader.calls == 1
+        await service.close()
+
+    asyncio.run(run())
+
+
+def test_redis_lock_coalesces_across_workers(monkeypatch):
+    """测试开启Redis锁时，其他worker等待持锁者写入结果而不重复查询"""
+    monkeypatch.setattr(settings, "cache_lock_enabled", True)
+    monkeypatch.setattr(settings, "cache_lock_poll_interval", 0.01)
+
+    async def run():
+        server = fakeredis.FakeServer()
+        first, second = make_service(server), make_service(server)
+        first_loader, second_loader = CountingLoader(delay=0.1), CountingLoader()
+
+        results = await asyncio.gather(
+            first.get_or_load("8.8.8.8", first_loader),
+            second.get_or_load("8.8.8.8", second_loader)
+        )
+
+        assert first_loader.calls + second_loader.calls == 1
+        assert all(result.ip == "8.8.8.8" for result in results)
+        assert first.stats["lock_wait_hit_count"] + second.stats["lock_wait_hit_count"] == 1
+        # 锁在写入后释放
+        assert await first.redis.get(first._get_lock_key("8.8.8.8")) is None
+        await first.close()
+        await second.close()
+
+    asyncio.run(run())
+
+
+def test_failed_load_is_not_cached():
+    """测试查询失败时所有等待的请求都收到异常，且不留下进行中的任务"""
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+
+        async def failing(ip: str) -> IPQueryResult:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("数据库不可用")
+
+        results = await asyncio.gather(
+            *(service.get_or_load("8.8.8.8", failing) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert service._inflight == {}
+        assert await service.redis.get("ip_query:8.8.8.8") is None
+        await service.close()
+
+    asyncio.run(run())
+
+
+def test_delete_removes_network_key_and_peer_l1(monkeypatch):
+    """测试网段键模式下删除IP缓存时同时删除网段键，并清除其他worker中同网段各IP的L1"""
+    monkeypatch.setattr(settings, "cache_key_mode", "prefix")
+
+    async def run():
+        server = fakeredis.FakeServer()
+        writer, reader = make_service(server), make_service(server)
+        reader._invalidation_task = asyncio.create_task(reader._listen_invalidations())
+        try:
+            await asyncio.sleep(0.05)
+            result = make_result("203.0.113.7")
+            result._prefix_len = 24
+            assert await writer.cache_result(result)
+            assert await writer.redis.exists("ip_query:203.0.113.0/24")
+
+            reader._prefix_index_loaded_at = 0.0
+            assert (await reader.get_cached_result("203.0.113.9")).ip == "203.0.113.9"
+            await writer.cache_result(make_result("8.8.8.8"))
+            await reader.get_cached_result("8.8.8.8")
+            assert len(reader.near_cache) == 2
+
+            assert await writer.delete_cache("203.0.113.50")
+            assert not await writer.redis.exists("ip_query:203.0.113.0/24")
+            for _ in range(100):
+                if len(reader.near_cache) == 1:
+                    break
+                await asyncio.sleep(0.01)
+            assert reader.near_cache.get("203.0.113.9") is None
+            assert reader.near_cache.get("8.8.8.8") is not None
+            assert await reader.get_cached_result("203.0.113.9") is None
+        finally:
+            await reader.close()
+            await writer.close()
+
+    asyncio.run(run())
+
+
+def test_bogon_addresses_skip_cache_and_loader():
+    """测试保留地址由区间表直接应答，不访问Redis和数据库"""
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+        loader = CountingLoader()
+        result = await service.get_or_load("10.1.2.3", loader)
+
+        assert loader.calls == 0
+        assert result.isp.organization == "Private-Use (RFC 1918)"
+        assert service.stats["bogon_count"] == 1
+        assert await service.redis.dbsize() == 0
+
+        cached, misses = await service.get_cached_results(["192.168.1.1", "8.8.8.8"])
+        assert set(cached) == {"192.168.1.1"}
+        assert misses == ["8.8.8.8"]
+        await service.close()
+
+    asyncio.run(run())
+
+
+def test_negative_results_use_short_ttl(monkeypatch):
+    """测试不在数据库中的地址以cache_negative_ttl负缓存，命中时按请求IP返回空结果"""
+    monkeypatch.setattr(settings, "cache_negative_ttl", 120)
+    monkeypatch.setattr(settings, "cache_stale_ttl", 0)
+
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+        empty = IPQueryResult(ip="45.1.2.3", location=LocationInfo(), isp=ISPInfo(), query_time=0.001)
+        assert await service.cache_result(empty)
+        assert await service.cache_result(make_result())
+
+        assert 0 < await service.redis.ttl("ip_query:45.1.2.3") <= 120
+        assert await service.redis.ttl("ip_query:8.8.8.8") > 120
+        assert service.stats["negative_cached_count"] == 1
+
+        service.near_cache.clear()
+        result = await service.get_cached_result("45.1.2.3")
+        assert result.ip == "45.1.2.3"
+        assert result.location.country is None
+        assert service.stats["negative_hit_count"] == 1
+        await service.close()
+
+    asyncio.run(run())
+
+
+def test_purge_results_on_database_switch():
+    """测试数据库切换时删除全部查询结果，保留其他键"""
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+        for i in range(5):
+            await service.cache_result(make_result(f"8.8.8.{i}"))
+        await service.redis.set("ip_query_lock:8.8.8.8", b"token")
+        await service.redis.set("ratelimit:127.0.0.1", b"1")
+
+        assert await service.purge_results() == 5
+        assert len(service.near_cache) == 0
+        assert await service.get_cached_result("8.8.8.1") is None
+        assert sorted(await service.redis.keys()) == [b"ip_query_lock:8.8.8.8", b"ratelimit:127.0.0.1"]
+
+        # 清空缓存同样只删除查询结果
+        await service.cache_result(make_result())
+        assert await service.clear_cache()
+        assert sorted(await service.redis.keys()) == [b"ip_query_lock:8.8.8.8", b"ratelimit:127.0.0.1"]
+        await service.close()
+
+    asyncio.run(run())
+
+
+def test_purge_once_per_build():
+    """测试各worker切换到同一数据库构建时只有第一个删除结果，其余只清空本地L1"""
+    async def run():
+        server = fakeredis.FakeServer()
+        first, second = make_service(server), make_service(server)
+        for i in range(3):
+            await first.cache_result(make_result(f"8.8.8.{i}"))
+        second.near_cache.put("8.8.8.8", make_result())
+
+        assert await first.purge_for_build(1700000000) == 3
+        await first.cache_result(make_result("1.1.1.1"))
+
+        assert await second.purge_for_build(1700000000) is None
+        assert len(second.near_cache) == 0
+        assert await second.get_cached_result("1.1.1.1") is not None
+
+        # 下一个构建再次删除
+        assert await second.purge_for_build(1700086400) == 1
+        await first.close()
+        await second.close()
+
+    asyncio.run(run())
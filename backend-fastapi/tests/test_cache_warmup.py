@@ -0,0 +1,54 @@
+"""
+缓存预热测试
+"""
+import asyncio
+import threading
+
+import fakeredis
+import pytest
+
+from app.services import cache_warmup
+from app.services.cache_warmup import CacheWarmer, STARTUP_DONE
+from tests.conftest import make_service
+
+
+pytestmark = pytest.mark.usefixtures("cache_settings")
+
+
+def test_startup_warmup_runs_in_one_worker(monkeypatch):
+    """测试多个worker同时启动时只有认领者执行预热，其余worker等待其完成后就绪"""
+    monkeypatch.setattr(cache_warmup, "STARTUP_POLL_INTERVAL", 0.01)
+    release = threading.Event()
+    selected = []
+
+    def select(limit, days):
+        selected.append(limit)
+        release.wait(timeout=5)
+        return []
+
+    async def run():
+        service = make_service(fakeredis.FakeServer())
+        service.set_build_epoch(1700000000)
+        monkeypatch.setattr(cache_warmup, "cache_service", service)
+
+        leader, follower = CacheWarmer(), CacheWarmer()
+        leader._select_from_records = select
+        follower._select_from_records = select
+
+        await leader.start_on_startup()
+        await follower.start_on_startup()
+        await asyncio.sleep(0.05)
+        assert not leader.ready
+        assert not follower.ready
+        assert not follower.running
+
+        release.set()
+        await asyncio.wait_for(leader._task, timeout=2)
+        await asyncio.wait_for(follower._startup_task, timeout=2)
+        assert leader.ready and follower.ready
+        assert leader.progress["status"] == "completed"
+        assert len(selected) == 1
+        assert await service.redis.get("ip_query_warmup:1700000000") == STARTUP_DONE
+        await service.close()
+
+    asyncio.run(run())
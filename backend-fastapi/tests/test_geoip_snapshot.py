@@ -0,0 +1,103 @@
+"""
+GeoIP列式快照测试
+"""
+import ipaddress
+
+import pytest
+from mmdb_writer import MMDBWriter
+from netaddr import IPSet
+
+from app.services.geoip_service import AsyncGeoIPService
+from app.services.geoip_snapshot import GeoIPSnapshot, build_snapshot
+from app.services.reader_set import ReaderSet
+
+CITY_RECORDS = {
+    "203.0.113.0/24": {
+        "country": {"iso_code": "AU", "names": {"en": "Australia"}},
+        "city": {"names": {"en": "Sydney"}},
+        "location": {"latitude": -33.86, "longitude": 151.2, "time_zone": "Australia/Sydney"},
+    },
+    "203.0.113.128/25": {
+        "country": {"iso_code": "AU", "names": {"en": "Australia"}},
+        "city": {"names": {"en": "Melbourne"}},
+    },
+    "2001:db8::/32": {
+        "country": {"iso_code": "DE", "names": {"en": "Germany"}},
+    },
+}
+
+ASN_RECORDS = {
+    "203.0.112.0/23": {"autonomous_system_number": 64500, "autonomous_system_organization": "Example Net"},
+    "198.51.100.0/24": {"autonomous_system_number": 64501, "autonomous_system_organization": "Doc Net"},
+}
+
+
+def write_mmdb(path, database_type, records):
+    """写入测试用mmdb文件"""
+    writer = MMDBWriter(ip_version=6, database_type=database_type, ipv4_compatible=True)
+    for network, record in records.items():
+        writer.insert_network(IPSet([network]), record)
+    writer.to_db_file(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def databases(tmp_path):
+    """生成城市/ASN测试数据库"""
+    city_path = write_mmdb(tmp_path / "city.mmdb", "GeoLite2-City", CITY_RECORDS)
+    asn_path = write_mmdb(tmp_path / "asn.mmdb", "GeoLite2-ASN", ASN_RECORDS)
+    return city_path, asn_path
+
+
+def test_snapshot_matches_online_lookup(databases, tmp_path):
+    """测试快照查找结果与在线合并查询一致"""
+    city_path, asn_path = databases
+    snapshot_path = str(tmp_path / "merged.snap")
+    header = build_snapshot(snapshot_path, city_path=city_path, asn_path=asn_path)
+    assert set(header["sources"]) == {"city", "asn"}
+
+    service = AsyncGeoIPService()
+    readers = ReaderSet.open(1, city_path=city_path, asn_path=asn_path, mode="memory")
+    snapshot = GeoIPSnapshot(snapshot_path)
+    try:
+        for ip in ("203.0.113.5", "203.0.113.200", "203.0.112.9", "198.51.100.7", "2001:db8::1", "192.0.2.1"):
+            online = service._lookup_merged(ip, readers)
+            row, _ = snapshot.lookup(ip)
+            if row is None:
+                assert not any(online["location"].values()) and not online["isp"]["asn"]
+            else:
+                assert row == (online["location"], online["isp"])
+    finally:
+        snapshot.close()
+        readers.retire()
+
+
+def test_snapshot_prefix_covers_uniform_block(databases, tmp_path):
+    """测试返回的前缀内所有地址的查找结果相同"""
+    city_path, asn_path = databases
+    snapshot_path = str(tmp_path / "merged.snap")
+    build_snapshot(snapshot_path, city_path=city_path, asn_path=asn_path)
+
+    snapshot = GeoIPSnapshot(snapshot_path)
+    try:
+        for ip in ("203.0.113.5", "203.0.113.200", "203.0.112.9", "10.1.2.3"):
+            row, prefix_len = snapshot.lookup(ip)
+            network = ipaddress.ip_network(f"{ip}/{prefix_len}", strict=False)
+            for address in (network.network_address, network.broadcast_address):
+                assert snapshot.lookup(str(address))[0] == row
+
+        row, prefix_len = snapshot.lookup("203.0.113.200")
+        assert row[0]["city"] == "Melbourne"
+        assert row[1]["asn"] == "64500"
+        assert prefix_len == 25
+    finally:
+        snapshot.close()
+
+
+def test_snapshot_rejects_invalid_file(tmp_path):
+    """测试非快照文件无法加载"""
+    path = tmp_path / "bad.snap"
+    path.write_bytes(b"NOTASNAP" + b"\0" * 64)
+
+    with pytest.raises(ValueError):
+        GeoIPSnapshot(str(path))
@@ -0,0 +1,96 @@
+"""
+ISP推断区间表测试
+"""
+import ipaddress
+import os
+import random
+
+from app.services.isp_ranges import ISPRangeTable, compile_ranges
+
+
+def test_compile_ranges_prefers_most_specific_network():
+    """测试嵌套网段由最具体的网段决定"""
+    tables = compile_ranges([
+        {"network": "10.0.0.0/8", "isp": "Wide"},
+        {"network": "10.1.2.0/24", "isp": "Narrow"},
+    ])
+    starts, ends, infos = tables[4]
+
+    assert [info["isp"] for info in infos] == ["Wide", "Narrow", "Wide"]
+    assert tables[6] == ([], [], [])
+
+
+def test_range_table_lookup_with_overrides(tmp_path):
+    """测试内置区间查找和覆盖文件加载"""
+    overrides = tmp_path / "isp_ranges.json"
+    overrides.write_text('[{"network": "8.8.8.0/24", "isp": "Override"}]', encoding="utf-8")
+
+    table = ISPRangeTable(str(overrides))
+    table.load()
+
+    assert table.lookup("8.8.8.8")["isp"] == "Override"
+    assert table.lookup("8.8.1.1")["organization"] == "Google Services"
+    assert table.lookup("192.0.2.1") is None
+    assert table.get_stats()["hit_rate"] == round(2 / 3, 4)
+
+
+def test_compile_ranges_matches_naive_resolution():
+    """测试扫描编译结果与逐个网段比较的结果一致"""
+    rng = random.Random(7)
+    entries = []
+    for index in range(200):
+        prefix = rng.choice([8, 12, 16, 20, 24, 28, 32])
+        address = rng.choice([10, 11]) << 24 | rng.getrandbits(24)
+        entries.append({"network": f"{ipaddress.ip_address(address)}/{prefix}", "isp": f"isp-{index}"})
+
+    table = ISPRangeTable()
+    table._tables = compile_ranges(entries)
+
+    networks = {}
+    for entry in entries:
+        networks[ipaddress.ip_network(entry["network"], strict=False)] = entry["isp"]
+    for _ in range(2000):
+        ip = ipaddress.ip_address(rng.choice([10, 11, 12]) << 24 | rng.getrandbits(24))
+        covering = [network for network in networks if ip in network]
+        expected = networks[max(covering, key=lambda network: network.prefixlen)] if covering else None
+        info = table.lookup(str(ip))
+        assert (info["isp"] if info else None) == expected
+
+
+def test_lookup_prefix_uses_matched_interval():
+    """测试返回的前缀长度只取决于命中的区间，不受其他位置的长前缀影响"""
+    table = ISPRangeTable()
+    table._tables = compile_ranges([
+        {"network": "10.0.0.0/8", "isp": "Wide"},
+        {"network": "10.1.2.3/32", "isp": "Single"},
+    ])
+
+    assert table.lookup_with_prefix("10.1.2.3") == ({"isp": "Single", "organization": None}, 32)
+    assert table.lookup_with_prefix("10.200.0.1")[1] == 9
+    assert table.lookup_with_prefix("192.0.2.1") == (None, 1)
+
+
+def test_invalid_overrides_are_skipped(tmp_path):
+    """测试覆盖文件中的无效条目被跳过，其余条目和内置区间仍然生效"""
+    overrides = tmp_path / "isp_ranges.json"
+    overrides.write_text(
+        '[{"network": "10.0.0.300/24", "isp": "Bad"},'
+        ' {"isp": "Missing"},'
+        ' "not-an-object",'
+        ' {"network": "192.0.2.0/24", "isp": "Good"}]',
+        encoding="utf-8"
+    )
+
+    table = ISPRangeTable(str(overrides))
+    table.load()
+
+    assert table.lookup("192.0.2.1")["isp"] == "Good"
+    assert table.lookup("8.8.8.8")["organization"] == "Google Public DNS"
+    assert table.get_stats()["invalid_overrides"] == 3
+    assert table.get_stats()["override_ranges"] == 1
+
+    overrides.write_text('[{"network": "not-a-network"}]', encoding="utf-8")
+    os.utime(overrides, (0, 0))
+    assert table.reload_if_changed() is True
+    assert table.lookup("192.0.2.1") is None
+    assert table.lookup("8.8.8.8")["isp"] == "Google LLC"
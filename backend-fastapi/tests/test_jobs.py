@@ -0,0 +1,116 @@
+"""
+批量查询任务测试
+"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.core.exceptions import ValidationException
+from app.jobs import service as job_service
+from app.jobs.models import BulkLookupJob
+from app.jobs.service import BulkJobManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """使用独立SQLite数据库和任务目录的任务管理器"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    BulkLookupJob.__table__.create(bind=engine)
+    monkeypatch.setattr(job_service, "SessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(settings, "jobs_enabled", True)
+    monkeypatch.setattr(settings, "jobs_dir", str(tmp_path / "jobs"))
+    monkeypatch.setattr(settings, "jobs_shard_size", 2)
+    monkeypatch.setattr(settings, "jobs_max_per_user", 2)
+    monkeypatch.setattr(settings, "jobs_max_disk_mb_per_user", 1)
+    return BulkJobManager()
+
+
+def create(manager: BulkJobManager, body: bytes, owner_id: int) -> BulkLookupJob:
+    """上传内容并创建任务"""
+    async def chunks():
+        yield body
+    return asyncio.run(manager.create_job(chunks(), None, "ndjson", owner_id))
+
+
+def test_jobs_are_scoped_to_owner(manager):
+    """测试任务只对创建者可见，超级管理员（不限定范围）可见全部"""
+    job = create(manager, b"8.8.8.8\n1.1.1.1\n9.9.9.9\n", owner_id=1)
+    assert job.total_ips == 3
+    assert job.shard_offsets == [0, 16]
+    assert job.disk_bytes == 24
+
+    assert manager.get_job(job.id, owner_id=1).id == job.id
+    assert manager.get_job(job.id, owner_id=2) is None
+    assert manager.get_job(job.id) is not None
+    assert manager.list_jobs(owner_id=2) == []
+    assert manager.cancel_job(job.id, owner_id=2) is None
+    assert manager.delete_job(job.id, owner_id=2) is False
+    assert manager.cancel_job(job.id, owner_id=1).status == "cancelled"
+
+
+def test_job_count_quota(manager):
+    """测试每个用户的任务数量上限"""
+    create(manager, b"8.8.8.8\n", owner_id=1)
+    create(manager, b"8.8.8.8\n", owner_id=1)
+    with pytest.raises(ValidationException):
+        create(manager, b"8.8.8.8\n", owner_id=1)
+    create(manager, b"8.8.8.8\n", owner_id=2)
+
+
+def test_job_disk_quota(manager, tmp_path):
+    """测试上传超出剩余磁盘配额时拒绝创建并清理临时文件"""
+    body = b"".join(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}\n".encode() for i in range(100000))
+    with pytest.raises(ValidationException):
+        create(manager, body, owner_id=1)
+    assert list((tmp_path / "jobs").iterdir()) == []
+
+
+def test_job_routes_require_authentication():
+    """测试任务接口需要认证"""
+    from main import app
+
+    client = TestClient(app)
+    assert client.get("/api/jobs").status_code in (401, 403)
+    assert client.post("/api/jobs/1/cancel").status_code in (401, 403)
+    assert client.get("/api/jobs/1/shards/0").status_code in (401, 403)
+
+
+def test_results_over_disk_quota_stop_job(manager):
+    """测试执行中结果文件超出磁盘配额时任务以失败结束"""
+    job = create(manager, b"8.8.8.8\n1.1.1.1\n", owner_id=1)
+    manager.worker_id = "test-worker"
+    db = job_service.SessionLocal()
+    db.query(BulkLookupJob).filter(BulkLookupJob.id == job.id).update(
+        {"status": "running", "worker_id": manager.worker_id}
+    )
+    db.commit()
+    db.close()
+
+    manager.get_shard_path(job.id, 0, "ndjson").write_bytes(b"x" * (2 * 1024 * 1024))
+    assert manager._record_progress(job.id, [(0, (2, 0))]) is False
+
+    job = manager.get_job(job.id)
+    assert job.status == "failed"
+    assert job.completed_shards == [0]
+    assert "磁盘配额" in job.error_message
+
+
+def test_resume_from_threadpool_wakes_poll_loop(manager):
+    """测试在线程池中恢复任务时通过事件循环唤醒轮询"""
+    job = create(manager, b"8.8.8.8\n", owner_id=1)
+    manager.cancel_job(job.id, owner_id=1)
+
+    async def run():
+        manager._wakeup = asyncio.Event()
+        manager._loop = asyncio.get_running_loop()
+        resumed = await run_in_threadpool(manager.resume_job, job.id, 1)
+        assert resumed.status == "pending"
+        await asyncio.wait_for(manager._wakeup.wait(), timeout=1)
+
+    asyncio.run(run())
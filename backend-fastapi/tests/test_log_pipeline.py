@@ -0,0 +1,137 @@
+"""
+日志管道测试
+"""
+import io
+import logging
+import sys
+
+import pytest
+import structlog
+
+from app.core.log_pipeline import (
+    BatchLogWriter, BoundedQueueHandler, EventSampler, LogPipeline, QueueLogger, filter_by_stdlib_level
+)
+
+
+def render(created: float, method_name: str, event_dict: dict) -> str:
+    """测试用渲染函数（不含时间，便于比较输出）"""
+    return f"{method_name} {event_dict['event']}"
+
+
+def make_pipeline(queue_enabled: bool, **kwargs) -> LogPipeline:
+    """写入StringIO的日志管道"""
+    return LogPipeline(
+        render, EventSampler(), queue_enabled=queue_enabled, stream=io.StringIO(), flush_interval=0.01, **kwargs
+    )
+
+
+def test_queue_drops_when_full():
+    """测试队列已满时丢弃新记录，写入时输出丢弃数量"""
+    handler = BoundedQueueHandler(maxsize=2)
+    for i in range(5):
+        handler.put((0.0, "info", {"event": f"e{i}"}))
+    assert len(handler.queue) == 2
+    assert handler.enqueued == 2
+    assert handler.dropped == 3
+
+    stream = io.StringIO()
+    writer = BatchLogWriter(handler, lambda item: render(*item), stream)
+    writer.start()
+    writer.stop()
+    assert stream.getvalue().splitlines() == ["info e0", "info e1", "日志队列已满，已丢弃 3 条日志"]
+    assert writer.written == 2
+
+
+def test_sampling_by_event_and_logger_name(monkeypatch):
+    """测试按事件名、再按记录器名抽样，WARNING及以上不抽样"""
+    sampler = EventSampler({"请求完成": 0.0, "performance": 0.0, "request": 1.0})
+    request_logger = QueueLogger("request", None)
+    performance_logger = QueueLogger("performance", None)
+
+    with pytest.raises(structlog.DropEvent):
+        sampler(request_logger, "info", {"event": "请求完成"})
+    assert sampler(request_logger, "info", {"event": "请求开始"}) == {"event": "请求开始"}
+    with pytest.raises(structlog.DropEvent):
+        sampler(performance_logger, "debug", {"event": "性能数据"})
+    assert sampler(performance_logger, "warning", {"event": "性能数据"}) == {"event": "性能数据"}
+    assert sampler.sampled_out == {"请求完成": 1, "performance": 1}
+
+    # 0到1之间按随机数保留
+    sampler = EventSampler({"noisy": 0.5})
+    monkeypatch.setattr("app.core.log_pipeline.random.random", lambda: 0.7)
+    with pytest.raises(structlog.DropEvent):
+        sampler(request_logger, "info", {"event": "noisy"})
+    monkeypatch.setattr("app.core.log_pipeline.random.random", lambda: 0.3)
+    assert sampler(request_logger, "info", {"event": "noisy"})
+
+
+def test_queued_output_matches_sync_output():
+    """测试入队模式与同步模式的输出相同，停止时写完队列中的记录"""
+    outputs = []
+    for queue_enabled in (False, True):
+        pipeline = make_pipeline(queue_enabled, batch_size=3)
+        pipeline.start()
+        logger = pipeline.logger_factory("app")
+        for i in range(10):
+            logger.info({"event": f"事件{i}"})
+        logger.error({"event": "失败"})
+        pipeline.stop()
+        outputs.append(pipeline.stream.getvalue())
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0].splitlines()[-1] == "error 失败"
+    assert len(outputs[0].splitlines()) == 11
+
+
+def test_stdlib_handler_output():
+    """测试标准库日志记录在两种模式下按消息原样输出"""
+    for queue_enabled in (False, True):
+        pipeline = make_pipeline(queue_enabled)
+        pipeline.start()
+        record = logging.LogRecord("uvicorn", logging.INFO, __file__, 1, "监听 %s", ("0.0.0.0",), None)
+        pipeline.create_handler().handle(record)
+        pipeline.stop()
+        assert pipeline.stream.getvalue() == "监听 0.0.0.0\n"
+
+
+def test_stdlib_record_formatted_at_emit():
+    """测试标准库日志在入队时合并参数，之后修改参数不影响输出，异常在入队时展开"""
+    pipeline = make_pipeline(True)
+    handler = pipeline.create_handler()
+    items = ["a"]
+    handler.handle(logging.LogRecord("app", logging.INFO, __file__, 1, "items %s", (items,), None))
+    items.append("b")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("app", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+    handler.handle(record)
+    assert record.exc_info is not None
+    assert all(item.args is None and item.exc_info is None for item in handler.queue)
+
+    pipeline.start()
+    pipeline.stop()
+    output = pipeline.stream.getvalue()
+    assert output.startswith("items ['a']\nfailed\nTraceback")
+    assert "ValueError: boom" in output
+
+
+def test_stdlib_level_settings_apply():
+    """测试logging.disable和记录器级别对structlog事件同样生效"""
+    logger = QueueLogger("test.log_pipeline", None)
+    stdlib_logger = logging.getLogger("test.log_pipeline")
+    stdlib_logger.setLevel(logging.WARNING)
+    try:
+        with pytest.raises(structlog.DropEvent):
+            filter_by_stdlib_level(logger, "info", {"event": "x"})
+        assert filter_by_stdlib_level(logger, "warning", {"event": "x"}) == {"event": "x"}
+
+        stdlib_logger.setLevel(logging.DEBUG)
+        assert filter_by_stdlib_level(logger, "info", {"event": "x"})
+        logging.disable(logging.INFO)
+        with pytest.raises(structlog.DropEvent):
+            filter_by_stdlib_level(logger, "info", {"event": "x"})
+        assert filter_by_stdlib_level(logger, "exception", {"event": "x"})
+    finally:
+        logging.disable(logging.NOTSET)
+        stdlib_logger.setLevel(logging.NOTSET)
@@ -0,0 +1,146 @@
+"""
+请求中间件栈（纯ASGI）测试
+"""
+import fakeredis
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.core import rate_limit
+from app.core.error_handler import SecurityErrorHandler
+from app.core.rate_limit import rate_limiter
+from app.core.security_middleware import SECURITY_RATE_LIMIT_POLICY, SecurityHeaders, SecurityMiddleware
+from app.middleware.performance import PerformanceMiddleware, RateLimitMiddleware
+
+
+def build_app(calls_per_minute: int = 120) -> FastAPI:
+    """按main.py的顺序组装中间件"""
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"pong": True}
+
+    @app.get("/api/stream")
+    async def stream():
+        async def body():
+            for i in range(3):
+                yield f"{i}\n".encode()
+        return StreamingResponse(body(), media_type="text/plain")
+
+    @app.post("/api/submit")
+    async def submit():
+        return {"ok": True}
+
+    @app.get("/api/fail")
+    async def fail():
+        raise RuntimeError("boom")
+
+    app.add_middleware(SecurityMiddleware)
+    app.add_middleware(SecurityErrorHandler, debug=False)
+    app.add_middleware(PerformanceMiddleware)
+    app.add_middleware(RateLimitMiddleware, calls_per_minute=calls_per_minute)
+    return app
+
+
+@pytest.fixture(autouse=True)
+def local_rate_limit(monkeypatch):
+    """使用进程内令牌桶，每个测试从空计数开始"""
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "rate_limit_use_redis", False)
+    rate_limiter.local.clear()
+    yield
+    rate_limiter.local.clear()
+
+
+def test_response_headers():
+    """测试普通响应和流式响应都带有安全头和计时头"""
+    client = TestClient(build_app())
+    for path, body in (("/api/ping", b'{"pong":true}'), ("/api/stream", b"0\n1\n2\n")):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.content == body
+        for header, value in SecurityHeaders.get_security_headers().items():
+            assert response.headers[header] == value
+        assert response.headers["X-Response-Time"].endswith("s")
+        float(response.headers["X-Process-Time"])
+
+
+def test_early_responses():
+    """测试CSRF和非法输入的拒绝响应"""
+    client = TestClient(build_app())
+
+    response = client.post("/api/submit")
+    assert response.status_code == 403
+    assert response.json() == {"detail": "CSRF令牌无效或缺失"}
+    assert "X-Response-Time" in response.headers
+
+    response = client.get("/api/ping", params={"q": "<script>alert(1)</script>"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "请求包含非法字符"}
+
+
+def test_unhandled_exception_becomes_json_error(monkeypatch):
+    """测试未处理的异常转换为500 JSON响应，非调试模式下不泄露异常信息"""
+    monkeypatch.setattr(settings, "debug", False)
+    client = TestClient(build_app(), raise_server_exceptions=False)
+    response = client.get("/api/fail")
+    assert response.status_code == 500
+    assert response.json()["error_type"] == "internal_error"
+    assert "boom" not in response.text
+
+
+def test_rate_limit_response_headers():
+    """测试超出限额时返回429、Retry-After及CORS头"""
+    client = TestClient(build_app(calls_per_minute=2))
+    headers = {"Origin": "http://localhost:3000"}
+    assert client.get("/api/ping", headers=headers).status_code == 200
+    assert client.get("/api/ping", headers=headers).status_code == 200
+
+    response = client.get("/api/ping", headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["Access-Control-Allow-Origin"] == "http://localhost:3000"
+    assert response.headers["Access-Control-Allow-Credentials"] == "true"
+    assert response.json()["error"]["code"] == "RATE_LIMIT_ERROR"
+
+
+def test_policies_checked_in_one_redis_call(monkeypatch):
+    """测试全局策略和安全策略在同一次Redis脚本调用中判断"""
+    client = fakeredis.aioredis.FakeRedis()
+    calls = []
+
+    class CountingRedis:
+        def register_script(self, script):
+            registered = client.register_script(script)
+
+            async def call(keys, args):
+                calls.append(keys)
+                return await registered(keys=keys, args=args)
+            return call
+
+    monkeypatch.setattr(rate_limit, "get_redis", lambda: CountingRedis())
+    monkeypatch.setattr(settings, "redis_enabled", True)
+    monkeypatch.setattr(settings, "rate_limit_use_redis", True)
+    monkeypatch.setattr(settings, "rate_limit_redis_timeout", 5.0)
+    monkeypatch.setattr(rate_limiter, "_script", None)
+
+    response = TestClient(build_app()).get("/api/ping")
+    assert response.status_code == 200
+    assert len(calls) == 1
+    assert [key.split(":")[1] for key in calls[0][::2]] == ["global", "security"]
+
+
+def test_security_limit_ignores_global_switch(monkeypatch):
+    """测试关闭全局频率限制后安全中间件的限制仍然生效"""
+    monkeypatch.setattr(settings, "rate_limit_enabled", False)
+    client = TestClient(build_app(calls_per_minute=1))
+    limit = SECURITY_RATE_LIMIT_POLICY.limit
+
+    for _ in range(limit):
+        assert client.get("/api/ping").status_code == 200
+    response = client.get("/api/ping")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
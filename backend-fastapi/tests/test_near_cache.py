@@ -0,0 +1,97 @@
+"""
+L1近端缓存及跨worker失效测试
+"""
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from app.services.near_cache import NearCache
+from tests.conftest import make_result, make_service
+
+
+pytestmark = pytest.mark.usefixtures("cache_settings")
+
+
+async def wait_until(predicate, timeout: float = 2.0) -> bool:
+    """等待条件成立"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+def test_lru_eviction_and_expiry(monkeypatch):
+    """测试超出容量时淘汰最久未使用的条目，过期条目按未命中处理"""
+    cache = NearCache(max_size=2, ttl=60, jitter=0)
+    cache.put("1.1.1.1", make_result("1.1.1.1"))
+    cache.put("2.2.2.2", make_result("2.2.2.2"))
+    assert cache.get("1.1.1.1") is not None
+    cache.put("3.3.3.3", make_result("3.3.3.3"))
+
+    assert cache.get("2.2.2.2") is None
+    assert cache.get("1.1.1.1") is not None
+    assert cache.stats["evictions"] == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr("app.services.near_cache.time.monotonic", lambda: now + 61)
+    assert cache.get("1.1.1.1") is None
+    assert cache.stats["expirations"] == 1
+
+
+def test_stale_generation_is_discarded():
+    """测试读取L2期间发生失效时，读到的结果不写入L1"""
+    cache = NearCache(max_size=10, ttl=60)
+    generation = cache.generation
+    cache.delete("8.8.8.8")
+    assert not cache.put("8.8.8.8", make_result(), generation)
+    assert cache.put("8.8.8.8", make_result(), cache.generation)
+
+
+def test_invalidation_reaches_other_workers():
+    """测试删除和清空缓存时其他worker的L1同时失效"""
+    async def run():
+        server = fakeredis.FakeServer()
+        writer, reader = make_service(server), make_service(server)
+        reader._invalidation_task = asyncio.create_task(reader._listen_invalidations())
+        try:
+            assert await wait_until(lambda: reader.near_cache.stats["invalidations"] > 0)
+
+            await writer.cache_result(make_result())
+            assert (await reader.get_cached_result("8.8.8.8")).location.city == "Mountain View"
+            assert len(reader.near_cache) == 1
+
+            # 另一个worker更新了Redis中的值，本worker的L1仍是旧值，直到收到失效消息
+            await writer.redis.set("ip_query:8.8.8.8", writer.serializer.encode(make_result(city="Sydney")))
+            assert (await reader.get_cached_result("8.8.8.8")).location.city == "Mountain View"
+
+            assert await writer.delete_cache("8.8.8.8")
+            assert await wait_until(lambda: len(reader.near_cache) == 0)
+            assert await reader.get_cached_result("8.8.8.8") is None
+
+            await writer.cache_result(make_result("1.1.1.1"))
+            await reader.get_cached_result("1.1.1.1")
+            assert len(reader.near_cache) == 1
+            await writer.invalidate_near_cache()
+            assert await wait_until(lambda: len(reader.near_cache) == 0)
+        finally:
+            await reader.close()
+            await writer.close()
+
+    asyncio.run(run())
+
+
+def test_delete_network():
+    """测试按网段清除L1条目"""
+    cache = NearCache(max_size=10, ttl=60)
+    for ip in ("203.0.113.1", "203.0.113.200", "203.0.114.1", "2001:db8::1"):
+        cache.put(ip, make_result(ip))
+
+    assert cache.delete_network("203.0.113.0/24") == 2
+    assert cache.get("203.0.114.1") is not None
+    assert cache.delete_network("2001:db8::/32") == 1
+    assert cache.delete_network("not-a-network") == 0
+    assert len(cache) == 1
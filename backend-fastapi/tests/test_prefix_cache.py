@@ -0,0 +1,41 @@
+"""
+进程内前缀缓存测试
+"""
+from app.services.prefix_cache import PrefixLRUCache
+
+
+def test_prefix_cache_shared_by_network():
+    """测试同一网段内的IP共享缓存条目"""
+    cache = PrefixLRUCache(max_size=10, ttl=60)
+    cache.put("8.8.8.8", 24, {"isp": "Google"})
+
+    assert cache.get("8.8.8.200") == {"isp": "Google"}
+    assert cache.get("8.8.9.1") is None
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_prefix_cache_lru_eviction():
+    """测试超过容量时淘汰最久未使用的条目"""
+    cache = PrefixLRUCache(max_size=2, ttl=60)
+    cache.put("1.1.1.1", 24, {"n": 1})
+    cache.put("2.2.2.2", 24, {"n": 2})
+    cache.get("1.1.1.1")
+    cache.put("3.3.3.3", 24, {"n": 3})
+
+    assert cache.get("2.2.2.2") is None
+    assert cache.get("1.1.1.1") == {"n": 1}
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_prefix_cache_clear_discards_stale_results():
+    """测试清空后丢弃旧代数的写入"""
+    cache = PrefixLRUCache(max_size=10, ttl=60)
+    generation = cache.generation
+    cache.clear()
+
+    assert not cache.put("2001:db8::1", 32, {"n": 1}, generation)
+    assert cache.put("2001:db8::1", 32, {"n": 1}, cache.generation)
+    assert cache.get("2001:db8:ffff::1") == {"n": 1}
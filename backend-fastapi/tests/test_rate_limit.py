@@ -0,0 +1,161 @@
+"""
+频率限制测试
+"""
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.config import settings
+from app.core import rate_limit
+from app.core.rate_limit import LocalTokenBucket, RateLimiter, RateLimitPolicy
+
+
+@pytest.fixture
+def redis_limiter(monkeypatch):
+    """使用fakeredis执行GCRA脚本的限流器"""
+    client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(rate_limit, "get_redis", lambda: client)
+    monkeypatch.setattr(settings, "redis_enabled", True)
+    monkeypatch.setattr(settings, "rate_limit_use_redis", True)
+    monkeypatch.setattr(settings, "rate_limit_redis_timeout", 5.0)
+    return RateLimiter()
+
+
+def test_gcra_allows_burst_then_rejects(redis_limiter):
+    """测试窗口内允许limit次，之后拒绝并给出等待时间"""
+    policy = RateLimitPolicy(name="test", limit=3, window=60)
+
+    async def run():
+        results = [await redis_limiter.check(policy, "1.2.3.4") for _ in range(4)]
+        assert [result.allowed for result in results] == [True, True, True, False]
+        assert [result.remaining for result in results[:3]] == [2, 1, 0]
+        assert all(result.backend == "redis" for result in results)
+        # 下一个令牌约在20秒后发放
+        assert 19 <= results[3].retry_after <= 20
+        assert results[3].retry_after_header == "20"
+
+        # 其他键不受影响
+        assert (await redis_limiter.check(policy, "5.6.7.8")).allowed
+        assert redis_limiter.stats["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_gcra_blocks_after_limit(redis_limiter):
+    """测试配置了封禁时长的策略超限后在封禁期内一直拒绝"""
+    policy = RateLimitPolicy(name="block", limit=1, window=60, block_seconds=900)
+
+    async def run():
+        assert (await redis_limiter.check(policy, "1.2.3.4")).allowed
+        rejected = await redis_limiter.check(policy, "1.2.3.4")
+        assert not rejected.allowed
+        assert rejected.retry_after == 900
+        assert await rate_limit.get_redis().exists("ratelimit:block:1.2.3.4:blocked")
+        assert 890 <= (await redis_limiter.check(policy, "1.2.3.4")).retry_after <= 900
+
+    asyncio.run(run())
+
+
+def test_check_many_stops_at_first_rejection(redis_limiter):
+    """测试多个策略在一次调用中按顺序判断，被拒绝之后的策略不计数"""
+    first = RateLimitPolicy(name="global", limit=2, window=60)
+    second = RateLimitPolicy(name="security", limit=1, window=60)
+
+    async def run():
+        results = await redis_limiter.check_many([(first, "1.2.3.4"), (second, "1.2.3.4")])
+        assert [result.allowed for result in results] == [True, True]
+
+        results = await redis_limiter.check_many([(first, "1.2.3.4"), (second, "1.2.3.4")])
+        assert [result.allowed for result in results] == [True, False]
+
+        # 第一个策略已拒绝时不再判断第二个策略
+        results = await redis_limiter.check_many([(first, "1.2.3.4"), (second, "5.6.7.8")])
+        assert [result.allowed for result in results] == [False]
+        assert not await rate_limit.get_redis().exists("ratelimit:security:5.6.7.8")
+        assert redis_limiter.stats["redis_checks"] == 5
+
+    asyncio.run(run())
+
+
+def test_falls_back_to_local_bucket_on_redis_error(monkeypatch):
+    """测试Redis出错时改用本地令牌桶，并在重试间隔内不再访问Redis"""
+    class BrokenRedis:
+        def register_script(self, script):
+            async def call(keys, args):
+                raise ConnectionError("connection refused")
+            return call
+
+    monkeypatch.setattr(rate_limit, "get_redis", lambda: BrokenRedis())
+    monkeypatch.setattr(settings, "redis_enabled", True)
+    monkeypatch.setattr(settings, "rate_limit_use_redis", True)
+    limiter = RateLimiter()
+    policy = RateLimitPolicy(name="test", limit=1, window=60)
+
+    async def run():
+        assert (await limiter.check(policy, "1.2.3.4")).backend == "local"
+        assert not limiter.redis_active
+        assert not (await limiter.check(policy, "1.2.3.4")).allowed
+        assert limiter.stats["redis_errors"] == 1
+
+    asyncio.run(run())
+
+
+def test_local_bucket_refills(monkeypatch):
+    """测试本地令牌桶按limit/window的速率补充"""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    bucket = LocalTokenBucket()
+    policy = RateLimitPolicy(name="test", limit=2, window=60)
+
+    assert bucket.check(policy, "a").allowed
+    assert bucket.check(policy, "a").allowed
+    rejected = bucket.check(policy, "a")
+    assert not rejected.allowed
+    assert rejected.retry_after == pytest.approx(30)
+
+    now[0] += 30
+    assert bucket.check(policy, "a").allowed
+
+
+def test_local_bucket_evicts_least_recently_used():
+    """测试键数超过max_keys时淘汰最久未使用的键"""
+    bucket = LocalTokenBucket(max_keys=2)
+    policy = RateLimitPolicy(name="test", limit=1, window=60)
+
+    bucket.check(policy, "a")
+    bucket.check(policy, "b")
+    assert not bucket.check(policy, "a").allowed  # a变为最近使用
+    bucket.check(policy, "c")
+
+    assert list(bucket.buckets) == ["a", "c"]
+    assert bucket.stats["evicted"] == 1
+    # 被淘汰的键重新开始计数
+    assert bucket.check(policy, "b").allowed
+    assert bucket.get_stats()["keys"] == 2
+
+
+def test_local_bucket_block_and_sweep(monkeypatch):
+    """测试封禁期内拒绝，清理时移除已补满的令牌桶和已到期的封禁"""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    bucket = LocalTokenBucket()
+    blocking = RateLimitPolicy(name="block", limit=1, window=60, block_seconds=900)
+    plain = RateLimitPolicy(name="plain", limit=10, window=60)
+
+    bucket.check(blocking, "a")
+    assert bucket.check(blocking, "a").retry_after == 900
+    bucket.check(plain, "b")
+    assert bucket.sweep() == 0
+
+    # b在6秒后补满，a的令牌桶60秒后补满，封禁900秒后到期
+    now[0] += 61
+    assert bucket.sweep() == 2
+    assert not bucket.check(blocking, "a").allowed
+    assert list(bucket.blocked_until) == ["a"]
+
+    now[0] += 900
+    assert bucket.sweep() == 1
+    assert bucket.get_stats()["blocked_keys"] == 0
+    assert bucket.check(blocking, "a").allowed
+    assert bucket.stats["sweeps"] == 3
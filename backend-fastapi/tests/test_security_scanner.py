@@ -0,0 +1,62 @@
+"""
+恶意模式扫描器测试
+"""
+import random
+
+from app.core.security_middleware import MALICIOUS_PATTERNS, MaliciousPatternScanner
+
+ALL_PATTERNS = [pattern for items in MALICIOUS_PATTERNS.values() for pattern in items]
+
+
+def naive_check(texts) -> bool:
+    """原来的逐段、逐模式检查"""
+    return any(pattern in text.lower() for text in texts for pattern in ALL_PATTERNS)
+
+
+def random_text(rng: random.Random) -> str:
+    """由普通字符和模式片段拼成的随机文本"""
+    parts = []
+    for _ in range(rng.randint(0, 6)):
+        choice = rng.random()
+        if choice < 0.15:
+            pattern = rng.choice(ALL_PATTERNS)
+            parts.append(pattern.upper() if rng.random() < 0.3 else pattern)
+        elif choice < 0.4:
+            # 模式的前半部分，接近命中但不完整
+            pattern = rng.choice(ALL_PATTERNS)
+            parts.append(pattern[:max(1, len(pattern) // 2)])
+        else:
+            parts.append("".join(rng.choice("abcdef0123456789.:/-_ %<>&|;x") for _ in range(rng.randint(1, 8))))
+    return "".join(parts)
+
+
+def test_scan_matches_per_string_check():
+    """测试合并扫描的结果与逐段检查一致，返回的模式确实出现在某段文本中"""
+    rng = random.Random(20240601)
+    scanner = MaliciousPatternScanner()
+    for _ in range(3000):
+        texts = [random_text(rng) for _ in range(rng.randint(1, 5))]
+        pattern = scanner.scan(texts)
+        assert (pattern is not None) == naive_check(texts), texts
+        if pattern is not None:
+            assert any(pattern in text.lower() for text in texts)
+
+
+def test_match_does_not_span_texts():
+    """测试模式不会跨越两段文本匹配"""
+    scanner = MaliciousPatternScanner()
+    assert scanner.scan(["a.", "./b"]) is None
+    assert scanner.scan(["x&", "&y"]) is None
+    assert scanner.scan(["a", "../b"]) == "../"
+
+
+def test_safe_values_are_skipped_before_joining():
+    """测试IP地址等只由安全字符组成的查询值在连接前逐个跳过"""
+    scanner = MaliciousPatternScanner()
+    assert scanner.scan(["/api/query", "ip", "8.8.8.8", "", "2001:db8::1"]) is None
+    assert scanner.stats == {"scanned": 4, "skipped": 2, "matched": 0}
+
+    assert scanner.find("1.1.1.1") is None
+    assert scanner.find("1.1.1.1--") == "--"
+    assert scanner.stats["skipped"] == 3
+    assert scanner.get_stats()["hits_by_category"] == {"sql_injection": 1}
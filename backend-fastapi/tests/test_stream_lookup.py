@@ -0,0 +1,51 @@
+"""
+流式批量查询输入解析测试
+"""
+import asyncio
+
+import pytest
+
+from app.services.stream_lookup import StreamInputError, iter_request_ips
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def parse(*chunks: bytes, **kwargs) -> list:
+    """解析分块内容，返回IP列表"""
+    async def collect():
+        return [ip async for ip in iter_request_ips(_chunks(*chunks), **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_plain_lines_split_across_chunks():
+    """测试跨分块的行、注释和空行"""
+    assert parse(b"8.8.8.8\n# comment\n\n1.1.", b"1.1\r\n9.9.9.9") == ["8.8.8.8", "1.1.1.1", "9.9.9.9"]
+
+
+def test_csv_header_selects_ip_column():
+    """测试CSV首行含ip列名时取该列，引号内的逗号不拆分字段"""
+    body = b'name,ip\n"Example, Inc.",8.8.8.8\n"x", "1.1.1.1"\n'
+    assert parse(body) == ["8.8.8.8", "1.1.1.1"]
+
+
+def test_line_length_limit_inside_chunk():
+    """测试完整落在一个分块内的超长行同样被拒绝"""
+    body = b"8.8.8.8\n" + b"1" * 64 + b"\n1.1.1.1\n"
+    with pytest.raises(StreamInputError):
+        parse(body, max_line_length=32)
+
+
+def test_line_length_limit_for_partial_line():
+    """测试尚未结束的超长行在缓冲时即被拒绝"""
+    with pytest.raises(StreamInputError):
+        parse(b"8.8.8.8\n" + b"1" * 64, b"\n", max_line_length=32)
+
+
+def test_max_ips_limit():
+    """测试IP数量上限"""
+    assert parse(b"1.1.1.1\n2.2.2.2\n", max_ips=2) == ["1.1.1.1", "2.2.2.2"]
+    with pytest.raises(StreamInputError):
+        parse(b"1.1.1.1\n2.2.2.2\n3.3.3.3", max_ips=2)